@@ -2,10 +2,14 @@
 import numpy as np
 import streamlit as st
 import os 
-import imageio 
 import tensorflow as tf 
-from utils import load_data, num_to_char
+from utils import load_data
+# utils puts the repository root on sys.path
+from previews import mp4_preview, gif_preview, ffmpeg_available
+from ctc_decoder import greedy_tokens
+from vocab import tokens_to_text
 from modelutil import load_model
+from manifest import ensure_manifest
 
 # Set the layout to the streamlit app as wide 
 st.set_page_config(layout='wide')
@@ -18,15 +22,17 @@ with st.sidebar:
 
 st.title('LipNet Full Stack App') 
 
-# Ensure data directory exists
+# Ensure data directory exists; the manifest lists its clips and is only
+# rescanned when a directory changed
 data_dir = os.path.join('..', 'data', 's1')
-if not os.path.exists(data_dir):
+manifest = ensure_manifest(os.path.join('..', 'data'))
+if manifest is None or not os.path.isdir(data_dir):
     st.error(f"Data directory not found: {data_dir}")
     st.info("Please make sure the data directory exists with video files")
     st.stop()
 
 # Generating a list of options or videos 
-options = os.listdir(data_dir)
+options = [os.path.basename(record['video']) for record in manifest.select('s1')]
 if not options:
     st.error("No video files found in the data directory")
     st.info(f"Please add video files to: {data_dir}")
@@ -44,16 +50,10 @@ if options:
         file_path = os.path.join('..', 'data', 's1', selected_video)
         
         # Check if ffmpeg command exists
-        if os.system('ffmpeg -version') == 0:
-            # Convert video to mp4 with proper settings
-            os.system(f'ffmpeg -i "{file_path}" -vcodec libx264 -pix_fmt yuv420p -preset ultrafast test_video.mp4 -y')
-
+        if ffmpeg_available():
             try:
-                # Rendering inside of the app
-                video = open('test_video.mp4', 'rb') 
-                video_bytes = video.read() 
-                st.video(video_bytes)
-                video.close()
+                # Convert video to mp4 once per file content and render it
+                st.video(mp4_preview(file_path))
             except Exception as e:
                 st.error(f"Error displaying video: {str(e)}")
         else:
@@ -74,9 +74,8 @@ if options:
             if video_np.shape[-1] == 1:
                 video_np = np.squeeze(video_np, axis=-1)
                 
-            # Save as GIF with proper settings
-            imageio.mimsave('animation.gif', video_np, fps=10)
-            st.image('animation.gif', width=400) 
+            # Encode as GIF in memory, once per file content
+            st.image(gif_preview(file_path, video_np, tag='lipnet-main'), width=400) 
 
             st.info('This is the output of the machine learning model as tokens')
             try:
@@ -89,10 +88,10 @@ if options:
                 yhat = model.predict(video_for_prediction)
                 
                 # Decode the prediction
-                decoder = tf.keras.backend.ctc_decode(yhat, input_length=tf.constant([75]), greedy=True)[0][0]
+                decoder = greedy_tokens(yhat)[0]
                 
                 # Convert numbers to characters
-                converted_prediction = tf.strings.reduce_join(num_to_char(decoder)).numpy().decode('utf-8')
+                converted_prediction = tokens_to_text(decoder)
                 
                 # Display the prediction
                 st.info('Decoded text from video:')
@@ -100,7 +99,7 @@ if options:
                 
                 # Display original annotations for comparison
                 st.info('Original annotations:')
-                original_text = tf.strings.reduce_join(num_to_char(annotations)).numpy().decode('utf-8')
+                original_text = tokens_to_text(annotations.numpy())
                 st.text(original_text)
                 
             except Exception as e:
@@ -2,8 +2,18 @@ import tensorflow as tf
 from typing import List
 import cv2
 import os
+import sys
 import numpy as np
 
+# The shared video loader lives at the repository root
+root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if root_dir not in sys.path:
+    sys.path.append(root_dir)
+import video
+from manifest import ensure_manifest
+
+decoder = video.get_decoder()
+
 # Define vocabulary
 vocab = [x for x in "abcdefghijklmnopqrstuvwxyz'?!123456789 "]
 
@@ -21,76 +31,12 @@ def load_video(path: str) -> List[float]:
     if not os.path.exists(path):
         raise FileNotFoundError(f"Video file not found: {path}")
     
-    # Open video
-    cap = cv2.VideoCapture(path)
-    if not cap.isOpened():
-        raise ValueError(f"Failed to open video: {path}")
-    
     try:
-        # Get video properties
-        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        
-        print(f"Video properties:")
-        print(f"Frame count: {frame_count}")
-        print(f"Resolution: {width}x{height}")
-        
-        frames = []
-        successful_frames = 0
+        # Crop, grayscale and normalize with the shared loader
+        crops = video.read_mouth_crops(path, color_code=cv2.COLOR_BGR2GRAY, decoder=decoder)
+        print(f"Successfully processed {len(crops)} frames")
         
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-                
-            try:
-                # Ensure frame is not None and has the correct shape
-                if frame is None:
-                    print(f"Warning: Skipping frame {successful_frames} (None frame)")
-                    continue
-                
-                if frame.size == 0:
-                    print(f"Warning: Skipping frame {successful_frames} (Empty frame)")
-                    continue
-                
-                # Convert BGR to RGB
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                
-                # Convert to float32 before creating tensor
-                frame_float = frame_rgb.astype(np.float32)
-                
-                # Create tensor
-                frame_tensor = tf.convert_to_tensor(frame_float)
-                
-                # Convert to grayscale
-                frame_gray = tf.image.rgb_to_grayscale(frame_tensor)
-                
-                # Ensure frame is large enough to crop
-                if frame_gray.shape[0] >= 236 and frame_gray.shape[1] >= 220:
-                    # Crop the region of interest
-                    cropped = frame_gray[190:236, 80:220, :]
-                    frames.append(cropped)
-                    successful_frames += 1
-                else:
-                    print(f"Warning: Frame {successful_frames} too small for cropping: {frame_gray.shape}")
-                
-            except Exception as e:
-                print(f"Warning: Error processing frame {successful_frames}: {str(e)}")
-                continue
-        
-        print(f"Successfully processed {successful_frames} frames")
-        
-        if not frames:
-            raise ValueError(f"No valid frames were read from video: {path}")
-        
-        # Stack frames
-        frames_tensor = tf.stack(frames)
-        
-        # Normalize
-        mean = tf.math.reduce_mean(frames_tensor)
-        std = tf.math.reduce_std(tf.cast(frames_tensor, tf.float32))
-        normalized_frames = tf.cast((frames_tensor - mean), tf.float32) / std
+        normalized_frames = tf.convert_to_tensor(video.normalize_crops(crops))
         
         print(f"Final tensor shape: {normalized_frames.shape}")
         return normalized_frames
@@ -98,9 +44,6 @@ def load_video(path: str) -> List[float]:
     except Exception as e:
         print(f"Error in load_video: {str(e)}")
         raise
-        
-    finally:
-        cap.release()
 
 def load_alignments(path: str) -> List[str]:
     """Load and process alignment files."""
@@ -137,12 +80,18 @@ def load_data(path: str):
             path = bytes.decode(path.numpy())
         
         # Get the file name
-        file_name = path.split('\\')[-1].split('.')[0]
+        file_name = os.path.splitext(path.replace('\\', '/').split('/')[-1])[0]
         print(f"Processing file: {file_name}")
         
-        # Construct paths
-        video_path = os.path.join('..', 'data', 's1', f'{file_name}.mpg')
-        alignment_path = os.path.join('..', 'data', 'alignments', 's1', f'{file_name}.align')
+        # Look the paths up in the data manifest
+        manifest = ensure_manifest(os.path.join('..', 'data'))
+        record = manifest.find(file_name, 's1') if manifest else None
+        if record is None:
+            raise FileNotFoundError(f"Video file not found in the data manifest: {file_name}")
+        video_path = manifest.video_path(record)
+        alignment_path = manifest.alignment_path(record)
+        if alignment_path is None:
+            raise FileNotFoundError(f"Alignment file not found for: {file_name}")
         
         print(f"Video path: {video_path}")
         print(f"Alignment path: {alignment_path}")
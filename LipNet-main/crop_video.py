@@ -2,6 +2,11 @@ import cv2
 import numpy as np
 import os
 import argparse
+import sys
+
+# The shared video decoders live at the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import video
 
 def select_crop_region(video_path):
     """
@@ -88,6 +93,7 @@ def crop_video(input_path, output_path, x1=0, y1=0, x2=0, y2=0):
     height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
     fps = cap.get(cv2.CAP_PROP_FPS)
     total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
 
     # Set default crop values if not provided
     if x1 == 0 and y1 == 0 and x2 == 0 and y2 == 0:
@@ -108,15 +114,9 @@ def crop_video(input_path, output_path, x1=0, y1=0, x2=0, y2=0):
     print(f"Total frames: {total_frames}")
     print(f"Crop region: ({x1}, {y1}) to ({x2}, {y2})")
 
+    # Decode only the crop window
     frame_count = 0
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        # Crop the frame
-        cropped_frame = frame[y1:y2, x1:x2]
-        
+    for cropped_frame in video.get_decoder().read(input_path, crop=(y1, y2, x1, x2)):
         # Write the cropped frame
         out.write(cropped_frame)
         
@@ -125,7 +125,6 @@ def crop_video(input_path, output_path, x1=0, y1=0, x2=0, y2=0):
             print(f"Processed {frame_count}/{total_frames} frames")
 
     # Release resources
-    cap.release()
     out.release()
     print(f"Video processing complete. Output saved to: {output_path}")
     return True
@@ -1,42 +1,51 @@
 import os 
+import json
+import tensorflow as tf
 from tensorflow.keras.models import Sequential 
 from tensorflow.keras.layers import Conv3D, LSTM, Dense, Dropout, Bidirectional, MaxPool3D, Activation, Reshape, SpatialDropout3D, BatchNormalization, TimeDistributed, Flatten
 
-def load_model() -> Sequential: 
-    model = Sequential()
+# Batch of normalized clips the serving network consumes
+INPUT_SIGNATURE = tf.TensorSpec(shape=(None, 75, 46, 140, 1), dtype=tf.float32)
 
-    model.add(Conv3D(128, 3, input_shape=(75,46,140,1), padding='same'))
-    model.add(Activation('relu'))
-    model.add(MaxPool3D((1,2,2)))
+# Get the base directory (LipNet-main)
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STUDENT_DIR = os.path.join(BASE_DIR, 'models', 'student')
 
-    model.add(Conv3D(256, 3, padding='same'))
-    model.add(Activation('relu'))
-    model.add(MaxPool3D((1,2,2)))
+def build_model(conv_filters=(128, 256, 75), lstm_units: int = 128) -> Sequential:
+    """The serving architecture; the defaults are the widths of ``models/checkpoint``."""
+    model = Sequential()
 
-    model.add(Conv3D(75, 3, padding='same'))
-    model.add(Activation('relu'))
-    model.add(MaxPool3D((1,2,2)))
+    for i, filters in enumerate(conv_filters):
+        if i == 0:
+            model.add(Conv3D(filters, 3, input_shape=(75,46,140,1), padding='same'))
+        else:
+            model.add(Conv3D(filters, 3, padding='same'))
+        model.add(Activation('relu'))
+        model.add(MaxPool3D((1,2,2)))
 
     model.add(TimeDistributed(Flatten()))
 
-    model.add(Bidirectional(LSTM(128, kernel_initializer='Orthogonal', return_sequences=True), name='bidirectional_1'))
+    model.add(Bidirectional(LSTM(lstm_units, kernel_initializer='Orthogonal', return_sequences=True), name='bidirectional_1'))
     model.add(Dropout(.5))
 
-    model.add(Bidirectional(LSTM(128, kernel_initializer='Orthogonal', return_sequences=True), name='bidirectional_2'))
+    model.add(Bidirectional(LSTM(lstm_units, kernel_initializer='Orthogonal', return_sequences=True), name='bidirectional_2'))
     model.add(Dropout(.5))
 
     model.add(Dense(41, kernel_initializer='he_normal', activation='softmax'))
+    return model
 
-    # Get the base directory (LipNet-main)
-    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    checkpoint_path = os.path.join(base_dir, 'models', 'checkpoint')
+def load_model(verbose: bool = False) -> Sequential: 
+    model = build_model()
+
+    checkpoint_path = os.path.join(BASE_DIR, 'models', 'checkpoint')
     
     print(f"Loading model from: {checkpoint_path}")
     if not os.path.exists(checkpoint_path):
         raise ValueError(f"Model checkpoint not found at: {checkpoint_path}")
     
     # Print model summary
-    model.summary()
+    if verbose:
+        model.summary()
     
     # Load weights
     try:
@@ -44,13 +53,48 @@ def load_model() -> Sequential:
         print("Model weights loaded successfully")
         
         # Verify weights were loaded
-        for layer in model.layers:
-            if layer.weights:
-                print(f"Layer {layer.name} has {len(layer.weights)} weights")
-                for w in layer.weights:
-                    print(f"  - {w.name}: shape={w.shape}")
+        if verbose:
+            for layer in model.layers:
+                if layer.weights:
+                    print(f"Layer {layer.name} has {len(layer.weights)} weights")
+                    for w in layer.weights:
+                        print(f"  - {w.name}: shape={w.shape}")
     except Exception as e:
         print(f"Error loading weights: {str(e)}")
         raise
 
-    return model
\ No newline at end of file
+    return model
+
+def load_student(student_dir: str = STUDENT_DIR) -> Sequential:
+    """Load a distilled student written by ``distill.py`` (widths from its config.json)."""
+    config_path = os.path.join(student_dir, 'config.json')
+    print(f"Loading student model from: {student_dir}")
+    if not os.path.exists(config_path):
+        raise ValueError(f"Student model not found at: {student_dir}")
+    with open(config_path, 'r') as f:
+        config = json.load(f)
+
+    model = build_model(config['conv_filters'], config['lstm_units'])
+    model.load_weights(os.path.join(student_dir, config['weights']))
+    print("Student weights loaded successfully")
+    return model
+
+def make_predict_fn(model: Sequential):
+    """Trace inference once for any batch of (75, 46, 140, 1) clips."""
+    @tf.function(input_signature=[INPUT_SIGNATURE])
+    def predict(frames):
+        return model(frames, training=False)
+    return predict
+
+def load_predictor(student: bool = None):
+    """Load the model, trace its prediction function and run a warm-up pass.
+
+    ``LIPNET_MODEL=student`` (or ``student=True``) serves the distilled student
+    from ``models/student`` instead of the full checkpoint.
+    """
+    if student is None:
+        student = os.environ.get('LIPNET_MODEL', 'checkpoint') == 'student'
+    model = load_student() if student else load_model()
+    predict = make_predict_fn(model)
+    predict(tf.zeros((1, 75, 46, 140, 1), dtype=tf.float32))
+    return model, predict
@@ -2,10 +2,15 @@
 import numpy as np
 import streamlit as st
 import os 
-import imageio 
 import tensorflow as tf 
-from utils import load_data, num_to_char
-from modelutil import load_model
+from utils import load_data
+# utils puts the repository root on sys.path
+from previews import mp4_preview, gif_preview, ffmpeg_available
+from ctc_decoder import greedy_tokens
+from vocab import tokens_to_text
+from manifest import ensure_manifest
+import tracing
+from modelutil import load_predictor
 
 # Set the layout to the streamlit app as wide 
 st.set_page_config(layout='wide')
@@ -18,12 +23,26 @@ with st.sidebar:
 
 st.title('LipNet Full Stack App') 
 
+# Build, load and warm up the model once per process; every rerun and
+# session reuses the same traced prediction function
+@st.cache_resource
+def get_predictor():
+    return load_predictor()
+
+try:
+    model, predict = get_predictor()
+    model_error = None
+except Exception as e:
+    predict, model_error = None, e
+
 # Get the base directory
 base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
-# Generating a list of options or videos 
+# Generating a list of options or videos from the data manifest, which only
+# rescans the directory when it changed
 video_dir = os.path.join(base_dir, 'data', 's1')
-options = os.listdir(video_dir)
+manifest = ensure_manifest(os.path.join(base_dir, 'data'))
+options = [os.path.basename(record['video']) for record in manifest.select('s1')] if manifest else []
 selected_video = st.selectbox('Choose video', options)
 
 # Generate two columns 
@@ -36,15 +55,18 @@ if options:
             st.info('The video below displays and the format is mpeg')
             file_path = os.path.join(video_dir, selected_video)
             
-            # Convert video to mp4 with proper settings
-            os.system(f'ffmpeg -i {file_path} -vcodec libx264 -pix_fmt yuv420p -preset ultrafast test_video.mp4 -y')
-
-            # Rendering inside of the app
-            video = open('test_video.mp4', 'rb') 
-            video_bytes = video.read() 
-            st.video(video_bytes)
+            # Check if ffmpeg command exists
+            if ffmpeg_available():
+                try:
+                    # Convert video to mp4 once per file content and render it
+                    st.video(mp4_preview(file_path))
+                except Exception as e:
+                    st.error(f"Error displaying video: {str(e)}")
+            else:
+                st.error("ffmpeg not found. Please install ffmpeg to convert videos.")
 
-        with col2: 
+        # One trace per prediction when LIPNET_TRACE is set
+        with col2, tracing.span('streamlit_prediction', clip=selected_video): 
             st.info('This is all the machine learning model sees when making a prediction')
             
             # Load and process video
@@ -63,15 +85,16 @@ if options:
                 if video_np.shape[-1] == 1:
                     video_np = np.squeeze(video_np, axis=-1)
                     
-                # Save as GIF with proper settings
-                imageio.mimsave('animation.gif', video_np, fps=10, quality=100)
-                st.image('animation.gif', width=400) 
+                # Encode as GIF in memory, once per file content
+                with tracing.span('gif_preview'):
+                    st.image(gif_preview(file_path, video_np, tag='app'), width=400) 
 
                 st.info('This is the output of the machine learning model as tokens')
                 
-                # Load model and make prediction
+                # Make prediction with the cached model
                 try:
-                    model = load_model()
+                    if predict is None:
+                        raise RuntimeError(f"Model failed to load: {model_error}")
                     
                     # Prepare video for prediction
                     video_for_prediction = tf.expand_dims(video, axis=0)
@@ -87,15 +110,17 @@ if options:
                             st.write(f"Adjusted shape: {video_for_prediction.shape}")
                     
                     # Get model prediction
-                    yhat = model.predict(video_for_prediction, verbose=0)
+                    with tracing.span('inference'):
+                        yhat = predict(video_for_prediction).numpy()
                     st.write(f"Prediction shape: {yhat.shape}")
                     
                     # Decode the prediction
-                    input_length = tf.ones(yhat.shape[0]) * yhat.shape[1]
-                    decoder = tf.keras.backend.ctc_decode(yhat, input_length, greedy=True)[0][0].numpy()
+                    with tracing.span('ctc_decode'):
+                        decoder = greedy_tokens(yhat)[0]
                     
                     # Convert numbers to characters
-                    converted_prediction = tf.strings.reduce_join(num_to_char(decoder)).numpy().decode('utf-8')
+                    with tracing.span('num_to_char'):
+                        converted_prediction = tokens_to_text(decoder)
                     
                     # Display the prediction
                     st.info('Parser text:')
@@ -107,7 +132,7 @@ if options:
                     
                     # Display text from video
                     st.info('Decoded Text from video:')
-                    original_text = tf.strings.reduce_join(num_to_char(annotations)).numpy().decode('utf-8')
+                    original_text = tokens_to_text(annotations.numpy())
                     st.text(original_text)
                     
                 except Exception as e:
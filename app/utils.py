@@ -2,12 +2,22 @@ import tensorflow as tf
 from typing import List
 import cv2
 import os 
+import sys
 import numpy as np
 
-# Define vocabulary and print it for debugging
-vocab = [x for x in "abcdefghijklmnopqrstuvwxyz'?!123456789 "]
-print("\nVocabulary:", vocab)
-print("Vocabulary size:", len(vocab))
+# The crop cache and video loader live at the repository root, next to the
+# training code
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if base_dir not in sys.path:
+    sys.path.append(base_dir)
+from crop_cache import CropCache, cache_enabled
+import video
+import tracing
+from label_index import alignment_label, alignment_text
+from manifest import ensure_manifest
+from vocab import VOCAB as vocab
+
+print("\nVocabulary size:", len(vocab))
 
 char_to_num = tf.keras.layers.StringLookup(vocabulary=vocab, oov_token="")
 # Mapping integers back to original characters
@@ -15,184 +25,62 @@ num_to_char = tf.keras.layers.StringLookup(
     vocabulary=char_to_num.get_vocabulary(), oov_token="", invert=True
 )
 
-# Print character to number mapping for debugging
-print("\nCharacter to number mapping:")
-for char in vocab:
-    num = char_to_num([char]).numpy()[0]
-    print(f"'{char}' -> {num}")
+# Preprocessing that produced the cached crops; part of the cache key
+decoder = video.get_decoder()
+CROP_PARAMS = video.crop_params(decoder, 'cv2.COLOR_BGR2GRAY')
+
+crop_cache = CropCache() if cache_enabled() else None
 
+def read_mouth_crops(path:str) -> np.ndarray:
+    """Decode a video into its uint8 (T, 46, 140) grayscale mouth crops."""
+    return video.read_mouth_crops(path, color_code=cv2.COLOR_BGR2GRAY, decoder=decoder)
+
+@tracing.traced()
 def load_video(path:str) -> List[float]: 
     print(f"Loading video from: {path}")
-    cap = cv2.VideoCapture(path)
-    if not cap.isOpened():
-        raise ValueError(f"Could not open video file: {path}")
-        
-    frames = []
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    
-    print(f"Video properties:")
-    print(f"- Total frames: {total_frames}")
-    print(f"- FPS: {fps}")
-    print(f"- Resolution: {width}x{height}")
-    
-    if total_frames == 0:
-        raise ValueError(f"Video file appears to be empty or corrupted: {path}")
-    
-    # Read all frames first
-    all_frames = []
-    frame_count = 0
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-            
-        try:
-            # Convert to grayscale
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            
-            # Check frame dimensions
-            if frame.shape[0] < 236 or frame.shape[1] < 220:
-                print(f"Warning: Frame {frame_count} too small ({frame.shape[0]}x{frame.shape[1]}), skipping")
-                continue
-                
-            # Crop the frame to focus on the mouth region
-            try:
-                cropped = frame[190:236, 80:220]
-            except IndexError as e:
-                print(f"Error cropping frame {frame_count}: {str(e)}")
-                print(f"Frame shape: {frame.shape}")
-                continue
-            
-            # Normalize the frame
-            normalized = cv2.normalize(cropped, None, 0, 255, cv2.NORM_MINMAX)
-            
-            # Convert to tensor format
-            frame_tensor = tf.convert_to_tensor(normalized, dtype=tf.float32)
-            frame_tensor = tf.expand_dims(frame_tensor, axis=-1)  # Add channel dimension
-            
-            all_frames.append(frame_tensor)
-            frame_count += 1
-            
-            if frame_count % 10 == 0:
-                print(f"Processed {frame_count} frames...")
-                
-        except Exception as e:
-            print(f"Error processing frame {frame_count}: {str(e)}")
-            continue
-    
-    cap.release()
-    
-    if not all_frames:
-        raise ValueError(f"No valid frames were processed from video: {path}")
-        
-    print(f"Successfully read {len(all_frames)} frames")
-    
-    # Now sample or pad to get exactly 75 frames
-    if len(all_frames) > 75:
-        # Sample evenly
-        indices = np.linspace(0, len(all_frames)-1, 75, dtype=int)
-        frames = [all_frames[i] for i in indices]
-        print(f"Sampled {len(frames)} frames from {len(all_frames)} original frames")
-    elif len(all_frames) < 75:
-        # Pad with last frame
-        frames = all_frames + [all_frames[-1]] * (75 - len(all_frames))
-        print(f"Padded {len(all_frames)} frames to {len(frames)} frames")
+    if crop_cache is not None:
+        crops = crop_cache.get_or_compute(path, CROP_PARAMS, read_mouth_crops)
+        print(f"Crop cache: {crop_cache.hits} hits, {crop_cache.misses} misses")
     else:
-        frames = all_frames
-        print("Using all frames (exactly 75)")
-    
-    print(f"Final frame count: {len(frames)}")
+        crops = read_mouth_crops(path)
+    print(f"Successfully read {len(crops)} frames")
     
-    # Stack frames and normalize
-    frames_tensor = tf.stack(frames)
-    mean = tf.math.reduce_mean(frames_tensor)
-    std = tf.math.reduce_std(tf.cast(frames_tensor, tf.float32))
-    normalized = tf.cast((frames_tensor - mean), tf.float32) / std
+    # Sample or pad to exactly 75 frames, then stretch each frame's contrast
+    # and normalize the clip
+    normalized = tf.convert_to_tensor(video.normalize_crops(video.fit_frames(crops, 75), stretch=True))
     
     print(f"Final tensor shape: {normalized.shape}")
-    print(f"Value range: min={tf.reduce_min(normalized)}, max={tf.reduce_max(normalized)}")
-    
     return normalized
     
+@tracing.traced()
 def load_alignments(path:str) -> List[str]: 
     print(f"Loading alignments from: {path}")
     if not os.path.exists(path):
         raise ValueError(f"Alignment file not found: {path}")
         
-    with open(path, 'r') as f: 
-        lines = f.readlines() 
-    
-    print("\nOriginal alignment lines:")
-    for line in lines:
-        print(line.strip())
-    
-    tokens = []
-    for line in lines:
-        line = line.split()
-        # Skip 'sil' and 'sp' tokens
-        if line[2] not in ['sil', 'sp']: 
-            # Add space before each word except the first one
-            if tokens:  # if not empty
-                tokens.append(' ')
-            tokens.append(line[2])
-    
-    print("\nProcessed tokens:", tokens)
-    
-    # Convert to tensor and get character indices
-    char_indices = char_to_num(tf.reshape(tf.strings.unicode_split(tokens, input_encoding='UTF-8'), (-1)))
-    
-    # Debug: Convert back to characters to verify
-    decoded = num_to_char(char_indices)
-    decoded_text = tf.strings.reduce_join(decoded).numpy().decode('utf-8')
-    print("\nDecoded text from indices:", decoded_text)
+    # Encoded once per corpus in the label index; 'sil' and 'sp' are already dropped
+    char_indices = tf.convert_to_tensor(alignment_label(path), dtype=tf.int64)
+    print("Alignment text:", alignment_text(path))
     
     return char_indices
 
+@tracing.traced()
 def load_data(path: str): 
     path = bytes.decode(path.numpy())
-    file_name = path.split('/')[-1].split('.')[0]
-    # File name splitting for windows
-    file_name = path.split('\\')[-1].split('.')[0]
-    
-    # Get the base directory (LipNet-main)
-    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    
-    # Try multiple video extensions
-    video_extensions = ['.mp4', '.mpeg', '.mpg', '.avi', '.mov']
-    video_path = None
-    
-    for ext in video_extensions:
-        temp_path = os.path.join(base_dir, 'data', 's1', f'{file_name}{ext}')
-        if os.path.exists(temp_path):
-            video_path = temp_path
-            break
-    
-    if video_path is None:
-        # If not found in s1 directory, try the root data directory
-        for ext in video_extensions:
-            temp_path = os.path.join(base_dir, 'data', f'{file_name}{ext}')
-            if os.path.exists(temp_path):
-                video_path = temp_path
-                break
-    
-    if video_path is None:
-        raise ValueError(f"Video file not found for {file_name} with extensions {video_extensions}")
-    
-    # Try to find alignment file in multiple locations
-    alignment_paths = [
-        os.path.join(base_dir, 'data', 'alignments', 's1', f'{file_name}.align'),
-        os.path.join(base_dir, 'data', 'alignments', f'{file_name}.align'),
-        os.path.join(base_dir, 'data', f'{file_name}.align')
-    ]
-    
-    alignment_path = None
-    for path in alignment_paths:
-        if os.path.exists(path):
-            alignment_path = path
-            break
+    # File name splitting for both Windows and POSIX paths
+    file_name = os.path.splitext(path.replace('\\', '/').split('/')[-1])[0]
+    
+    # The manifest knows every clip's video and alignment, so nothing is
+    # probed here; it prefers the path given, then s1, then the data root
+    manifest = ensure_manifest(os.path.join(base_dir, 'data'))
+    record = None
+    if manifest is not None:
+        record = manifest.lookup(path) or manifest.find(file_name, 's1') or manifest.find(file_name, '')
+    
+    if record is None:
+        raise ValueError(f"Video file not found for {file_name} in the data manifest")
+    video_path = manifest.video_path(record)
+    alignment_path = manifest.alignment_path(record)
     
     if alignment_path is None:
         print(f"Warning: No alignment file found for {file_name}. Using empty alignment.")
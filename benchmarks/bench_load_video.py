@@ -0,0 +1,173 @@
+"""Micro-benchmark of the shared video loader against the old load_video copies.
+
+Each implementation runs in a fresh process so their peak memory figures do
+not contaminate each other. Peak memory is reported twice: the growth of the
+process high-water mark (ru_maxrss) over one cold call, which also covers
+TensorFlow's allocator, and the tracemalloc peak of the Python/NumPy heap.
+
+Usage:
+    python benchmarks/bench_load_video.py
+    python benchmarks/bench_load_video.py data/s1/bbaf2n.mpg --repeats 20
+"""
+import os
+import sys
+import time
+import argparse
+import resource
+import statistics
+import tracemalloc
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.append(BASE_DIR)
+
+
+def legacy_root(path):
+    """The per-frame TF loader of utils.py and the notebook before the rewrite."""
+    import cv2
+    import tensorflow as tf
+    cap = cv2.VideoCapture(path)
+    frames = []
+    for _ in range(int(cap.get(cv2.CAP_PROP_FRAME_COUNT))):
+        ret, frame = cap.read()
+        frame = tf.image.rgb_to_grayscale(frame)
+        frames.append(frame[190:236, 80:220, :])
+    cap.release()
+    frames = tf.convert_to_tensor(frames)
+    mean = tf.math.reduce_mean(frames)
+    std = tf.math.reduce_std(tf.cast(frames, tf.float32))
+    return tf.cast((frames - mean), tf.float32) / std
+
+
+def legacy_app(path):
+    """The app/utils.py loader before the rewrite, without its debug output."""
+    import cv2
+    import numpy as np
+    import tensorflow as tf
+    cap = cv2.VideoCapture(path)
+    all_frames = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        normalized = cv2.normalize(frame[190:236, 80:220], None, 0, 255, cv2.NORM_MINMAX)
+        frame_tensor = tf.convert_to_tensor(normalized, dtype=tf.float32)
+        all_frames.append(tf.expand_dims(frame_tensor, axis=-1))
+    cap.release()
+    if len(all_frames) > 75:
+        indices = np.linspace(0, len(all_frames) - 1, 75, dtype=int)
+        frames = [all_frames[i] for i in indices]
+    else:
+        frames = all_frames + [all_frames[-1]] * (75 - len(all_frames))
+    frames_tensor = tf.stack(frames)
+    mean = tf.math.reduce_mean(frames_tensor)
+    std = tf.math.reduce_std(tf.cast(frames_tensor, tf.float32))
+    return tf.cast((frames_tensor - mean), tf.float32) / std
+
+
+def legacy_lipnet_main(path):
+    """The LipNet-main/app/utils.py loader: float32 RGB copy of every full frame."""
+    import cv2
+    import numpy as np
+    import tensorflow as tf
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        frame_gray = tf.image.rgb_to_grayscale(tf.convert_to_tensor(frame_rgb.astype(np.float32)))
+        frames.append(frame_gray[190:236, 80:220, :])
+    cap.release()
+    frames_tensor = tf.stack(frames)
+    mean = tf.math.reduce_mean(frames_tensor)
+    std = tf.math.reduce_std(tf.cast(frames_tensor, tf.float32))
+    return tf.cast((frames_tensor - mean), tf.float32) / std
+
+
+def shared_root(path):
+    import cv2
+    import video
+    return video.normalize_crops(video.read_mouth_crops(path, color_code=cv2.COLOR_RGB2GRAY))
+
+
+def shared_app(path):
+    import cv2
+    import video
+    crops = video.read_mouth_crops(path, color_code=cv2.COLOR_BGR2GRAY)
+    return video.normalize_crops(video.fit_frames(crops, 75), stretch=True)
+
+
+def shared_lipnet_main(path):
+    import cv2
+    import video
+    return video.normalize_crops(video.read_mouth_crops(path, color_code=cv2.COLOR_BGR2GRAY))
+
+
+IMPLEMENTATIONS = {
+    'legacy utils.py / notebook': legacy_root,
+    'shared utils.py / notebook': shared_root,
+    'legacy app/utils.py': legacy_app,
+    'shared app/utils.py': shared_app,
+    'legacy LipNet-main/app/utils.py': legacy_lipnet_main,
+    'shared LipNet-main/app/utils.py': shared_lipnet_main,
+}
+
+
+def measure(name: str, path: str, repeats: int) -> dict:
+    """Run one implementation in this (fresh) process and collect its numbers."""
+    import tensorflow as tf
+    fn = IMPLEMENTATIONS[name]
+
+    # Bring up the TF runtime first so its one-off setup is not billed to the loader
+    tf.reduce_sum(tf.zeros((4, 4)))
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    fn(path)
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_rss
+
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn(path)
+        timings.append(time.perf_counter() - start)
+
+    return {
+        'name': name,
+        'median_ms': statistics.median(timings) * 1000,
+        'min_ms': min(timings) * 1000,
+        'rss_growth_mib': rss_growth / 1024,
+        'traced_peak_mib': traced_peak / 1024 ** 2,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark load_video implementations')
+    parser.add_argument('video', nargs='?', default=os.path.join(BASE_DIR, 'data', 's1', 'bbaf2n.mpg'),
+                        help='Video to load')
+    parser.add_argument('--repeats', type=int, default=10, help='Timed calls per implementation')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.video):
+        print(f"Video not found: {args.video}")
+        return 1
+
+    print(f"Benchmarking load_video on {args.video} ({args.repeats} repeats)\n")
+    print(f"{'implementation':<34} {'median ms':>10} {'min ms':>10} {'RSS +MiB':>10} {'heap MiB':>10}")
+    context = multiprocessing.get_context('spawn')
+    for name in IMPLEMENTATIONS:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            result = executor.submit(measure, name, args.video, args.repeats).result()
+        print(f"{result['name']:<34} {result['median_ms']:>10.1f} {result['min_ms']:>10.1f} "
+              f"{result['rss_growth_mib']:>10.1f} {result['traced_peak_mib']:>10.2f}")
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,370 @@
+"""Benchmark suite for the load, model and decode hot paths on synthetic data.
+
+A small GRID-shaped corpus (``synthetic_grid``) is generated in a temporary
+directory laid out like ``data/``, so the suite runs on a fresh checkout
+without the dataset or trained weights. Every benchmark runs in its own
+spawned process, after one untimed warm-up call, so TensorFlow state and
+peak memory do not leak from one into the next:
+
+- ``load_video``, ``load_alignments``, ``load_data`` from ``utils`` (crop
+  cache off, so decoding is measured)
+- ``train_step``: one ``model.LipNet`` step with ``CTCLoss`` and Adam
+- ``forward/batch<N>``: the ``app/modelutil`` serving network, randomly
+  initialized (weights do not change the cost), at each ``--batch-sizes``
+- ``ctc_decode/greedy``: ``ctc_decoder.greedy_decode_batch``;
+  ``ctc_decode/tf_greedy``: ``ctc_decode`` and ``num_to_char`` joining, the
+  path it replaced; ``ctc_decode/beam8``: ``ctc_decoder.beam_search_batch``
+
+Results go to a JSON file with the host and library versions. ``--compare``
+checks the run against such a baseline and exits non-zero when any median is
+more than ``--threshold`` slower; ``compare`` does the same for two files.
+
+Usage:
+    python benchmarks/suite.py run --output benchmarks/baseline.json
+    python benchmarks/suite.py run --compare benchmarks/baseline.json
+    python benchmarks/suite.py run --only load_video ctc_decode/greedy --repeats 20
+    python benchmarks/suite.py compare benchmarks/baseline.json results.json --threshold 0.2
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.append(BASE_DIR)
+
+DEFAULT_BATCH_SIZES = (1, 4, 16)
+DEFAULT_THRESHOLD = 0.15
+
+
+def make_corpus(root: str, clips: int, seed: int = 0) -> list:
+    """Write ``clips`` synthetic clips under ``root/data``; returns their names."""
+    from synthetic_grid import make_clip
+
+    names = [f'syn{index:03d}' for index in range(clips)]
+    for index, name in enumerate(names):
+        make_clip(os.path.join(root, 'data', 's1', f'{name}.mpg'),
+                  os.path.join(root, 'data', 'alignments', 's1', f'{name}.align'), seed + index)
+    return names
+
+
+def cycle(items):
+    """A zero-argument callable returning the next of ``items`` on each call."""
+    state = {'index': 0}
+
+    def next_item():
+        item = items[state['index'] % len(items)]
+        state['index'] += 1
+        return item
+    return next_item
+
+
+# Each setup runs inside the benchmark process with the corpus as working
+# directory and returns the zero-argument callable to time.
+
+def setup_load_video(names, batch_size):
+    from utils import load_video
+    clip = cycle([os.path.join('data', 's1', f'{name}.mpg') for name in names])
+    return lambda: load_video(clip())
+
+
+def setup_load_alignments(names, batch_size):
+    from utils import load_alignments
+    alignment = cycle([os.path.join('data', 'alignments', 's1', f'{name}.align') for name in names])
+    return lambda: load_alignments(alignment())
+
+
+def setup_load_data(names, batch_size):
+    from utils import load_data
+    clip = cycle([f'{name}.mpg' for name in names])
+    return lambda: load_data(clip())
+
+
+def setup_train_step(names, batch_size):
+    import numpy as np
+    import tensorflow as tf
+    from model import LipNet, CTCLoss
+    from utils import char_to_num, load_data
+
+    samples = [load_data(f'{names[i % len(names)]}.mpg') for i in range(batch_size)]
+    frames = tf.stack([sample[0] for sample in samples])
+    width = max(int(sample[1].shape[0]) for sample in samples)
+    labels = np.zeros((batch_size, width), dtype=np.int64)
+    for row, (_, label) in enumerate(samples):
+        labels[row, :label.shape[0]] = label.numpy()
+    labels = tf.constant(labels)
+
+    model = LipNet(vocab_size=char_to_num.vocabulary_size())
+    optimizer = tf.keras.optimizers.Adam(learning_rate=0.0001)
+
+    @tf.function
+    def train_step(x, y):
+        with tf.GradientTape() as tape:
+            loss = tf.reduce_mean(CTCLoss(y, model(x, training=True)))
+        gradients = tape.gradient(loss, model.trainable_variables)
+        optimizer.apply_gradients(zip(gradients, model.trainable_variables))
+        return loss
+
+    return lambda: float(train_step(frames, labels))
+
+
+def setup_forward(names, batch_size):
+    import numpy as np
+    import tensorflow as tf
+    sys.path.append(os.path.join(BASE_DIR, 'app'))
+    from modelutil import build_model, make_predict_fn
+
+    predict = make_predict_fn(build_model())
+    rng = np.random.default_rng(0)
+    batch = tf.constant(rng.standard_normal((batch_size, 75, 46, 140, 1)).astype(np.float32))
+    return lambda: predict(batch).numpy()
+
+
+def random_outputs(batch_size: int, seed: int = 0):
+    from ctc_decoder import random_outputs
+
+    return random_outputs(batch_size, seed=seed)
+
+
+def setup_greedy_decode(names, batch_size):
+    from ctc_decoder import greedy_decode_batch
+
+    yhat = random_outputs(batch_size)
+    return lambda: greedy_decode_batch(yhat)
+
+
+def setup_tf_greedy_decode(names, batch_size):
+    import numpy as np
+    import tensorflow as tf
+    from utils import num_to_char
+
+    yhat = random_outputs(batch_size)
+    input_length = np.full(batch_size, yhat.shape[1])
+
+    def decode():
+        decoded = tf.keras.backend.ctc_decode(yhat, input_length, greedy=True)[0][0].numpy()
+        return [tf.strings.reduce_join(num_to_char(tokens[tokens >= 0])).numpy().decode('utf-8')
+                for tokens in decoded]
+    return decode
+
+
+def setup_beam_decode(names, batch_size):
+    from ctc_decoder import beam_search_batch
+
+    yhat = random_outputs(batch_size)
+    return lambda: beam_search_batch(yhat, beam_width=8)
+
+
+def benchmark_table(batch_sizes, train_batch_size: int, decode_batch_size: int) -> dict:
+    """Benchmark name -> ``(setup, batch size, repeats)``."""
+    table = {
+        'load_video': (setup_load_video, 1, 20),
+        'load_alignments': (setup_load_alignments, 1, 200),
+        'load_data': (setup_load_data, 1, 20),
+        'train_step': (setup_train_step, train_batch_size, 3),
+    }
+    for batch_size in batch_sizes:
+        table[f'forward/batch{batch_size}'] = (setup_forward, batch_size, 5)
+    table['ctc_decode/greedy'] = (setup_greedy_decode, decode_batch_size, 20)
+    table['ctc_decode/tf_greedy'] = (setup_tf_greedy_decode, decode_batch_size, 20)
+    table['ctc_decode/beam8'] = (setup_beam_decode, decode_batch_size, 5)
+    return table
+
+
+def measure(setup, corpus: str, names, batch_size: int, repeats: int, budget: float = None) -> dict:
+    """Warm up once, then time ``repeats`` calls; runs in a fresh process.
+
+    Timing stops early once ``budget`` seconds are spent and at least three
+    calls are in, so slow benchmarks on small hosts still finish.
+    """
+    # The crop cache would turn every load after the first into a .npy read
+    os.environ['LIPNET_CACHE'] = '0'
+    os.environ['LIPNET_TRACE'] = '0'
+    os.chdir(corpus)
+    fn = setup(names, batch_size)
+    fn()
+
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+        if budget and len(timings) >= 3 and sum(timings) > budget:
+            break
+    timings.sort()
+    return {
+        'batch_size': batch_size,
+        'repeats': len(timings),
+        'median_ms': statistics.median(timings) * 1000,
+        'min_ms': timings[0] * 1000,
+        'p90_ms': timings[min(len(timings) - 1, int(len(timings) * 0.9))] * 1000,
+    }
+
+
+def environment() -> dict:
+    """Host and library versions, so results are only compared like for like."""
+    import cv2
+    import numpy as np
+    import tensorflow as tf
+    import video
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit,
+        'host': platform.node(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'python': platform.python_version(),
+        'tensorflow': tf.__version__,
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'decoder': video.get_decoder().name,
+    }
+
+
+def run_suite(only=None, batch_sizes=DEFAULT_BATCH_SIZES, train_batch_size: int = 2, decode_batch_size: int = 16,
+              clips: int = 8, repeats: int = None, budget: float = 60.0) -> dict:
+    table = benchmark_table(batch_sizes, train_batch_size, decode_batch_size)
+    if only:
+        unknown = [name for name in only if name not in table]
+        if unknown:
+            raise ValueError(f"Unknown benchmarks {unknown}, choose from {list(table)}")
+        table = {name: table[name] for name in only}
+
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as corpus:
+        print(f"Generating {clips} synthetic clips in {corpus}")
+        names = make_corpus(corpus, clips)
+        print(f"\n{'benchmark':<22}{'batch':>6}{'median ms':>11}{'min ms':>10}{'p90 ms':>10}")
+        for name, (setup, batch_size, default_repeats) in table.items():
+            try:
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    result = executor.submit(measure, setup, corpus, names, batch_size,
+                                             repeats or default_repeats, budget).result()
+            except BrokenProcessPool:
+                # Typically the OOM killer on a large batch
+                result = {'batch_size': batch_size, 'error': 'benchmark process died'}
+            except Exception as e:
+                result = {'batch_size': batch_size, 'error': f"{type(e).__name__}: {e}"}
+            results[name] = result
+            if 'error' in result:
+                print(f"{name:<22}{batch_size:>6}  failed: {result['error']}")
+            else:
+                print(f"{name:<22}{batch_size:>6}{result['median_ms']:>11.2f}{result['min_ms']:>10.2f}"
+                      f"{result['p90_ms']:>10.2f}")
+    return {'environment': environment(), 'results': results}
+
+
+def compare(baseline: dict, current: dict, threshold: float = DEFAULT_THRESHOLD) -> list:
+    """Rows of ``(name, baseline ms, current ms, ratio, status)`` by median time.
+
+    ``status`` is ``regression`` when the current median is more than
+    ``threshold`` slower, ``faster`` when it is that much faster, otherwise
+    ``ok``; ``new``, ``missing`` and ``failed`` mark benchmarks without a pair.
+    """
+    rows = []
+    old, new = baseline['results'], current['results']
+    for name in list(old) + [name for name in new if name not in old]:
+        before, after = old.get(name, {}), new.get(name, {})
+        if name not in new:
+            rows.append((name, before.get('median_ms'), None, None, 'missing'))
+        elif 'error' in after:
+            rows.append((name, before.get('median_ms'), None, None, 'failed'))
+        elif name not in old or 'error' in before:
+            rows.append((name, None, after['median_ms'], None, 'new'))
+        else:
+            ratio = after['median_ms'] / before['median_ms']
+            status = 'regression' if ratio > 1 + threshold else 'faster' if ratio < 1 - threshold else 'ok'
+            rows.append((name, before['median_ms'], after['median_ms'], ratio, status))
+    return rows
+
+
+def print_comparison(rows, baseline: dict, current: dict) -> None:
+    keys = ('machine', 'cpus', 'tensorflow', 'decoder')
+    before = {key: baseline.get('environment', {}).get(key) for key in keys}
+    after = {key: current.get('environment', {}).get(key) for key in keys}
+    if before != after:
+        print(f"Warning: environments differ, baseline {before} vs current {after}")
+
+    print(f"\n{'benchmark':<22}{'baseline ms':>13}{'current ms':>12}{'ratio':>8}  status")
+    for name, old_ms, new_ms, ratio, status in rows:
+        old_text = f"{old_ms:.2f}" if old_ms is not None else '-'
+        new_text = f"{new_ms:.2f}" if new_ms is not None else '-'
+        ratio_text = f"{ratio:.2f}" if ratio is not None else '-'
+        print(f"{name:<22}{old_text:>13}{new_text:>12}{ratio_text:>8}  {status.upper() if status == 'regression' else status}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the load, model and decode hot paths on synthetic data')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='Run the suite')
+    run_parser.add_argument('--output', '-o', help='Write the results JSON here (e.g. a new baseline)')
+    run_parser.add_argument('--compare', help='Baseline JSON to check the results against')
+    run_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                            help='Relative median slowdown counted as a regression')
+    run_parser.add_argument('--only', nargs='+', help='Run only these benchmarks')
+    run_parser.add_argument('--batch-sizes', type=int, nargs='+', default=list(DEFAULT_BATCH_SIZES),
+                            help='Batch sizes of the forward-pass benchmarks')
+    run_parser.add_argument('--train-batch-size', type=int, default=2, help='Clips per training step')
+    run_parser.add_argument('--decode-batch-size', type=int, default=16, help='Clips per CTC decode')
+    run_parser.add_argument('--clips', type=int, default=8, help='Synthetic clips to generate')
+    run_parser.add_argument('--repeats', type=int, help='Timed calls per benchmark (default: per benchmark)')
+    run_parser.add_argument('--budget', type=float, default=60.0,
+                            help='Seconds of timed calls per benchmark before stopping early (after three calls)')
+
+    compare_parser = subparsers.add_parser('compare', help='Compare two result files')
+    compare_parser.add_argument('baseline', help='Baseline results JSON')
+    compare_parser.add_argument('current', help='Current results JSON')
+    compare_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                                help='Relative median slowdown counted as a regression')
+
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        with open(args.current, 'r') as f:
+            current = json.load(f)
+    else:
+        baseline = None
+        if args.compare:
+            with open(args.compare, 'r') as f:
+                baseline = json.load(f)
+        current = run_suite(args.only, args.batch_sizes, args.train_batch_size, args.decode_batch_size,
+                            args.clips, args.repeats, args.budget)
+        if args.output:
+            os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+            with open(args.output, 'w') as f:
+                json.dump(current, f, indent=2)
+            print(f"\nResults written to {args.output}")
+        if baseline is None:
+            return 1 if any('error' in result for result in current['results'].values()) else 0
+
+    rows = compare(baseline, current, args.threshold)
+    print_comparison(rows, baseline, current)
+    regressions = [row[0] for row in rows if row[4] in ('regression', 'failed')]
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    print(f"\nNo regressions beyond {args.threshold:.0%}")
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
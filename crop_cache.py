@@ -0,0 +1,243 @@
+"""Persistent on-disk cache of preprocessed mouth crops.
+
+Every entry is the uint8 ``(T, 46, 140)`` mouth-crop block of one video saved
+as a ``.npy`` file, so later epochs memory-map it back instead of decoding the
+MPEG again. Entries are keyed by the video's absolute path, size and mtime plus
+the preprocessing parameters of the loader that produced them, and the cache
+directory is trimmed least-recently-used first once it grows past its byte
+budget.
+
+Usage:
+    python crop_cache.py warm data/s1
+    python crop_cache.py warm data/s1 --loader app.utils
+    python crop_cache.py stats
+    python crop_cache.py clear
+"""
+import os
+import sys
+import json
+import glob
+import time
+import hashlib
+import argparse
+import importlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import tracing
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CACHE_DIR = os.environ.get('LIPNET_CACHE_DIR', os.path.join(BASE_DIR, '.cache', 'crops'))
+DEFAULT_MAX_BYTES = int(os.environ.get('LIPNET_CACHE_BYTES', 2 * 1024 ** 3))
+
+# Bump when the on-disk layout changes so stale entries are never read back.
+CACHE_VERSION = 1
+
+
+def cache_enabled() -> bool:
+    """Return False when the cache was switched off with LIPNET_CACHE=0."""
+    return os.environ.get('LIPNET_CACHE', '1') not in ('0', 'false', 'no')
+
+
+def cache_key(video_path: str, params: dict) -> str:
+    """Content address of a video's crops: path, size, mtime and parameters."""
+    stat = os.stat(video_path)
+    payload = json.dumps({
+        'path': os.path.abspath(video_path),
+        'size': stat.st_size,
+        'mtime': stat.st_mtime_ns,
+        'params': params,
+        'version': CACHE_VERSION,
+    }, sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def directory_size(root: str, suffix: str = '.npy') -> int:
+    """Total size in bytes of the cache entries below ``root``."""
+    total = 0
+    for entry in os.scandir(root):
+        if entry.is_file() and entry.name.endswith(suffix):
+            total += entry.stat().st_size
+    return total
+
+
+def evict_lru(root: str, max_bytes: int, suffix: str = '.npy') -> int:
+    """Delete the least recently used entries until ``root`` fits in ``max_bytes``.
+
+    Recency is the file mtime, which readers bump on every hit. Returns the
+    number of bytes that remain in the directory.
+    """
+    entries = []
+    total = 0
+    for entry in os.scandir(root):
+        if entry.is_file() and entry.name.endswith(suffix):
+            stat = entry.stat()
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+            total += stat.st_size
+
+    entries.sort()
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+    return total
+
+
+class CropCache:
+    """Byte-budgeted LRU cache of uint8 mouth crops, one ``.npy`` per video."""
+
+    def __init__(self, root: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._bytes = None
+        os.makedirs(root, exist_ok=True)
+
+    def entry_path(self, key: str) -> str:
+        return os.path.join(self.root, f'{key}.npy')
+
+    def get(self, video_path: str, params: dict):
+        """Return the memory-mapped crops of ``video_path`` or None on a miss."""
+        entry = self.entry_path(cache_key(video_path, params))
+        try:
+            crops = np.load(entry, mmap_mode='r')
+        except (FileNotFoundError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+        return crops
+
+    def put(self, video_path: str, params: dict, crops: np.ndarray) -> None:
+        """Store ``crops`` for ``video_path``, evicting old entries if needed."""
+        crops = np.ascontiguousarray(crops, dtype=np.uint8)
+        entry = self.entry_path(cache_key(video_path, params))
+
+        # Write to a private temp file first so concurrent readers never
+        # memory-map a half written array.
+        tmp_path = f'{entry}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, crops)
+        os.replace(tmp_path, entry)
+
+        if self._bytes is None:
+            self._bytes = directory_size(self.root)
+        else:
+            self._bytes += os.path.getsize(entry)
+        if self._bytes > self.max_bytes:
+            self._bytes = evict_lru(self.root, self.max_bytes)
+
+    def get_or_compute(self, video_path: str, params: dict, compute) -> np.ndarray:
+        """Return cached crops, running ``compute(video_path)`` on a miss."""
+        with tracing.span('cache_lookup') as span:
+            crops = self.get(video_path, params)
+            span.set(hit=crops is not None)
+        if crops is None:
+            crops = compute(video_path)
+            with tracing.span('cache_store'):
+                self.put(video_path, params, crops)
+        return crops
+
+    def stats(self) -> dict:
+        entries = [e for e in os.scandir(self.root) if e.name.endswith('.npy')]
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(entries),
+            'bytes': sum(e.stat().st_size for e in entries),
+            'max_bytes': self.max_bytes,
+        }
+
+    def clear(self) -> int:
+        removed = 0
+        for entry in os.scandir(self.root):
+            if entry.name.endswith('.npy') or entry.name.endswith('.tmp'):
+                os.remove(entry.path)
+                removed += 1
+        self._bytes = 0
+        return removed
+
+
+def warm(paths, loader_name: str = 'utils', workers: int = 4, cache: CropCache = None) -> dict:
+    """Fill the cache for ``paths`` using the crop function of ``loader_name``.
+
+    The loader module must expose ``read_mouth_crops(path)`` and ``CROP_PARAMS``,
+    which is the case for the root ``utils`` and for ``app.utils``.
+    """
+    if BASE_DIR not in sys.path:
+        sys.path.append(BASE_DIR)
+    loader = importlib.import_module(loader_name)
+    cache = cache or CropCache()
+
+    def warm_one(path):
+        cache.get_or_compute(path, loader.CROP_PARAMS, loader.read_mouth_crops)
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for i, _ in enumerate(executor.map(warm_one, paths), start=1):
+            if i % 100 == 0:
+                print(f"Warmed {i}/{len(paths)} videos...")
+
+    stats = cache.stats()
+    stats['elapsed'] = time.time() - start
+    return stats
+
+
+def collect_videos(inputs, extensions=('.mpg', '.mpeg', '.mp4', '.avi', '.mov')):
+    """Expand directories and glob patterns into a sorted list of video files."""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, files in os.walk(item):
+                paths.extend(os.path.join(root, f) for f in files if f.lower().endswith(extensions))
+        else:
+            paths.extend(glob.glob(item))
+    return sorted(set(paths))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the on-disk mouth-crop cache')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='Cache directory')
+    parser.add_argument('--max-bytes', type=int, default=DEFAULT_MAX_BYTES, help='Byte budget before LRU eviction')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    warm_parser = subparsers.add_parser('warm', help='Decode videos and store their crops')
+    warm_parser.add_argument('inputs', nargs='+', help='Video files, directories or glob patterns')
+    warm_parser.add_argument('--loader', default='utils', help='Module providing read_mouth_crops (utils or app.utils)')
+    warm_parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Decoding threads')
+
+    subparsers.add_parser('stats', help='Show cache size and entry count')
+    subparsers.add_parser('clear', help='Delete every cache entry')
+
+    args = parser.parse_args()
+    cache = CropCache(args.cache_dir, args.max_bytes)
+
+    if args.command == 'warm':
+        paths = collect_videos(args.inputs)
+        if not paths:
+            print(f"No videos found in: {' '.join(args.inputs)}")
+            return 1
+        stats = warm(paths, args.loader, args.workers, cache)
+        print(f"Warmed {len(paths)} videos in {stats['elapsed']:.1f}s "
+              f"({stats['hits']} hits, {stats['misses']} misses)")
+    elif args.command == 'stats':
+        stats = cache.stats()
+        print(f"Cache directory: {cache.root}")
+        print(f"Entries: {stats['entries']}")
+        print(f"Size: {stats['bytes'] / 1024 ** 2:.1f} MiB of {stats['max_bytes'] / 1024 ** 2:.1f} MiB")
+    elif args.command == 'clear':
+        print(f"Removed {cache.clear()} entries from {cache.root}")
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -1,103 +1,260 @@
+"""Crop videos to the model's 140x46 mouth window.
+
+A single file is cropped in place of the old one-off script. A directory is
+processed as a batch: every video under it is cropped on a process pool into
+the same layout under the output directory. Outputs newer than their input
+are skipped, each output is written to a temporary file and renamed when
+complete, and a JSON summary of frames and seconds per file is rewritten
+after every file. An interrupted batch therefore resumes where it stopped
+when run again.
+
+Usage:
+    python crop_video.py clip.mp4 -o clip_cropped.mp4
+    python crop_video.py data/s2 -o cropped/s2 --crop grid --workers 8
+    python crop_video.py new_speakers -o cropped --crop localize --summary cropped/summary.json
+"""
 import cv2
 import os
+import json
+import time
 import argparse
 import sys
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
+import video
+
+CROP_MODES = ('center', 'grid', 'localize')
+
 
 def get_video_dimensions(video_path):
     """Get video dimensions and frame count."""
     cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
         raise ValueError(f"Could not open video file: {video_path}")
-    
+
     width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
     fps = int(cap.get(cv2.CAP_PROP_FPS))
     frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
     cap.release()
-    
+
     return width, height, fps, frame_count
 
-def crop_video(input_path, output_path):
-    """Crop video to fixed dimensions."""
+def read_crops(input_path, width, height, crop='center'):
+    """Decode ``input_path`` into 140x46 BGR crops.
+
+    ``center`` takes the middle of the frame, ``grid`` the fixed GRID mouth
+    window and ``localize`` follows the mouth with ``mouth_roi``.
+    """
+    if crop == 'localize':
+        from mouth_roi import MouthLocalizer, default_detector
+        localizer = MouthLocalizer(default_detector())
+        return [localizer.process(frame) for frame in video.get_decoder().read(input_path)]
+    if crop == 'grid':
+        return video.get_decoder().read(input_path, crop=video.MOUTH_CROP)
+    x = (width - 140) // 2  # Center horizontally
+    y = (height - 46) // 2  # Center vertically
+    return video.get_decoder().read(input_path, crop=(y, y + 46, x, x + 140))
+
+def crop_video(input_path, output_path, crop='center', verbose=True):
+    """Crop video to fixed dimensions; returns the frame count."""
     # Get video dimensions
     width, height, fps, frame_count = get_video_dimensions(input_path)
-    print(f"\nVideo dimensions: {width}x{height}")
-    print(f"FPS: {fps}")
-    print(f"Total frames: {frame_count}")
-    
+    if verbose:
+        print(f"\nVideo dimensions: {width}x{height}")
+        print(f"FPS: {fps}")
+        print(f"Total frames: {frame_count}")
+
     # Fixed crop dimensions
-    x = (width - 140) // 2  # Center horizontally
-    y = (height - 46) // 2  # Center vertically
     w = 140  # Fixed width
     h = 46   # Fixed height
-    
-    print(f"\nCropping video to fixed dimensions: {w}x{h}")
-    
-    # Open video
-    cap = cv2.VideoCapture(input_path)
-    if not cap.isOpened():
-        raise ValueError(f"Could not open video file: {input_path}")
-    
+
+    if verbose:
+        print(f"\nCropping video to fixed dimensions: {w}x{h} ({crop} crop)")
+
+    # Decode only the crop window
+    frames = read_crops(input_path, width, height, crop)
+
     # Create output directory if it doesn't exist
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+
     # Create video writer
     fourcc = cv2.VideoWriter_fourcc(*'mp4v')
     out = cv2.VideoWriter(output_path, fourcc, fps, (w, h))
-    
-    # Process frames
+    if not out.isOpened():
+        raise ValueError(f"Could not open video writer for: {output_path}")
+
+    # Write frames
     frame_count = 0
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-            
-        # Crop frame
-        cropped = frame[y:y+h, x:x+w]
-        
-        # Write frame
+    for cropped in frames:
         out.write(cropped)
         frame_count += 1
-        
+
         # Print progress
-        if frame_count % 100 == 0:
+        if verbose and frame_count % 100 == 0:
             print(f"Processed {frame_count} frames...")
-    
+
     # Clean up
-    cap.release()
     out.release()
-    
-    print(f"\nVideo processing complete!")
-    print(f"Output saved to: {output_path}")
-    print(f"Final dimensions: {w}x{h}")
-    print(f"Total frames processed: {frame_count}")
+
+    if verbose:
+        print(f"\nVideo processing complete!")
+        print(f"Output saved to: {output_path}")
+        print(f"Final dimensions: {w}x{h}")
+        print(f"Total frames processed: {frame_count}")
+    return frame_count
+
+def output_path_for(input_path, input_root, output_root):
+    """Mirror ``input_path`` from ``input_root`` under ``output_root`` as an .mp4."""
+    relative = os.path.relpath(input_path, input_root)
+    return os.path.join(output_root, os.path.splitext(relative)[0] + '.mp4')
+
+def is_up_to_date(input_path, output_path):
+    """True when ``output_path`` exists, is not empty and is newer than its input."""
+    try:
+        output = os.stat(output_path)
+    except FileNotFoundError:
+        return False
+    return output.st_size > 0 and output.st_mtime >= os.stat(input_path).st_mtime
+
+def crop_job(input_path, output_path, crop):
+    """Crop one file for the batch pool; returns ``(frames, seconds, error)``."""
+    start = time.perf_counter()
+    # VideoWriter picks the container from the extension, so the partial file keeps it
+    base, ext = os.path.splitext(output_path)
+    partial = f"{base}.partial{ext}"
+    try:
+        frames = crop_video(input_path, partial, crop, verbose=False)
+        os.replace(partial, output_path)
+    except Exception as e:
+        if os.path.exists(partial):
+            os.remove(partial)
+        return 0, time.perf_counter() - start, str(e)
+    return frames, time.perf_counter() - start, None
+
+def write_summary(summary, path):
+    """Write the summary atomically, so an interrupted batch never leaves it half-written."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    files = summary['files'].values()
+    summary['totals'] = {
+        status: sum(1 for entry in files if entry['status'] == status) for status in ('cropped', 'skipped', 'failed')
+    }
+    summary['totals']['frames'] = sum(entry.get('frames', 0) for entry in files)
+    summary['totals']['seconds'] = round(sum(entry.get('seconds', 0.0) for entry in files), 3)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(summary, f, indent=2)
+    os.replace(tmp_path, path)
+
+def crop_tree(input_root, output_root, crop='center', workers=None, summary_path=None, force=False):
+    """Crop every video under ``input_root`` into ``output_root`` on a process pool.
+
+    Files whose output is up to date and was made with the same ``crop``
+    mode are skipped unless ``force`` is set; their earlier summary entries
+    are kept. Every entry records its crop mode. ``totals`` in the summary
+    covers every entry, earlier runs included; ``run`` counts only what this
+    call cropped, skipped and failed. Returns the summary dict.
+    """
+    from crop_cache import collect_videos
+
+    workers = workers or os.cpu_count() or 1
+    summary_path = summary_path or os.path.join(output_root, 'summary.json')
+    summary = {'input_root': input_root, 'output_root': output_root, 'crop': crop, 'files': {}}
+    if os.path.exists(summary_path):
+        with open(summary_path, 'r') as f:
+            previous_summary = json.load(f)
+        summary['files'] = previous_summary.get('files', {})
+        # Summaries written before entries carried their mode used one mode for the whole tree
+        for entry in summary['files'].values():
+            entry.setdefault('crop', previous_summary.get('crop'))
+
+    output_abs = os.path.abspath(output_root)
+    jobs = {}
+    up_to_date = 0
+    for input_path in collect_videos([input_root]):
+        # An output directory inside the input tree must not be cropped again
+        if os.path.abspath(input_path).startswith(output_abs + os.sep):
+            continue
+        relative = os.path.relpath(input_path, input_root)
+        output_path = output_path_for(input_path, input_root, output_root)
+        previous = summary['files'].get(relative, {})
+        # An output made with another crop mode (or an unknown one) is stale too
+        if not force and previous.get('crop') == crop and is_up_to_date(input_path, output_path):
+            up_to_date += 1
+            if previous.get('status') != 'cropped':
+                summary['files'][relative] = {'status': 'skipped', 'output': output_path, 'crop': crop}
+            continue
+        jobs[relative] = (input_path, output_path)
+
+    print(f"{len(jobs)} videos to crop, {up_to_date} up to date, {workers} workers")
+    summary['run'] = {'cropped': 0, 'skipped': up_to_date, 'failed': 0, 'frames': 0}
+    start = time.perf_counter()
+    frames_total = 0
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    with executor:
+        futures = {executor.submit(crop_job, input_path, output_path, crop): relative
+                   for relative, (input_path, output_path) in jobs.items()}
+        for done, future in enumerate(as_completed(futures), 1):
+            relative = futures[future]
+            frames, seconds, error = future.result()
+            entry = {'status': 'failed' if error else 'cropped', 'output': jobs[relative][1],
+                     'crop': crop, 'frames': frames, 'seconds': round(seconds, 3)}
+            if error:
+                entry['error'] = error
+                print(f"Error cropping {relative}: {error}")
+            summary['files'][relative] = entry
+            summary['run'][entry['status']] += 1
+            frames_total += frames
+            summary['run']['frames'] = frames_total
+            write_summary(summary, summary_path)
+            if done % 50 == 0 or done == len(jobs):
+                elapsed = time.perf_counter() - start
+                print(f"{done}/{len(jobs)} videos, {frames_total / elapsed:.0f} frames/sec")
+
+    summary['elapsed_seconds'] = round(time.perf_counter() - start, 3)
+    write_summary(summary, summary_path)
+    return summary
 
 def main():
     parser = argparse.ArgumentParser(description='Crop video to fixed dimensions (140x46)')
-    parser.add_argument('input', help='Input video file path')
-    parser.add_argument('--output', '-o', help='Output video file path')
-    
+    parser.add_argument('input', help='Input video file path, or a directory to crop every video under it')
+    parser.add_argument('--output', '-o', help='Output video file path (output directory for a batch)')
+    parser.add_argument('--crop', choices=CROP_MODES, default='center',
+                        help='Crop the frame center, the GRID mouth window, or follow the mouth (mouth_roi.py)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Batch worker processes')
+    parser.add_argument('--summary', help='Batch JSON summary path (default: <output>/summary.json)')
+    parser.add_argument('--force', action='store_true', help='Re-crop batch outputs even if they are up to date')
+
     args = parser.parse_args()
-    
+
     # Validate input file
     if not os.path.exists(args.input):
         raise FileNotFoundError(f"Input file not found: {args.input}")
-    
+
+    if os.path.isdir(args.input):
+        output_root = args.output or f"{args.input.rstrip(os.sep)}_cropped"
+        summary = crop_tree(args.input, output_root, args.crop, args.workers, args.summary, args.force)
+        run, totals = summary['run'], summary['totals']
+        print(f"\nCropped {run['cropped']}, skipped {run['skipped']}, failed {run['failed']} "
+              f"in {summary['elapsed_seconds']:.1f}s")
+        print(f"All runs: {totals['cropped']} cropped, {totals['skipped']} skipped, {totals['failed']} failed")
+        return 1 if run['failed'] else 0
+
     # Set default output path if not provided
     if not args.output:
         input_dir = os.path.dirname(args.input)
         input_filename = os.path.basename(args.input)
         name, ext = os.path.splitext(input_filename)
         args.output = os.path.join(input_dir, f"{name}_cropped{ext}")
-    
+
     try:
-        crop_video(args.input, args.output)
+        crop_video(args.input, args.output, args.crop)
     except Exception as e:
         print(f"Error: {str(e)}")
         return 1
-    
+
     return 0
 
 if __name__ == '__main__':
-    exit(main()) 
\ No newline at end of file
+    exit(main())
@@ -0,0 +1,404 @@
+"""CTC decoding: vectorized greedy decoding and prefix beam search with an
+optional lexicon or GRID grammar.
+
+``greedy_decode_batch`` decodes a whole ``(N, T, classes)`` batch with a
+handful of NumPy operations: argmax per frame, a mask that drops blanks and
+repeats, and ``vocab.CHAR_CODES`` to turn the kept tokens into text. It is
+what every greedy decode site uses instead of ``tf.keras.backend.ctc_decode``
+followed by ``num_to_char`` and ``tf.strings.reduce_join`` per sentence.
+
+``beam_search_batch`` advances a whole batch of clips together, scoring every
+extension of every beam in one NumPy operation per frame and only walking the
+top candidates in Python, which puts it on par with or ahead of the C++
+``tf.keras.backend.ctc_decode(greedy=False)`` without a TF session. A ``Grammar`` built from
+the alignment corpus restricts the beams to real words: ``lexicon`` allows
+any sequence of corpus words, ``grid`` only the words seen at each sentence
+position (command, color, preposition, letter, digit, adverb).
+
+Usage:
+    python ctc_decoder.py benchmark --clips 20 --beam-width 8
+    python ctc_decoder.py benchmark --outputs outputs.npz --beam-width 16
+    python ctc_decoder.py greedy-benchmark --batch-sizes 1 16 256
+"""
+import os
+import sys
+import glob
+import time
+import argparse
+
+import numpy as np
+
+from evaluation import error_rates, reference_text
+from label_index import ensure_label_index
+from vocab import BLANK, CHARS, CHAR_CODES, CHAR_TO_INDEX as TOKENS, NUM_CLASSES, SPACE
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def greedy_mask(probs: np.ndarray, lengths=None) -> tuple:
+    """Best class per frame and the frames greedy CTC keeps (not blank, not a repeat, within ``lengths``)."""
+    best = np.argmax(probs, axis=-1)
+    keep = best != BLANK
+    keep[:, 1:] &= best[:, 1:] != best[:, :-1]
+    if lengths is not None:
+        keep &= np.arange(best.shape[1]) < np.reshape(lengths, (-1, 1))
+    return best, keep
+
+
+def greedy_tokens(probs: np.ndarray, lengths=None) -> list:
+    """Greedy CTC token arrays of a ``(N, T, classes)`` batch, one per clip."""
+    best, keep = greedy_mask(np.asarray(probs), lengths)
+    return [row[mask] for row, mask in zip(best, keep)]
+
+
+def greedy_decode_batch(probs: np.ndarray, lengths=None) -> list:
+    """Greedy CTC transcripts of a ``(N, T, classes)`` batch; ``lengths`` gives the valid frames per clip.
+
+    Same output as ``tf.keras.backend.ctc_decode(greedy=True)`` joined with
+    ``num_to_char``: repeats merge before blanks are removed.
+    """
+    best, keep = greedy_mask(np.asarray(probs), lengths)
+    codes = np.where(keep, CHAR_CODES[best], 0)
+    return [row[row != 0].tobytes().decode('ascii') for row in codes]
+
+
+class TrieNode:
+    __slots__ = ('children', 'terminal', 'final', 'next_root', 'mask')
+
+    def __init__(self):
+        self.children = {}
+        self.terminal = False   # a word ends here
+        self.final = False      # ...and the sentence may end after it
+        self.next_root = None   # trie of the next word, entered with a space
+        self.mask = None        # tokens allowed after this node
+
+
+class Grammar:
+    """Word-level constraint on the decoded text: one word trie per sentence slot.
+
+    ``slots[i]`` is the set of words allowed at position ``i``; a sentence may
+    end after any slot in ``end_slots``. With ``loop=True`` there is a single
+    slot that repeats, i.e. any sequence of its words.
+    """
+
+    def __init__(self, slots, end_slots=None, loop: bool = False):
+        self.slots = [sorted(words) for words in slots]
+        end_slots = set(range(len(slots))) if end_slots is None else set(end_slots)
+        roots = [TrieNode() for _ in slots]
+        for index, (root, words) in enumerate(zip(roots, self.slots)):
+            next_root = root if loop else (roots[index + 1] if index + 1 < len(roots) else None)
+            for word in words:
+                node = root
+                for char in word:
+                    node = node.children.setdefault(TOKENS[char], TrieNode())
+                node.terminal = True
+                node.final = index in end_slots
+                node.next_root = next_root
+        self.root = roots[0]
+        self._build_masks(roots)
+
+    @staticmethod
+    def _build_masks(roots) -> None:
+        stack = list(roots)
+        seen = set()
+        while stack:
+            node = stack.pop()
+            if id(node) in seen:
+                continue
+            seen.add(id(node))
+            node.mask = np.zeros(NUM_CLASSES, dtype=bool)
+            node.mask[list(node.children)] = True
+            if node.terminal and node.next_root is not None:
+                node.mask[SPACE] = True
+            stack.extend(node.children.values())
+
+    @staticmethod
+    def load_sentences(alignment_dir: str = os.path.join(BASE_DIR, 'data', 'alignments')) -> list:
+        """Word lists of every ``.align`` file under ``alignment_dir``, skipping words outside VOCAB.
+
+        Reads the label index when ``alignment_dir`` is an indexed alignment root.
+        """
+        index = ensure_label_index(alignment_dir)
+        if index is not None and len(index):
+            texts = [index.text(key) for key in sorted(index.positions)]
+        else:
+            texts = [reference_text(path)
+                     for path in sorted(glob.glob(os.path.join(alignment_dir, '**', '*.align'), recursive=True))]
+        sentences = []
+        for words in (text.split() for text in texts):
+            if words and all(char in TOKENS for word in words for char in word):
+                sentences.append(words)
+        return sentences
+
+    @classmethod
+    def from_alignments(cls, mode: str = 'grid', alignment_dir: str = None) -> 'Grammar':
+        """Build a ``grid`` (words per position) or ``lexicon`` (any word order) grammar."""
+        sentences = cls.load_sentences(alignment_dir) if alignment_dir else cls.load_sentences()
+        if not sentences:
+            raise ValueError("No usable alignments to build the grammar from")
+        if mode == 'lexicon':
+            return cls([{word for words in sentences for word in words}], loop=True)
+        if mode != 'grid':
+            raise ValueError(f"Unknown grammar mode: {mode}")
+        slots = [set() for _ in range(max(len(words) for words in sentences))]
+        for words in sentences:
+            for index, word in enumerate(words):
+                slots[index].add(word)
+        return cls(slots, end_slots={len(words) - 1 for words in sentences})
+
+    def transition(self, node: TrieNode, token: int) -> TrieNode:
+        return node.next_root if token == SPACE else node.children[token]
+
+
+def beam_search_batch(probs: np.ndarray, beam_width: int = 8, grammar: Grammar = None,
+                      lengths=None, prune: float = 1e-4, blank_skip: float = 0.999) -> list:
+    """Prefix beam search over a ``(N, T, classes)`` batch of softmax outputs.
+
+    All clips advance one frame at a time together: beam scores and every
+    beam's extensions are computed as ``(N, beams, classes)`` arrays and only
+    the top ``beam_width`` extensions per clip are merged in Python.
+    Characters below ``prune`` at a frame do not extend beams there, and a
+    frame whose blank probability is at least ``blank_skip`` only updates the
+    existing beams, with no Python work. Scores are rescaled every frame so
+    long inputs do not underflow. ``lengths`` gives the valid frames per clip.
+    """
+    probs = np.asarray(probs, dtype=np.float64)
+    count, steps, classes = probs.shape
+    if lengths is not None:
+        # Frames past a clip's length become certain blanks, which leaves its beam ranking unchanged
+        probs = probs.copy()
+        padding = np.arange(steps)[np.newaxis, :] >= np.asarray(lengths)[:, np.newaxis]
+        probs[padding] = 0.0
+        probs[padding, BLANK] = 1.0
+
+    root = grammar.root if grammar else None
+    prefixes = [[()] for _ in range(count)]
+    states = [[root] for _ in range(count)]
+    p_blank = np.zeros((count, beam_width))
+    p_blank[:, 0] = 1.0
+    p_label = np.zeros((count, beam_width))
+    last = np.full((count, beam_width), -1)
+    allowed = np.ones(classes, dtype=bool)
+    allowed[[0, BLANK]] = False
+    masks = np.zeros((count, beam_width, classes), dtype=bool)
+    masks[:, 0] = root.mask if grammar else allowed
+    rows = np.arange(count)[:, np.newaxis]
+    tokens = np.arange(classes)
+
+    for t in range(steps):
+        y = probs[:, t]
+        total = p_blank + p_label
+        stay_blank = total * y[:, BLANK, np.newaxis]
+        # A repeated character without a blank in between collapses into the same prefix
+        stay_label = np.where(last >= 0, p_label * y[rows, np.maximum(last, 0)], 0.0)
+
+        # Extending with the last character needs a blank in between
+        base = np.where(tokens == last[..., np.newaxis], p_blank[..., np.newaxis], total[..., np.newaxis])
+        extend = base * y[:, np.newaxis, :]
+        extend *= masks & allowed & (y >= prune)[:, np.newaxis, :]
+        extend[y[:, BLANK] >= blank_skip] = 0.0
+        flat = extend.reshape(count, -1)
+        active = np.flatnonzero(flat.max(axis=1) > 0)
+
+        # Clips without extensions at this frame keep their beams as they are
+        p_blank, p_label = stay_blank, stay_label
+        if not len(active):
+            scale = (p_blank + p_label).max(axis=1, keepdims=True)
+            np.divide(p_blank, scale, out=p_blank, where=scale > 0)
+            np.divide(p_label, scale, out=p_label, where=scale > 0)
+            continue
+
+        top = np.argpartition(-flat, beam_width - 1, axis=1)[:, :beam_width]
+        # Python scalars from here on: indexing NumPy arrays one element at a time is slow
+        top_scores = np.take_along_axis(flat, top, axis=1).tolist()
+        top = top.tolist()
+        stay_blank, stay_label, last_tokens = stay_blank.tolist(), stay_label.tolist(), last.tolist()
+
+        for n in active.tolist():
+            beams = len(prefixes[n])
+            candidates = {prefix: [stay_blank[n][b], stay_label[n][b], last_tokens[n][b], states[n][b]]
+                          for b, prefix in enumerate(prefixes[n])}
+            for index, score in zip(top[n], top_scores[n]):
+                if score <= 0:
+                    continue
+                b, token = divmod(index, classes)
+                if b >= beams:
+                    continue
+                prefix = prefixes[n][b] + (token,)
+                entry = candidates.get(prefix)
+                if entry is None:
+                    state = grammar.transition(states[n][b], token) if grammar else None
+                    candidates[prefix] = [0.0, score, token, state]
+                else:
+                    entry[1] += score
+
+            ranked = sorted(candidates.items(), key=lambda item: item[1][0] + item[1][1], reverse=True)
+            ranked = ranked[:beam_width]
+            prefixes[n] = [prefix for prefix, _ in ranked]
+            states[n] = [entry[3] for _, entry in ranked]
+            kept = len(ranked)
+            p_blank[n, :kept] = [entry[0] for _, entry in ranked]
+            p_label[n, :kept] = [entry[1] for _, entry in ranked]
+            last[n, :kept] = [entry[2] for _, entry in ranked]
+            p_blank[n, kept:] = p_label[n, kept:] = 0.0
+            last[n, kept:] = -1
+            masks[n, kept:] = False
+            for b, state in enumerate(states[n]):
+                masks[n, b] = state.mask if grammar else allowed
+
+        scale = (p_blank + p_label).max(axis=1, keepdims=True)
+        np.divide(p_blank, scale, out=p_blank, where=scale > 0)
+        np.divide(p_label, scale, out=p_label, where=scale > 0)
+
+    texts = []
+    for n in range(count):
+        scores = p_blank[n] + p_label[n]
+        best = int(np.argmax(scores[:len(prefixes[n])]))
+        if grammar:
+            # Prefer beams that end on a complete sentence
+            complete = [b for b, state in enumerate(states[n]) if state.final]
+            if complete:
+                best = max(complete, key=lambda b: scores[b])
+        texts.append(''.join(CHARS[token] for token in prefixes[n][best]))
+    return texts
+
+
+def beam_search(probs: np.ndarray, beam_width: int = 8, grammar: Grammar = None, **kwargs) -> str:
+    """Decode a single ``(T, classes)`` output."""
+    return beam_search_batch(np.asarray(probs)[np.newaxis], beam_width, grammar, **kwargs)[0]
+
+
+def model_outputs(clips: int, batch_size: int = 4):
+    """Softmax outputs and reference transcripts for held-out clips."""
+    import tensorflow as tf
+    from export_model import held_out_split, load_clips
+    from pipeline import alignment_path_for
+
+    sys.path.append(os.path.join(BASE_DIR, 'app'))
+    from modelutil import load_predictor
+
+    _, val_files = held_out_split()
+    loaded = load_clips(val_files, clips)
+    _, predict = load_predictor()
+    outputs = []
+    for start in range(0, len(loaded), batch_size):
+        batch = np.stack([frames for _, frames in loaded[start:start + batch_size]])
+        outputs.append(predict(tf.constant(batch)).numpy())
+    references = [reference_text(alignment_path_for(path)) for path, _ in loaded]
+    return np.concatenate(outputs), references
+
+
+def benchmark(probs: np.ndarray, references, beam_width: int = 8) -> dict:
+    """Seconds per clip and CER/WER of the TF decoders and every NumPy decoder mode."""
+    import tensorflow as tf
+
+    def tf_decode(greedy):
+        input_length = np.full(len(probs), probs.shape[1])
+        decoded = tf.keras.backend.ctc_decode(probs, input_length, greedy=greedy, beam_width=beam_width)
+        return [''.join(CHARS[t] for t in tokens if 0 <= t < len(CHARS))
+                for tokens in decoded[0][0].numpy()]
+
+    decoders = {
+        'tf_greedy': lambda: tf_decode(True),
+        'numpy_greedy': lambda: greedy_decode_batch(probs),
+        'tf_beam': lambda: tf_decode(False),
+        'numpy_beam': lambda: beam_search_batch(probs, beam_width),
+    }
+    grammars = {}
+    for mode in ('lexicon', 'grid'):
+        try:
+            grammars[mode] = Grammar.from_alignments(mode)
+        except ValueError as e:
+            print(f"Skipping {mode} grammar: {e}", file=sys.stderr)
+    for mode, grammar in grammars.items():
+        decoders[f'numpy_beam_{mode}'] = lambda grammar=grammar: beam_search_batch(probs, beam_width, grammar)
+
+    results = {}
+    for name, decode in decoders.items():
+        decode()  # warm-up (graph tracing for the TF decoders)
+        start = time.perf_counter()
+        texts = decode()
+        elapsed = time.perf_counter() - start
+        results[name] = {'ms_per_clip': elapsed / len(probs) * 1000, **error_rates(zip(references, texts))}
+    return results
+
+
+def random_outputs(batch_size: int, frames: int = 75, seed: int = 0) -> np.ndarray:
+    """Peaked random softmax outputs shaped like the model's ``(N, 75, 41)``."""
+    rng = np.random.default_rng(seed)
+    logits = rng.standard_normal((batch_size, frames, NUM_CLASSES)) * 4.0
+    probs = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return (probs / probs.sum(axis=-1, keepdims=True)).astype(np.float32)
+
+
+def greedy_benchmark(batch_sizes, repeats: int = 20) -> dict:
+    """Milliseconds per batch of the TF greedy path and ``greedy_decode_batch`` on random outputs.
+
+    The TF path is the one the apps used: ``ctc_decode(greedy=True)``, then
+    ``num_to_char`` and ``reduce_join`` per sentence. Both must agree.
+    """
+    import tensorflow as tf
+    from utils import num_to_char
+
+    def tf_decode(probs):
+        input_length = np.full(len(probs), probs.shape[1])
+        decoded = tf.keras.backend.ctc_decode(probs, input_length, greedy=True)[0][0].numpy()
+        return [tf.strings.reduce_join(num_to_char(tokens[tokens >= 0])).numpy().decode('utf-8')
+                for tokens in decoded]
+
+    results = {}
+    for batch_size in batch_sizes:
+        probs = random_outputs(batch_size)
+        if tf_decode(probs) != greedy_decode_batch(probs):
+            raise AssertionError(f"NumPy and TF greedy decoding disagree at batch size {batch_size}")
+        row = {}
+        for name, decode in (('tf_greedy', tf_decode), ('numpy_greedy', greedy_decode_batch)):
+            times = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                decode(probs)
+                times.append(time.perf_counter() - start)
+            row[name] = sorted(times)[len(times) // 2] * 1000
+        results[batch_size] = row
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CTC decoding for GRID')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    bench_parser = subparsers.add_parser('benchmark', help='Compare speed and WER against the TF decoders')
+    bench_parser.add_argument('--clips', type=int, default=20, help='Held-out clips to run through the model')
+    bench_parser.add_argument('--outputs', help='.npz with saved "probs" and "references" (written if missing)')
+    bench_parser.add_argument('--beam-width', type=int, default=8, help='Beams kept per frame')
+    greedy_parser = subparsers.add_parser('greedy-benchmark',
+                                          help='Time NumPy greedy decoding against ctc_decode + num_to_char')
+    greedy_parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 16, 256], help='Clips per batch')
+    greedy_parser.add_argument('--repeats', type=int, default=20, help='Timed calls per batch size (median kept)')
+    args = parser.parse_args()
+
+    if args.command == 'greedy-benchmark':
+        results = greedy_benchmark(args.batch_sizes, args.repeats)
+        print(f"{'batch':>6}{'tf ms':>12}{'numpy ms':>12}{'speedup':>10}")
+        for batch_size, row in results.items():
+            print(f"{batch_size:>6}{row['tf_greedy']:>12.2f}{row['numpy_greedy']:>12.3f}"
+                  f"{row['tf_greedy'] / row['numpy_greedy']:>9.0f}x")
+        return 0
+
+    if args.outputs and os.path.exists(args.outputs):
+        saved = np.load(args.outputs)
+        probs, references = saved['probs'], list(saved['references'])
+    else:
+        probs, references = model_outputs(args.clips)
+        if args.outputs:
+            np.savez(args.outputs, probs=probs, references=np.array(references))
+
+    results = benchmark(probs, references, args.beam_width)
+    print(f"\n{len(probs)} clips, beam width {args.beam_width}")
+    print(f"{'decoder':<20}{'ms/clip':>10}{'CER':>8}{'WER':>8}")
+    for name, row in results.items():
+        print(f"{name:<20}{row['ms_per_clip']:>10.2f}{row['cer']:>8.3f}{row['wer']:>8.3f}")
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -54,7 +54,7 @@ def debug_video_processing(video_path):
         
         # Try model prediction
         print("\nLoading model...")
-        model = load_model()
+        model = load_model(verbose=True)
         
         # Prepare video for prediction
         video_for_prediction = tf.expand_dims(video, axis=0)
@@ -0,0 +1,294 @@
+"""Distil the serving model into a narrower student for CPU serving.
+
+``train`` fits a student built with ``app/modelutil.build_model`` (configurable
+Conv3D widths and LSTM size) to the per-frame softmax outputs of the
+``models/checkpoint`` teacher, mixed with the usual CTC loss on the
+alignments. Teacher outputs are computed once per clip and cached next to
+the student, so later epochs and reruns only run the student.
+
+``compare`` reports FLOPs, parameters, CPU latency and CER/WER of teacher and
+student on the ``train.py`` validation split. Serve the student with
+``LIPNET_MODEL=student``.
+
+Usage:
+    python distill.py train --conv-filters 32 64 96 --lstm-units 128 --epochs 20
+    python distill.py compare --eval-clips 20
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+import numpy as np
+import tensorflow as tf
+
+from evaluation import error_rates, reference_text
+from export_model import held_out_split, load_clips, decode
+from model import CTCLossWithLengths
+from pipeline import alignment_path_for, make_executor, parallel_map, MAX_FRAMES, MAX_LABEL_LENGTH
+from predict import prepare_clip
+from vocab import NUM_CLASSES
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BASE_DIR, 'app'))
+from modelutil import build_model, load_model, load_student, make_predict_fn, STUDENT_DIR  # noqa: E402
+
+WEIGHTS_FILE = 'student.weights.h5'
+TARGETS_FILE = 'teacher_targets.npz'
+
+
+def clip_key(path: str) -> str:
+    """Stable name for a clip inside the targets archive."""
+    return os.path.relpath(os.path.abspath(path), BASE_DIR).replace(os.sep, ':')
+
+
+def teacher_targets(paths, cache_path: str, batch_size: int = 4, workers: int = None) -> dict:
+    """Teacher softmax outputs ``(75, 41)`` per clip key, computed once and cached."""
+    targets = dict(np.load(cache_path)) if os.path.exists(cache_path) else {}
+    missing = [path for path in paths if clip_key(path) not in targets]
+    if not missing:
+        return targets
+
+    print(f"Computing teacher outputs for {len(missing)} clips")
+    teacher = make_predict_fn(load_model())
+    workers = workers or os.cpu_count() or 1
+    batch, keys = [], []
+    start = time.perf_counter()
+
+    def flush():
+        probabilities = teacher(tf.constant(np.stack(batch))).numpy()
+        targets.update(zip(keys, probabilities))
+        batch.clear()
+        keys.clear()
+
+    with make_executor('thread', workers) as executor:
+        for path, frames, error in parallel_map(executor, prepare_clip, missing, 2 * workers):
+            if error is not None:
+                print(f"Skipping {path}: {error}", file=sys.stderr)
+                continue
+            batch.append(frames)
+            keys.append(clip_key(path))
+            if len(batch) == batch_size:
+                flush()
+        if batch:
+            flush()
+    print(f"Teacher outputs done in {time.perf_counter() - start:.1f}s")
+
+    tmp_path = f'{cache_path}.tmp.npz'
+    np.savez(tmp_path, **targets)
+    os.replace(tmp_path, cache_path)
+    return targets
+
+
+def make_distill_dataset(paths, targets: dict, batch_size: int, executor, workers: int,
+                         seed: int = 0) -> tf.data.Dataset:
+    """Batches of ``(frames, label, label_length, teacher_probabilities)``, reshuffled every epoch.
+
+    Labels are zero-padded to ``MAX_LABEL_LENGTH``; ``label_length`` keeps the
+    true length so the padding is not scored as trailing tokens by the CTC loss.
+    """
+    from label_index import alignment_label
+
+    paths = [path for path in paths if clip_key(path) in targets]
+    rng = random.Random(seed)
+
+    def example(path):
+        path, frames, error = prepare_clip(path)
+        if error is not None:
+            return None
+        label = alignment_label(alignment_path_for(path)).astype(np.int64)
+        return frames, label, len(label), targets[clip_key(path)]
+
+    def generator():
+        order = list(paths)
+        rng.shuffle(order)
+        for result in parallel_map(executor, example, order, 2 * workers):
+            if result is not None:
+                yield result
+
+    dataset = tf.data.Dataset.from_generator(
+        generator,
+        output_signature=(
+            tf.TensorSpec(shape=(MAX_FRAMES, 46, 140, 1), dtype=tf.float32),
+            tf.TensorSpec(shape=(None,), dtype=tf.int64),
+            tf.TensorSpec(shape=(), dtype=tf.int64),
+            tf.TensorSpec(shape=(MAX_FRAMES, NUM_CLASSES), dtype=tf.float32),
+        ),
+    )
+    dataset = dataset.padded_batch(
+        batch_size, padded_shapes=([MAX_FRAMES, 46, 140, 1], [MAX_LABEL_LENGTH], [], [MAX_FRAMES, NUM_CLASSES])
+    )
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+def distillation_loss(teacher_probs, student_probs, temperature: float):
+    """Per-frame KL(teacher || student) at ``temperature``, scaled by T^2.
+
+    Both models end in a softmax, so the tempered distributions are rebuilt
+    from log-probabilities (``softmax(log p / T)`` equals ``softmax(z / T)``).
+    """
+    eps = 1e-8
+    teacher = tf.nn.softmax(tf.math.log(teacher_probs + eps) / temperature)
+    student_log = tf.nn.log_softmax(tf.math.log(student_probs + eps) / temperature)
+    kl = tf.reduce_sum(teacher * (tf.math.log(teacher + eps) - student_log), axis=-1)
+    return tf.reduce_mean(kl) * temperature ** 2
+
+
+def train_student(args) -> int:
+    os.makedirs(args.out_dir, exist_ok=True)
+    train_files, _ = held_out_split()
+    train_files = [path for path in train_files if os.path.exists(alignment_path_for(path))]
+    if args.limit:
+        train_files = train_files[:args.limit]
+    if not train_files:
+        print("No training clips with alignments found", file=sys.stderr)
+        return 1
+
+    targets = teacher_targets(train_files, os.path.join(args.out_dir, TARGETS_FILE),
+                              args.batch_size, args.workers)
+
+    student = build_model(args.conv_filters, args.lstm_units)
+    config = {'conv_filters': list(args.conv_filters), 'lstm_units': args.lstm_units, 'weights': WEIGHTS_FILE,
+              'alpha': args.alpha, 'temperature': args.temperature}
+    optimizer = tf.keras.optimizers.Adam(learning_rate=args.learning_rate)
+    alpha, temperature = args.alpha, args.temperature
+
+    @tf.function
+    def train_step(frames, labels, label_length, teacher_probs):
+        with tf.GradientTape() as tape:
+            student_probs = student(frames, training=True)
+            kd_loss = distillation_loss(teacher_probs, student_probs, temperature)
+            input_length = tf.fill(tf.shape(label_length), tf.shape(student_probs, out_type=tf.int64)[1])
+            ctc_loss = tf.reduce_mean(CTCLossWithLengths(labels, student_probs, input_length, label_length))
+            loss = alpha * kd_loss + (1 - alpha) * ctc_loss
+        gradients = tape.gradient(loss, student.trainable_variables)
+        optimizer.apply_gradients(zip(gradients, student.trainable_variables))
+        return kd_loss, ctc_loss
+
+    workers = args.workers or os.cpu_count() or 1
+    with make_executor('thread', workers) as executor:
+        dataset = make_distill_dataset(train_files, targets, args.batch_size, executor, workers)
+        for epoch in range(args.epochs):
+            kd_total = ctc_total = 0.0
+            clips = steps = 0
+            start = time.perf_counter()
+            for frames, labels, label_length, teacher_probs in dataset:
+                kd_loss, ctc_loss = train_step(frames, labels, label_length, teacher_probs)
+                kd_total += float(kd_loss)
+                ctc_total += float(ctc_loss)
+                clips += int(frames.shape[0])
+                steps += 1
+            elapsed = time.perf_counter() - start
+            print(f"Epoch {epoch + 1}/{args.epochs}: distillation {kd_total / max(steps, 1):.4f}, "
+                  f"ctc {ctc_total / max(steps, 1):.4f} ({clips / elapsed:.1f} clips/sec)")
+
+            student.save_weights(os.path.join(args.out_dir, WEIGHTS_FILE))
+            with open(os.path.join(args.out_dir, 'config.json'), 'w') as f:
+                json.dump(config, f, indent=2)
+
+    print(f"\nStudent saved to {args.out_dir}")
+    return 0
+
+
+def count_flops(model) -> int:
+    """Floating-point operations for one clip (2 per multiply-add, main layers only)."""
+    flops = 0
+    for layer in model.layers:
+        input_shape, output_shape = layer.input.shape, layer.output.shape
+        if isinstance(layer, tf.keras.layers.Conv3D):
+            kernel = int(np.prod(layer.kernel_size))
+            flops += 2 * kernel * input_shape[-1] * int(np.prod(output_shape[1:]))
+        elif isinstance(layer, tf.keras.layers.Bidirectional):
+            units = layer.forward_layer.units
+            steps, features = input_shape[1], input_shape[-1]
+            # Four gates per step and direction, each an input and a recurrent matmul
+            flops += 2 * steps * 2 * 4 * units * (features + units)
+        elif isinstance(layer, tf.keras.layers.Dense):
+            flops += 2 * int(np.prod(input_shape[1:-1])) * input_shape[-1] * layer.units
+    return flops
+
+
+def benchmark_model(model, clips, repeats: int = 1) -> dict:
+    """Batch-of-one CPU latency and CER/WER of ``model`` on ``clips``."""
+    predict = make_predict_fn(model)
+    predict(tf.constant(clips[0][1][np.newaxis]))
+    latencies = []
+    pairs = []
+    for path, frames in clips:
+        batch = tf.constant(frames[np.newaxis])
+        for _ in range(repeats):
+            start = time.perf_counter()
+            yhat = predict(batch).numpy()
+            latencies.append(time.perf_counter() - start)
+        pairs.append((reference_text(alignment_path_for(path)), decode(yhat)))
+    return {
+        'flops': count_flops(model),
+        'parameters': int(model.count_params()),
+        'latency_p50_ms': float(np.percentile(latencies, 50)) * 1000,
+        'latency_mean_ms': float(np.mean(latencies)) * 1000,
+        **error_rates(pairs),
+    }
+
+
+def compare_models(args) -> int:
+    _, val_files = held_out_split()
+    clips = load_clips(val_files, args.eval_clips)
+    if not clips:
+        print("No held-out clips with alignments to evaluate on", file=sys.stderr)
+        return 1
+
+    results = {}
+    for name, loader in (('teacher', load_model), ('student', lambda: load_student(args.student_dir))):
+        model = loader()
+        results[name] = benchmark_model(model, clips, args.repeats)
+        del model
+
+    print(f"\n{'model':<10}{'GFLOPs':>10}{'params':>12}{'p50 ms':>10}{'mean ms':>10}{'CER':>8}{'WER':>8}")
+    for name, row in results.items():
+        print(f"{name:<10}{row['flops'] / 1e9:>10.1f}{row['parameters']:>12,}{row['latency_p50_ms']:>10.1f}"
+              f"{row['latency_mean_ms']:>10.1f}{row['cer']:>8.3f}{row['wer']:>8.3f}")
+    teacher, student = results['teacher'], results['student']
+    print(f"\nStudent: {teacher['flops'] / student['flops']:.1f}x fewer FLOPs, "
+          f"{teacher['latency_p50_ms'] / student['latency_p50_ms']:.1f}x faster, "
+          f"CER {student['cer'] - teacher['cer']:+.3f}")
+
+    report_path = os.path.join(args.student_dir, 'comparison.json')
+    with open(report_path, 'w') as f:
+        json.dump({'eval_clips': len(clips), 'models': results}, f, indent=2)
+    print(f"Comparison written to {report_path}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Distil the LipNet serving model into a smaller student')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    train_parser = subparsers.add_parser('train', help='Train a student on the teacher outputs')
+    train_parser.add_argument('--out-dir', default=STUDENT_DIR, help='Directory for the student and teacher cache')
+    train_parser.add_argument('--conv-filters', type=int, nargs=3, default=[32, 64, 96],
+                              help='Filters of the three Conv3D layers')
+    train_parser.add_argument('--lstm-units', type=int, default=128, help='Units per LSTM direction')
+    train_parser.add_argument('--epochs', type=int, default=20, help='Number of training epochs')
+    train_parser.add_argument('--batch-size', type=int, default=4, help='Clips per batch')
+    train_parser.add_argument('--learning-rate', type=float, default=1e-4, help='Adam learning rate')
+    train_parser.add_argument('--alpha', type=float, default=0.9,
+                              help='Weight of the distillation loss; the CTC loss gets 1 - alpha')
+    train_parser.add_argument('--temperature', type=float, default=2.0, help='Softmax temperature for distillation')
+    train_parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Parallel decode workers')
+    train_parser.add_argument('--limit', type=int, help='Only use the first N training clips')
+
+    compare_parser = subparsers.add_parser('compare', help='Compare FLOPs, latency and CER of teacher and student')
+    compare_parser.add_argument('--student-dir', default=STUDENT_DIR, help='Directory written by distill.py train')
+    compare_parser.add_argument('--eval-clips', type=int, default=20, help='Held-out clips to evaluate on')
+    compare_parser.add_argument('--repeats', type=int, default=1, help='Timed runs per clip')
+
+    args = parser.parse_args()
+    if args.command == 'train':
+        return train_student(args)
+    return compare_models(args)
+
+
+if __name__ == '__main__':
+    exit(main())
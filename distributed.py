@@ -0,0 +1,239 @@
+"""Data-parallel LipNet training with MultiWorkerMirroredStrategy.
+
+Every worker is a separate process that reads its own slice of the clip list
+and trains a replica of the model; gradients are all-reduced after each step,
+so the global batch is the per-worker batch times the number of workers.
+Workers find each other through ``TF_CONFIG``. ``launch`` starts them as local
+processes on free ports, which is enough to measure scaling on one many-core
+machine; on several nodes set ``TF_CONFIG`` on each host and run
+``train.py --distributed`` directly.
+
+Usage:
+    python distributed.py launch --workers 4 -- --epochs 10 --batch-size 4
+    python distributed.py scaling --workers 1 2 4 --steps 20
+    python distributed.py scaling --workers 1 2 --data data/s1 --json scaling.json
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import subprocess
+import tempfile
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def tf_config(addresses, index: int) -> str:
+    """The ``TF_CONFIG`` of worker ``index`` in a cluster of ``addresses``."""
+    return json.dumps({'cluster': {'worker': list(addresses)}, 'task': {'type': 'worker', 'index': index}})
+
+
+def free_ports(count: int) -> list:
+    sockets = []
+    for _ in range(count):
+        sock = socket.socket()
+        sock.bind(('localhost', 0))
+        sockets.append(sock)
+    ports = [sock.getsockname()[1] for sock in sockets]
+    for sock in sockets:
+        sock.close()
+    return ports
+
+
+def task_index(strategy) -> int:
+    resolver = strategy.cluster_resolver
+    return resolver.task_id if resolver is not None and resolver.task_type else 0
+
+
+def is_chief(strategy) -> bool:
+    """Worker 0 writes checkpoints and reports; the others only train."""
+    return task_index(strategy) == 0
+
+
+def shard_files(files, index: int, count: int) -> list:
+    """Every ``count``-th file starting at ``index``, so shard sizes differ by at most one."""
+    return list(files)[index::count]
+
+
+def make_distributed_dataset(strategy, files, global_batch_size: int, shuffle: bool = True, seed: int = None,
+                             **dataset_kwargs):
+    """Distribute ``pipeline.make_dataset`` over the workers of ``strategy``.
+
+    Each worker builds a repeating dataset over its own shard of ``files``
+    with the per-replica batch size. Returns the distributed dataset, the
+    number of steps that make one pass over the smallest shard (every worker
+    must run the same number of steps, since each one joins an all-reduce)
+    and this worker's ``pipeline.FileOrder``.
+    """
+    from pipeline import FileOrder, make_dataset
+
+    files = list(files)
+    local_replicas = len(strategy.extended.worker_devices)
+    workers = strategy.num_replicas_in_sync // local_replicas
+    per_worker = global_batch_size // workers
+    steps = max(1, (len(files) // workers) // per_worker)
+    order = FileOrder(shard_files(files, task_index(strategy), workers), shuffle, seed)
+
+    def dataset_fn(input_context):
+        batch_size = input_context.get_per_replica_batch_size(global_batch_size)
+        return make_dataset(order, batch_size=batch_size, **dataset_kwargs).repeat()
+
+    return strategy.distribute_datasets_from_function(dataset_fn), steps, order
+
+
+def launch(num_workers: int, command, threads: int = None, log_dir: str = None) -> list:
+    """Run ``command`` as ``num_workers`` local workers and wait for all of them.
+
+    Every worker gets its own ``TF_CONFIG`` and ``threads`` intra-op threads
+    (by default the cores divided between the workers). Worker 0 writes to
+    this terminal; the others log to ``log_dir/worker-<i>.log``. Returns the
+    exit codes.
+    """
+    threads = threads or max(1, (os.cpu_count() or 1) // num_workers)
+    log_dir = log_dir or os.path.join(BASE_DIR, 'logs', 'distributed')
+    os.makedirs(log_dir, exist_ok=True)
+    addresses = [f'localhost:{port}' for port in free_ports(num_workers)]
+
+    processes, logs = [], []
+    for index in range(num_workers):
+        env = dict(os.environ, TF_CONFIG=tf_config(addresses, index),
+                   TF_NUM_INTRAOP_THREADS=str(threads), OMP_NUM_THREADS=str(threads))
+        output = None
+        if index > 0:
+            output = open(os.path.join(log_dir, f'worker-{index}.log'), 'w')
+            logs.append(output)
+        processes.append(subprocess.Popen(command, env=env, stdout=output, stderr=output, cwd=BASE_DIR))
+
+    try:
+        codes = [process.wait() for process in processes]
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        raise
+    finally:
+        for log in logs:
+            log.close()
+    return codes
+
+
+def benchmark_worker(steps: int, batch_size: int, data: str, output: str) -> None:
+    """Time ``steps`` distributed steps; runs inside every launched worker."""
+    import tensorflow as tf
+
+    strategy = tf.distribute.MultiWorkerMirroredStrategy()
+    from utils import char_to_num
+    from model import LipNet
+    from train_loop import make_train_step, synthetic_batches
+
+    global_batch = batch_size * strategy.num_replicas_in_sync
+    if data:
+        from crop_cache import collect_videos
+        dataset, _, _ = make_distributed_dataset(strategy, collect_videos([data]), global_batch)
+    else:
+        dataset = strategy.distribute_datasets_from_function(
+            lambda context: synthetic_batches(context.get_per_replica_batch_size(global_batch),
+                                              seed=context.input_pipeline_id))
+
+    with strategy.scope():
+        model = LipNet(vocab_size=char_to_num.vocabulary_size())
+        optimizer = tf.keras.optimizers.Adam(learning_rate=0.0001)
+    train_step = make_train_step(model, optimizer, strategy=strategy)
+
+    iterator = iter(dataset)
+    float(train_step(*next(iterator)))  # trace, build the optimizer and warm up the collectives
+    start = time.perf_counter()
+    for _ in range(steps):
+        float(train_step(*next(iterator)))
+    elapsed = time.perf_counter() - start
+
+    if is_chief(strategy) and output:
+        with open(output, 'w') as f:
+            json.dump({
+                'workers': strategy.num_replicas_in_sync,
+                'global_batch': global_batch,
+                'step_ms': elapsed / steps * 1000,
+                'clips_per_sec': global_batch * steps / elapsed,
+            }, f)
+
+
+def scaling(worker_counts, steps: int = 20, batch_size: int = 4, data: str = None, threads: int = None) -> list:
+    """Measure throughput at each worker count and the efficiency against the first.
+
+    Efficiency is the measured throughput over the first count's throughput
+    scaled linearly, so 1.0 means perfect scaling.
+    """
+    results = []
+    for count in worker_counts:
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'result.json')
+            command = [sys.executable, os.path.abspath(__file__), 'worker-benchmark', '--steps', str(steps),
+                       '--batch-size', str(batch_size), '--output', output]
+            if data:
+                command += ['--data', data]
+            codes = launch(count, command, threads)
+            if any(codes) or not os.path.exists(output):
+                results.append({'workers': count, 'error': f"exit codes {codes}"})
+                continue
+            with open(output, 'r') as f:
+                results.append(json.load(f))
+
+    base = next((row for row in results if 'error' not in row), None)
+    for row in results:
+        if base and 'error' not in row:
+            ideal = base['clips_per_sec'] * row['workers'] / base['workers']
+            row['efficiency'] = row['clips_per_sec'] / ideal
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Data-parallel LipNet training on local worker processes')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    launch_parser = subparsers.add_parser('launch', help='Run train.py --distributed on local workers')
+    launch_parser.add_argument('--workers', type=int, default=2, help='Number of worker processes')
+    launch_parser.add_argument('--threads', type=int, help='Intra-op threads per worker (default: cores / workers)')
+    launch_parser.add_argument('train_args', nargs=argparse.REMAINDER, help='Arguments for train.py, after --')
+
+    scaling_parser = subparsers.add_parser('scaling', help='Throughput and scaling efficiency per worker count')
+    scaling_parser.add_argument('--workers', type=int, nargs='+', default=[1, 2], help='Worker counts to run')
+    scaling_parser.add_argument('--steps', type=int, default=20, help='Timed steps per run (after one warm-up)')
+    scaling_parser.add_argument('--batch-size', type=int, default=4, help='Clips per worker per step')
+    scaling_parser.add_argument('--data', help='Directory of clips to train on (default: synthetic batches)')
+    scaling_parser.add_argument('--threads', type=int, help='Intra-op threads per worker (default: cores / workers)')
+    scaling_parser.add_argument('--json', help='Also write the results to this file')
+
+    worker_parser = subparsers.add_parser('worker-benchmark', help=argparse.SUPPRESS)
+    worker_parser.add_argument('--steps', type=int, required=True)
+    worker_parser.add_argument('--batch-size', type=int, required=True)
+    worker_parser.add_argument('--data')
+    worker_parser.add_argument('--output')
+    args = parser.parse_args()
+
+    if args.command == 'launch':
+        train_args = args.train_args[1:] if args.train_args[:1] == ['--'] else args.train_args
+        codes = launch(args.workers, [sys.executable, os.path.join(BASE_DIR, 'train.py'), '--distributed'] + train_args,
+                       args.threads)
+        return max(codes, key=abs)
+
+    if args.command == 'worker-benchmark':
+        benchmark_worker(args.steps, args.batch_size, args.data, args.output)
+        return 0
+
+    results = scaling(args.workers, args.steps, args.batch_size, args.data, args.threads)
+    print(f"\n{'workers':>8}{'global batch':>14}{'ms/step':>10}{'clips/s':>10}{'efficiency':>12}")
+    for row in results:
+        if 'error' in row:
+            print(f"{row['workers']:>8}  failed: {row['error']}")
+            continue
+        print(f"{row['workers']:>8}{row['global_batch']:>14}{row['step_ms']:>10.0f}{row['clips_per_sec']:>10.2f}"
+              f"{row['efficiency']:>12.2f}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
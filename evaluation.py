@@ -0,0 +1,43 @@
+"""Character and word error rates for transcripts.
+
+CER and WER are corpus-level: the edit distances of every clip are summed and
+divided by the total reference length, so short clips do not dominate.
+"""
+from typing import Iterable, Sequence, Tuple
+
+from label_index import alignment_text
+
+
+def edit_distance(reference: Sequence, hypothesis: Sequence) -> int:
+    """Levenshtein distance between two sequences (characters or words)."""
+    if len(reference) < len(hypothesis):
+        reference, hypothesis = hypothesis, reference
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_item in enumerate(reference, 1):
+        current = [i]
+        for j, hyp_item in enumerate(hypothesis, 1):
+            current.append(min(previous[j] + 1,
+                               current[j - 1] + 1,
+                               previous[j - 1] + (ref_item != hyp_item)))
+        previous = current
+    return previous[-1]
+
+
+def reference_text(alignment_path: str) -> str:
+    """Transcript of a GRID ``.align`` file without the ``sil``/``sp`` tokens."""
+    return alignment_text(alignment_path)
+
+
+def error_rates(pairs: Iterable[Tuple[str, str]]) -> dict:
+    """Corpus CER and WER over ``(reference, hypothesis)`` pairs."""
+    char_errors = char_total = word_errors = word_total = 0
+    for reference, hypothesis in pairs:
+        reference, hypothesis = reference.strip(), hypothesis.strip()
+        char_errors += edit_distance(reference, hypothesis)
+        char_total += len(reference)
+        word_errors += edit_distance(reference.split(), hypothesis.split())
+        word_total += len(reference.split())
+    return {
+        'cer': char_errors / char_total if char_total else 0.0,
+        'wer': word_errors / word_total if word_total else 0.0,
+    }
@@ -0,0 +1,348 @@
+"""Export the serving model to SavedModel and TFLite and compare the variants.
+
+Builds ``app/modelutil.load_model`` from ``models/checkpoint`` once and writes:
+
+    <out-dir>/saved_model/           SavedModel, ``serving_default`` takes (None, 75, 46, 140, 1) float32
+    <out-dir>/lipnet_float.tflite    float32 TFLite
+    <out-dir>/lipnet_dynamic.tflite  dynamic-range quantized (int8 weights, float activations)
+    <out-dir>/lipnet_int8.tflite     int8 quantized, calibrated on training clips
+    <out-dir>/report.json            size, CPU latency and CER/WER of every variant
+
+The int8 model keeps float32 input and output and may leave ops without an
+int8 kernel in float. When calibration fails anyway (the TFLite calibrator
+can crash natively on the Conv3D layers followed by the LSTMs), it is built
+with float16 weights instead and the report marks it as ``float16``.
+
+The TFLite models take one ``(1, 75, 46, 140, 1)`` clip and use builtin ops
+only, so they run without the Flex delegate.
+
+Held-out clips are the validation split ``train.py`` uses for ``data/s1``
+unless ``--clips`` is given; calibration clips come from the training split.
+
+Usage:
+    python export_model.py --out-dir exports
+    python export_model.py --out-dir exports --clips "data/s1/bb*.mpg" --eval-clips 50
+    python export_model.py --out-dir exports --variants saved_model tflite_dynamic
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import multiprocessing
+
+import numpy as np
+import tensorflow as tf
+
+import video
+from crop_cache import collect_videos
+from evaluation import error_rates, reference_text
+from manifest import ensure_manifest
+from pipeline import alignment_path_for
+from predict import prepare_clip
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+VARIANTS = ('saved_model', 'tflite_float', 'tflite_dynamic', 'tflite_int8')
+# Built in place of tflite_int8 when full-integer calibration fails
+INT8_FALLBACK = 'tflite_float16'
+CLIP_SHAPE = (1, video.NUM_FRAMES, 46, 140, 1)
+
+
+def held_out_split(data_dir: str = os.path.join('data', 's1'), val_fraction: float = 0.2):
+    """Train and validation clip lists, split the same way as ``train.py``."""
+    data_root, speaker = os.path.split(os.path.normpath(data_dir))
+    manifest = ensure_manifest(data_root)
+    data_files = manifest.video_paths(speaker, extensions=('.mpg',)) if manifest else []
+    random.Random(0).shuffle(data_files)
+    val_size = int(len(data_files) * val_fraction)
+    return data_files[val_size:], data_files[:val_size]
+
+
+def load_clips(paths, limit: int) -> list:
+    """Preprocess up to ``limit`` clips that have alignments, as ``(path, frames)``."""
+    clips = []
+    for path in paths:
+        if len(clips) >= limit:
+            break
+        if not os.path.exists(alignment_path_for(path)):
+            continue
+        path, frames, error = prepare_clip(path)
+        if error is not None:
+            print(f"Skipping {path}: {error}", file=sys.stderr)
+            continue
+        clips.append((path, frames))
+    return clips
+
+
+def export_saved_model(model, out_dir: str) -> str:
+    """Save ``model`` with a batch-polymorphic ``serving_default`` signature."""
+    sys.path.append(os.path.join(BASE_DIR, 'app'))
+    from modelutil import INPUT_SIGNATURE
+
+    module = tf.Module()
+    module.model = model
+
+    @tf.function(input_signature=[INPUT_SIGNATURE])
+    def serve(frames):
+        return {'probabilities': model(frames, training=False)}
+
+    module.serve = serve
+    path = os.path.join(out_dir, 'saved_model')
+    tf.saved_model.save(module, path, signatures={'serving_default': serve})
+    return path
+
+
+def tflite_forward(model):
+    """Batch-of-one forward pass of ``model`` built only from TFLite builtin ops.
+
+    The LSTMs are unrolled over the 75 frames (their ``while`` loops read
+    resource variables the converter cannot freeze) and each ``(1, 2, 2)``
+    MaxPool3D runs as a 2D pool over the frames folded into the batch, which
+    is the same computation without the Flex-only MaxPool3D op.
+    """
+    config = model.get_config()
+    for layer_config in config['layers']:
+        if layer_config['class_name'] == 'Bidirectional':
+            layer_config['config']['layer']['config']['unroll'] = True
+    clone = tf.keras.Sequential.from_config(config)
+    clone.set_weights(model.get_weights())
+
+    @tf.function(input_signature=[tf.TensorSpec(CLIP_SHAPE, tf.float32)])
+    def forward(frames):
+        x = frames
+        for layer in clone.layers:
+            if isinstance(layer, tf.keras.layers.MaxPool3D) and layer.pool_size[0] == 1:
+                batch, steps, height, width, channels = x.shape
+                x = tf.reshape(x, (batch * steps, height, width, channels))
+                x = tf.nn.max_pool2d(x, layer.pool_size[1:], layer.strides[1:], layer.padding.upper())
+                x = tf.reshape(x, (batch, steps, *x.shape[1:]))
+            else:
+                x = layer(x, training=False)
+        return x
+
+    return forward
+
+
+def convert_tflite(model, variant: str, calibration=None) -> bytes:
+    """Convert ``model`` to a TFLite flatbuffer for ``variant``."""
+    # No trackable object: with one the converter keeps the weights as resource variables
+    forward = tflite_forward(model)
+    converter = tf.lite.TFLiteConverter.from_concrete_functions([forward.get_concrete_function()])
+    if variant == 'tflite_dynamic':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    elif variant == 'tflite_int8':
+        if not calibration:
+            raise ValueError("int8 quantization needs calibration clips")
+
+        def representative_dataset():
+            for _, frames in calibration:
+                yield [frames[np.newaxis].astype(np.float32)]
+
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        # Ops without an int8 kernel stay float; the model's I/O stays float32
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8,
+                                               tf.lite.OpsSet.TFLITE_BUILTINS]
+    elif variant == INT8_FALLBACK:
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    return converter.convert()
+
+
+def _convert_worker(variant: str, path: str, calibration_paths) -> None:
+    sys.path.append(os.path.join(BASE_DIR, 'app'))
+    from modelutil import load_model
+
+    calibration = load_clips(calibration_paths, len(calibration_paths)) if variant == 'tflite_int8' else None
+    flatbuffer = convert_tflite(load_model(), variant, calibration)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(flatbuffer)
+    os.replace(tmp_path, path)
+
+
+def _run_conversion(variant: str, path: str, calibration_paths) -> None:
+    process = multiprocessing.get_context('spawn').Process(
+        target=_convert_worker, args=(variant, path, list(calibration_paths)))
+    process.start()
+    process.join()
+    if process.exitcode < 0:
+        raise RuntimeError(f"TFLite converter crashed (signal {-process.exitcode})")
+    if process.exitcode != 0:
+        raise RuntimeError(f"TFLite conversion exited with code {process.exitcode}")
+
+
+def export_tflite(variant: str, path: str, calibration_paths=()) -> str:
+    """Convert ``variant`` in a child process, write it to ``path`` and return the variant built.
+
+    Conversion peaks at several GB for the Conv3D layers and the int8
+    calibrator can crash natively on some TensorFlow builds; a separate
+    process returns the memory and turns a crash into a retry with float16
+    weights, so ``tflite_int8`` may come back as ``INT8_FALLBACK``.
+    """
+    try:
+        _run_conversion(variant, path, calibration_paths)
+    except RuntimeError as e:
+        if variant != 'tflite_int8':
+            raise
+        print(f"int8 conversion failed ({e}); building {INT8_FALLBACK} instead", file=sys.stderr)
+        _run_conversion(INT8_FALLBACK, path, ())
+        return INT8_FALLBACK
+    return variant
+
+
+class SavedModelRunner:
+    """Runs one clip through the exported ``serving_default`` signature."""
+
+    def __init__(self, path: str):
+        self.loaded = tf.saved_model.load(path)
+        self.serve = self.loaded.signatures['serving_default']
+
+    def __call__(self, frames: np.ndarray) -> np.ndarray:
+        return self.serve(frames=tf.constant(frames))['probabilities'].numpy()
+
+
+class TFLiteRunner:
+    """Runs one clip through a TFLite interpreter, quantizing the I/O if needed."""
+
+    def __init__(self, path: str, threads: int = None, xnnpack: bool = True):
+        resolver = (tf.lite.experimental.OpResolverType.AUTO if xnnpack
+                    else tf.lite.experimental.OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES)
+        self.interpreter = tf.lite.Interpreter(model_path=path, num_threads=threads,
+                                               experimental_op_resolver_type=resolver)
+        self.interpreter.allocate_tensors()
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+
+    def __call__(self, frames: np.ndarray) -> np.ndarray:
+        if self.input['dtype'] == np.int8:
+            scale, zero_point = self.input['quantization']
+            frames = np.clip(np.rint(frames / scale + zero_point), -128, 127).astype(np.int8)
+        self.interpreter.set_tensor(self.input['index'], frames)
+        self.interpreter.invoke()
+        output = self.interpreter.get_tensor(self.output['index'])
+        if self.output['dtype'] == np.int8:
+            scale, zero_point = self.output['quantization']
+            output = (output.astype(np.float32) - zero_point) * scale
+        return output
+
+
+def decode(yhat: np.ndarray) -> str:
+    """Greedy CTC transcript of a single ``(1, T, classes)`` output."""
+    from ctc_decoder import greedy_decode_batch
+
+    return greedy_decode_batch(yhat)[0]
+
+
+def artifact_size(path: str) -> int:
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, f))
+                   for root, _, files in os.walk(path) for f in files)
+    return os.path.getsize(path)
+
+
+def evaluate_variant(runner, clips, repeats: int = 1) -> dict:
+    """Per-clip CPU latency and corpus CER/WER of ``runner`` on ``clips``."""
+    runner(clips[0][1][np.newaxis])  # warm-up: graph tracing and tensor allocation
+    latencies = []
+    pairs = []
+    for path, frames in clips:
+        batch = frames[np.newaxis]
+        for _ in range(repeats):
+            start = time.perf_counter()
+            yhat = runner(batch)
+            latencies.append(time.perf_counter() - start)
+        pairs.append((reference_text(alignment_path_for(path)), decode(yhat)))
+    return {
+        'latency_p50_ms': float(np.percentile(latencies, 50)) * 1000,
+        'latency_mean_ms': float(np.mean(latencies)) * 1000,
+        **error_rates(pairs),
+    }
+
+
+def print_report(report: dict) -> None:
+    print(f"\n{'variant':<26}{'size MiB':>10}{'p50 ms':>10}{'mean ms':>10}{'CER':>8}{'WER':>8}")
+    for name, row in report['variants'].items():
+        if 'quantization' in row:
+            name = f"{name} ({row['quantization']})"
+        if 'error' in row:
+            print(f"{name:<26}  failed: {row['error']}")
+        elif 'cer' in row:
+            print(f"{name:<26}{row['size_bytes'] / 1024 ** 2:>10.1f}{row['latency_p50_ms']:>10.1f}"
+                  f"{row['latency_mean_ms']:>10.1f}{row['cer']:>8.3f}{row['wer']:>8.3f}")
+        else:
+            print(f"{name:<26}{row['size_bytes'] / 1024 ** 2:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the LipNet model to SavedModel and TFLite')
+    parser.add_argument('--out-dir', default='exports', help='Directory for the artifacts and report')
+    parser.add_argument('--variants', nargs='+', choices=VARIANTS, default=list(VARIANTS),
+                        help='Artifacts to build')
+    parser.add_argument('--clips', nargs='*', help='Held-out video files, directories or globs '
+                                                   '(default: the train.py validation split of data/s1)')
+    parser.add_argument('--eval-clips', type=int, default=20, help='Held-out clips to evaluate on')
+    parser.add_argument('--calibration-clips', type=int, default=16, help='Training clips for int8 calibration')
+    parser.add_argument('--repeats', type=int, default=1, help='Timed runs per clip')
+    parser.add_argument('--threads', type=int, default=os.cpu_count() or 1, help='TFLite interpreter threads')
+    parser.add_argument('--no-xnnpack', action='store_true',
+                        help='Run TFLite without the XNNPACK delegate (much lower memory for the Conv3D layers)')
+    parser.add_argument('--no-report', action='store_true', help='Only write the artifacts')
+    args = parser.parse_args()
+
+    variants = [v for v in VARIANTS if v in args.variants]
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    train_files, val_files = held_out_split()
+    eval_paths = collect_videos(args.clips) if args.clips else val_files
+    eval_clips = [] if args.no_report else load_clips(eval_paths, args.eval_clips)
+    calibration_paths = train_files[:args.calibration_clips] if 'tflite_int8' in variants else []
+    if not args.no_report and not eval_clips:
+        print("No held-out clips with alignments to evaluate on", file=sys.stderr)
+        return 1
+
+    report = {'eval_clips': len(eval_clips), 'calibration_clips': len(calibration_paths),
+              'threads': args.threads, 'variants': {}}
+
+    for variant in variants:
+        start = time.perf_counter()
+        built = variant
+        try:
+            if variant == 'saved_model':
+                sys.path.append(os.path.join(BASE_DIR, 'app'))
+                from modelutil import load_model
+                path = export_saved_model(load_model(), args.out_dir)
+            else:
+                path = os.path.join(args.out_dir, f"lipnet_{variant.split('_', 1)[1]}.tflite")
+                built = export_tflite(variant, path, calibration_paths)
+        except Exception as e:
+            # A failed variant (typically int8 quantization) should not lose the others
+            print(f"Failed to export {variant}: {e}", file=sys.stderr)
+            report['variants'][variant] = {'error': str(e).strip().splitlines()[0] if str(e).strip() else repr(e)}
+            continue
+
+        row = {'path': path, 'size_bytes': artifact_size(path), 'export_seconds': time.perf_counter() - start}
+        if built != variant:
+            row['quantization'] = built.split('_', 1)[1]
+        print(f"Wrote {path} ({row['size_bytes'] / 1024 ** 2:.1f} MiB)")
+        if eval_clips:
+            if variant == 'saved_model':
+                runner = SavedModelRunner(path)
+            else:
+                runner = TFLiteRunner(path, args.threads, xnnpack=not args.no_xnnpack)
+            row.update(evaluate_variant(runner, eval_clips, args.repeats))
+            # Interpreter arenas for the Conv3D layers are large; free one before building the next
+            del runner
+        report['variants'][variant] = row
+
+    report_path = os.path.join(args.out_dir, 'report.json')
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print_report(report)
+    print(f"\nReport written to {report_path}")
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
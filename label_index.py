@@ -0,0 +1,304 @@
+"""Precompiled label index of a GRID alignment tree.
+
+Parsing every ``.align`` file and running it through a ``StringLookup`` on
+every call, every epoch, costs more than the lookup it feeds. The index is
+built once per alignment root (``<data>/alignments``) into a single file,
+``labels.index``, that holds for every clip its encoded label, the label
+length and its word timings. The file is a small JSON header followed by
+flat, aligned arrays; loading it memory-maps the file, so the arrays are
+views on the page cache and every process reading it shares one copy.
+Clips are looked up by ``<speaker>/<clip id>`` through a dict built on
+first use, so a lookup is O(1).
+
+Labels are the transcript without ``sil`` and ``sp``, words joined by
+single spaces, encoded with ``vocab.encode_text``. A clip that is not in the
+index, or an alignment outside an ``alignments/<speaker>/`` tree, is parsed
+from its file instead, so a missing or stale index is never wrong for new
+clips. The index is stale once a speaker directory changes (files added,
+removed or replaced); ``ensure_label_index`` rebuilds it then, and so does
+the first lookup under an indexed root in every process, so lookups never
+read a stale index. An ``.align`` edited in place keeps its directory's
+mtime, so run ``build`` after that.
+
+Usage:
+    python label_index.py build data/alignments
+    python label_index.py show data/alignments s1/bbaf2n
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+from vocab import VOCAB, encode_text
+
+INDEX_NAME = 'labels.index'
+MAGIC = b'LIPNETLX'
+VERSION = 1
+ALIGNMENT = 64
+SILENCE = ('sil', 'sp')
+
+
+def parse_alignment(path: str) -> list:
+    """``(start, end, word)`` rows of a GRID ``.align`` file, times in corpus units."""
+    rows = []
+    with open(path, 'r') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 3:
+                rows.append((int(parts[0]), int(parts[1]), parts[2]))
+    return rows
+
+
+def transcript(rows) -> str:
+    return ' '.join(word for _, _, word in rows if word not in SILENCE)
+
+
+def clip_key(alignment_path: str) -> tuple:
+    """``(alignment root, '<speaker>/<clip id>')`` of ``<root>/<speaker>/<clip>.align``."""
+    speaker_dir, file_name = os.path.split(os.path.abspath(alignment_path))
+    root, speaker = os.path.split(speaker_dir)
+    return root, f"{speaker}/{os.path.splitext(file_name)[0]}"
+
+
+def speaker_dirs(alignment_root: str) -> dict:
+    """Speaker directory name -> mtime_ns; one stat per speaker, none per clip."""
+    return {entry.name: entry.stat().st_mtime_ns for entry in os.scandir(alignment_root)
+            if entry.is_dir() and not entry.name.startswith('.')}
+
+
+def build_label_index(alignment_root: str, path: str = None) -> str:
+    """Parse every alignment under ``alignment_root`` and write the index; returns its path."""
+    path = path or os.path.join(alignment_root, INDEX_NAME)
+    speakers = speaker_dirs(alignment_root)
+
+    keys, labels, label_lengths, word_counts = [], [], [], []
+    starts, ends, word_ids = [], [], []
+    words = {}
+    for speaker in sorted(speakers):
+        speaker_dir = os.path.join(alignment_root, speaker)
+        for file_name in sorted(os.listdir(speaker_dir)):
+            if not file_name.endswith('.align'):
+                continue
+            rows = parse_alignment(os.path.join(speaker_dir, file_name))
+            label = encode_text(transcript(rows))
+            keys.append(f"{speaker}/{file_name[:-len('.align')]}")
+            labels.append(label)
+            label_lengths.append(len(label))
+            word_counts.append(len(rows))
+            for start, end, word in rows:
+                starts.append(start)
+                ends.append(end)
+                word_ids.append(words.setdefault(word, len(words)))
+
+    arrays = {
+        'keys': np.array(keys, dtype=bytes) if keys else np.zeros(0, dtype='S1'),
+        'label_offsets': np.concatenate([[0], np.cumsum(label_lengths)]).astype(np.int64),
+        'labels': np.concatenate(labels) if labels else np.zeros(0, dtype=np.uint8),
+        'word_offsets': np.concatenate([[0], np.cumsum(word_counts)]).astype(np.int64),
+        'word_starts': np.array(starts, dtype=np.int32),
+        'word_ends': np.array(ends, dtype=np.int32),
+        'word_ids': np.array(word_ids, dtype=np.uint16),
+    }
+    header = {
+        'version': VERSION,
+        'vocab': ''.join(VOCAB),
+        'clips': len(keys),
+        'words': list(words),
+        'speakers': speakers,
+        'built': time.time(),
+        'arrays': {},
+    }
+
+    # Array offsets depend on the header size and the header lists the
+    # offsets, so lay the arrays out after a header padded to a fixed block
+    offset = 0
+    for name, array in arrays.items():
+        header['arrays'][name] = {'dtype': array.dtype.str, 'count': len(array), 'offset': offset}
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    header_bytes = json.dumps(header).encode()
+    data_start = -(-(len(MAGIC) + 8 + len(header_bytes)) // ALIGNMENT) * ALIGNMENT
+
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(np.uint64(len(header_bytes)).tobytes())
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.seek(data_start + header['arrays'][name]['offset'])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+    return path
+
+
+class LabelIndex:
+    """Read-only, memory-mapped view of a ``labels.index`` file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"Not a label index: {path}")
+            header_size = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+            self.header = json.loads(f.read(header_size))
+        if self.header['version'] != VERSION:
+            raise ValueError(f"Label index {path} has version {self.header['version']}, expected {VERSION}")
+        data_start = -(-(len(MAGIC) + 8 + header_size) // ALIGNMENT) * ALIGNMENT
+
+        buffer = np.memmap(path, dtype=np.uint8, mode='r') if os.path.getsize(path) > data_start else None
+        self.arrays = {}
+        for name, spec in self.header['arrays'].items():
+            dtype = np.dtype(spec['dtype'])
+            if spec['count'] == 0:
+                self.arrays[name] = np.zeros(0, dtype=dtype)
+                continue
+            start = data_start + spec['offset']
+            self.arrays[name] = buffer[start:start + spec['count'] * dtype.itemsize].view(dtype)
+        self.words = self.header['words']
+        self._positions = None
+
+    @property
+    def positions(self) -> dict:
+        if self._positions is None:
+            self._positions = {key.decode(): i for i, key in enumerate(self.arrays['keys'].tolist())}
+        return self._positions
+
+    def __len__(self) -> int:
+        return self.header['clips']
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.positions
+
+    def is_stale(self, alignment_root: str) -> bool:
+        """True when a speaker directory changed since the build or the vocabulary differs."""
+        return self.header['vocab'] != ''.join(VOCAB) or self.header['speakers'] != speaker_dirs(alignment_root)
+
+    def label(self, key: str) -> np.ndarray:
+        """The clip's uint8 tokens, a read-only view into the mapped file."""
+        i = self.positions[key]
+        offsets = self.arrays['label_offsets']
+        return self.arrays['labels'][offsets[i]:offsets[i + 1]]
+
+    def label_length(self, key: str) -> int:
+        i = self.positions[key]
+        offsets = self.arrays['label_offsets']
+        return int(offsets[i + 1] - offsets[i])
+
+    def word_timings(self, key: str) -> list:
+        """``(start, end, word)`` rows of the clip, ``sil`` and ``sp`` included."""
+        i = self.positions[key]
+        begin, end = self.arrays['word_offsets'][i:i + 2]
+        return [(int(s), int(e), self.words[w]) for s, e, w in zip(self.arrays['word_starts'][begin:end],
+                                                                  self.arrays['word_ends'][begin:end],
+                                                                  self.arrays['word_ids'][begin:end])]
+
+    def text(self, key: str) -> str:
+        return transcript(self.word_timings(key))
+
+
+_indexes = {}
+
+
+def load_label_index(alignment_root: str):
+    """The index of ``alignment_root``, loaded once per process; None when there is none."""
+    alignment_root = os.path.abspath(alignment_root)
+    if alignment_root not in _indexes:
+        path = os.path.join(alignment_root, INDEX_NAME)
+        _indexes[alignment_root] = LabelIndex(path) if os.path.exists(path) else None
+    return _indexes[alignment_root]
+
+
+def ensure_label_index(alignment_root: str):
+    """Build the index of ``alignment_root`` if it is missing or stale, then return it."""
+    alignment_root = os.path.abspath(alignment_root)
+    if not os.path.isdir(alignment_root) or not speaker_dirs(alignment_root):
+        return None
+    index = load_label_index(alignment_root)
+    if index is None or index.is_stale(alignment_root):
+        build_label_index(alignment_root)
+        _indexes.pop(alignment_root, None)
+        index = load_label_index(alignment_root)
+    return index
+
+
+_checked_roots = set()
+
+
+def _indexed(alignment_path: str):
+    root, key = clip_key(alignment_path)
+    if root in _checked_roots:
+        index = load_label_index(root)
+    else:
+        # One staleness check per root and process: a stat per speaker directory.
+        # Only roots that already have an index are rebuilt, never arbitrary parents
+        _checked_roots.add(root)
+        index = load_label_index(root)
+        if index is not None and index.is_stale(root):
+            try:
+                index = ensure_label_index(root)
+            except OSError:
+                # A read-only tree cannot be rebuilt; parse the files instead of trusting the index
+                _indexes[root] = index = None
+    return (index, key) if index is not None and key in index else (None, key)
+
+
+def alignment_label(alignment_path: str) -> np.ndarray:
+    """Encoded label of an ``.align`` file, from the index when it covers the clip."""
+    index, key = _indexed(alignment_path)
+    if index is not None:
+        return index.label(key)
+    return encode_text(transcript(parse_alignment(alignment_path)))
+
+
+def alignment_text(alignment_path: str) -> str:
+    """Transcript of an ``.align`` file without ``sil``/``sp``, from the index when it covers the clip."""
+    index, key = _indexed(alignment_path)
+    if index is not None:
+        return index.text(key)
+    return transcript(parse_alignment(alignment_path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or inspect the precompiled label index')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help='Index every alignment under a root')
+    build_parser.add_argument('root', nargs='?', default=os.path.join('data', 'alignments'),
+                              help='Alignment root holding one directory per speaker')
+
+    show_parser = subparsers.add_parser('show', help='Print the indexed entry of one clip')
+    show_parser.add_argument('root', help='Alignment root')
+    show_parser.add_argument('key', help='<speaker>/<clip id>, e.g. s1/bbaf2n')
+
+    args = parser.parse_args()
+    if not os.path.isdir(args.root):
+        print(f"Alignment root not found: {args.root}")
+        return 1
+
+    if args.command == 'build':
+        start = time.perf_counter()
+        path = build_label_index(args.root)
+        index = LabelIndex(path)
+        print(f"Indexed {len(index)} clips in {time.perf_counter() - start:.2f}s: {path} "
+              f"({os.path.getsize(path) / 1024:.1f} KiB)")
+        return 0
+
+    index = load_label_index(args.root)
+    if index is None:
+        print(f"No label index in {args.root}; run: python label_index.py build {args.root}")
+        return 1
+    if args.key not in index:
+        print(f"{args.key} is not in the index")
+        return 1
+    print(f"text:   {index.text(args.key)}")
+    print(f"label:  {index.label(args.key).tolist()} (length {index.label_length(args.key)})")
+    for start, end, word in index.word_timings(args.key):
+        print(f"        {start:>6} {end:>6} {word}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
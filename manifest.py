@@ -0,0 +1,340 @@
+"""Dataset manifest: one record per clip instead of globbing and probing.
+
+Training globs ``data/s1/*.mpg``, the apps list the speaker directory on
+every rerun and look for each clip under several extensions and alignment
+directories; on network storage with many speakers those listings and
+``os.path.exists`` calls cost more than the work they feed. The manifest is
+written once per data root (``<data>/manifest.jsonl``) and records for every
+clip its id, speaker, video and alignment path (relative to the root), frame
+count, resolution, frame rate, duration and byte size.
+
+The layout is the GRID one: videos in ``<data>/<speaker>/`` and alignments in
+``<data>/alignments/<speaker>/<clip id>.align``; videos directly in the root
+have the speaker ``""`` and take ``alignments/<clip id>.align`` or
+``<clip id>.align``. Frame count, resolution and frame rate come from the
+container header (``cv2.CAP_PROP_*``), not a full decode, so the count can be
+off by a frame for streams with an inexact header.
+
+The first line is a ``#`` comment with the state of every directory the
+records came from, and every other line is one JSON record with a ``video``
+key, so ``predict.py --manifest data/manifest.jsonl`` reads it as is. A
+speaker directory's state is its mtime; the root and ``alignments`` hold the
+manifest and the label index themselves, so their state is a checksum of
+their (short) listing without those files. Checking freshness is one stat
+per speaker directory and two small listings. A refresh rescans only
+the speakers whose video or alignment directory changed and probes only
+videos whose size or mtime changed; ``build`` stats every file as well, for
+videos replaced in place.
+
+Usage:
+    python manifest.py build data
+    python manifest.py show data
+    python manifest.py show data bbaf2n
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+from label_index import INDEX_NAME
+
+MANIFEST_NAME = 'manifest.jsonl'
+VERSION = 1
+ALIGNMENTS = 'alignments'
+# Lookup order when one clip id exists with several extensions
+VIDEO_EXTENSIONS = ('.mp4', '.mpeg', '.mpg', '.avi', '.mov')
+
+
+def probe_video(path: str) -> dict:
+    """Frame count, resolution, frame rate and duration from the video's header."""
+    cap = cv2.VideoCapture(path)
+    try:
+        if not cap.isOpened():
+            return {'frames': 0, 'width': 0, 'height': 0, 'fps': 0.0, 'duration': 0.0}
+        frames = max(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), 0)
+        fps = float(cap.get(cv2.CAP_PROP_FPS))
+        return {
+            'frames': frames,
+            'width': int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            'height': int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            'fps': fps,
+            'duration': round(frames / fps, 3) if fps > 0 else 0.0,
+        }
+    finally:
+        cap.release()
+
+
+def _directory_state(root: str, path: str):
+    """mtime_ns of a speaker directory, listing checksum of the root and ``alignments``; None if missing."""
+    full_path = os.path.join(root, path)
+    try:
+        if path not in ('.', ALIGNMENTS):
+            return os.stat(full_path).st_mtime_ns
+        names = sorted(name for name in os.listdir(full_path)
+                       if not name.startswith((MANIFEST_NAME, INDEX_NAME)))
+    except FileNotFoundError:
+        return None
+    return zlib.crc32('\n'.join(names).encode())
+
+
+def _group_dirs(speaker: str) -> tuple:
+    """Directories, relative to the root, whose listings make up one speaker's records."""
+    if speaker:
+        return speaker, f"{ALIGNMENTS}/{speaker}"
+    return '.', ALIGNMENTS
+
+
+def _list_files(path: str) -> dict:
+    """File name -> ``os.DirEntry`` of a directory; empty when it does not exist."""
+    try:
+        return {entry.name: entry for entry in os.scandir(path) if entry.is_file()}
+    except FileNotFoundError:
+        return {}
+
+
+def _scan_group(root: str, speaker: str, previous: dict) -> tuple:
+    """Records of one speaker (``""`` for the root) and the videos to probe.
+
+    Records in ``previous`` (keyed by video path) are reused when the video's
+    size and mtime are unchanged.
+    """
+    video_dir, alignment_dir = _group_dirs(speaker)
+    videos = _list_files(os.path.join(root, video_dir))
+    alignments = set(name for name in _list_files(os.path.join(root, alignment_dir)) if name.endswith('.align'))
+    loose_alignments = set(name for name in videos if name.endswith('.align')) if not speaker else set()
+
+    records, to_probe = [], []
+    for name in sorted(videos):
+        clip_id, extension = os.path.splitext(name)
+        if extension.lower() not in VIDEO_EXTENSIONS:
+            continue
+        video = f"{speaker}/{name}" if speaker else name
+        if f'{clip_id}.align' in alignments:
+            alignment = f"{alignment_dir}/{clip_id}.align"
+        elif f'{clip_id}.align' in loose_alignments:
+            alignment = f'{clip_id}.align'
+        else:
+            alignment = None
+
+        stat = videos[name].stat()
+        record = {'id': clip_id, 'speaker': speaker, 'video': video, 'alignment': alignment,
+                  'bytes': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        old = previous.get(video)
+        if old is not None and old['bytes'] == record['bytes'] and old['mtime_ns'] == record['mtime_ns']:
+            record.update({key: old[key] for key in ('frames', 'width', 'height', 'fps', 'duration')})
+        else:
+            to_probe.append(record)
+        records.append(record)
+    return records, to_probe
+
+
+class Manifest:
+    """The clips of one data root; paths are joined onto ``root`` as it was given."""
+
+    def __init__(self, root: str, clips: list, directories: dict, built: float = None):
+        self.root = root
+        self.clips = clips
+        self.directories = directories
+        self.built = built
+        self._by_id = None
+
+    def __len__(self) -> int:
+        return len(self.clips)
+
+    @property
+    def speakers(self) -> list:
+        return sorted(set(record['speaker'] for record in self.clips if record['speaker']))
+
+    def is_stale(self) -> bool:
+        """True once any directory the records came from changed, appeared or went away."""
+        return any(_directory_state(self.root, path) != state for path, state in self.directories.items())
+
+    def select(self, speaker: str = None, extensions=None, aligned: bool = False) -> list:
+        """Records of one speaker (all when None), optionally only these extensions or aligned clips."""
+        return [record for record in self.clips
+                if (speaker is None or record['speaker'] == speaker)
+                and (extensions is None or os.path.splitext(record['video'])[1].lower() in extensions)
+                and (not aligned or record['alignment'] is not None)]
+
+    def video_path(self, record: dict) -> str:
+        return os.path.join(self.root, *record['video'].split('/'))
+
+    def alignment_path(self, record: dict):
+        """Path of the clip's alignment file, None when it has none."""
+        if record['alignment'] is None:
+            return None
+        return os.path.join(self.root, *record['alignment'].split('/'))
+
+    def video_paths(self, speaker: str = None, extensions=None, aligned: bool = False) -> list:
+        """Sorted video paths, as ``glob`` under ``root`` would return them."""
+        return [self.video_path(record) for record in self.select(speaker, extensions, aligned)]
+
+    def _by_id_records(self, clip_id: str) -> list:
+        if self._by_id is None:
+            self._by_id = {}
+            for record in self.clips:
+                self._by_id.setdefault(record['id'], []).append(record)
+        return self._by_id.get(clip_id, [])
+
+    def find(self, clip_id: str, speaker: str = None):
+        """Record of ``clip_id`` (of ``speaker`` if given), preferring ``VIDEO_EXTENSIONS`` order; None if absent."""
+        candidates = [record for record in self._by_id_records(clip_id)
+                      if speaker is None or record['speaker'] == speaker]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda record: VIDEO_EXTENSIONS.index(os.path.splitext(record['video'])[1].lower()))
+
+    def lookup(self, video_path: str):
+        """Record of the video at ``video_path`` under ``root``; None if it is not listed."""
+        relative = os.path.relpath(os.path.abspath(video_path), os.path.abspath(self.root)).replace(os.sep, '/')
+        clip_id = os.path.splitext(os.path.basename(relative))[0]
+        speaker = relative.rsplit('/', 1)[0] if '/' in relative else ''
+        for record in self._by_id_records(clip_id):
+            if record['speaker'] == speaker and record['video'] == relative:
+                return record
+        return None
+
+    def write(self, path: str = None) -> str:
+        path = path or os.path.join(self.root, MANIFEST_NAME)
+        header = {'version': VERSION, 'built': self.built, 'clips': len(self.clips), 'directories': self.directories}
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, 'w') as f:
+            f.write(f"# {json.dumps(header)}\n")
+            for record in self.clips:
+                f.write(json.dumps(record) + '\n')
+        os.replace(tmp_path, path)
+        return path
+
+
+def read_manifest(data_root: str):
+    """The manifest written under ``data_root``, or None if it is missing or from another version."""
+    path = os.path.join(data_root, MANIFEST_NAME)
+    try:
+        with open(path, 'r') as f:
+            first = f.readline()
+            header = json.loads(first[1:]) if first.startswith('#') else {}
+            if header.get('version') != VERSION:
+                return None
+            clips = [json.loads(line) for line in f if line.strip()]
+    except (FileNotFoundError, ValueError):
+        return None
+    return Manifest(data_root, clips, header['directories'], header.get('built'))
+
+
+def refresh_manifest(data_root: str, previous: Manifest = None, verify: bool = False, workers: int = 8) -> Manifest:
+    """Rescan the speakers whose directories changed (all with ``verify``) and write the manifest.
+
+    Unchanged speakers keep their records without a listing; videos whose size
+    and mtime match their old record are not probed again.
+    """
+    old_dirs = previous.directories if previous else {}
+    old_groups = {}
+    for record in previous.clips if previous else ():
+        old_groups.setdefault(record['speaker'], {})[record['video']] = record
+
+    speakers = [''] + sorted(entry.name for entry in os.scandir(data_root)
+                             if entry.is_dir() and entry.name != ALIGNMENTS and not entry.name.startswith('.'))
+    clips, directories, to_probe = [], {}, []
+    for speaker in speakers:
+        dirs = {path: _directory_state(data_root, path) for path in _group_dirs(speaker)}
+        directories.update(dirs)
+        previous_group = old_groups.get(speaker, {})
+        unchanged = speaker in old_groups and all(old_dirs.get(path) == state for path, state in dirs.items())
+        if unchanged and not verify:
+            clips.extend(previous_group.values())
+            continue
+        records, probe = _scan_group(data_root, speaker, previous_group)
+        clips.extend(records)
+        to_probe.extend(probe)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        probes = executor.map(lambda record: probe_video(os.path.join(data_root, *record['video'].split('/'))),
+                              to_probe)
+        for record, probe in zip(to_probe, probes):
+            record.update(probe)
+
+    clips.sort(key=lambda record: (record['speaker'], record['video']))
+    manifest = Manifest(data_root, clips, directories, time.time())
+    try:
+        manifest.write()
+    except OSError as e:
+        # A read-only data root still gets the scanned manifest for this process
+        print(f"Could not write {os.path.join(data_root, MANIFEST_NAME)}: {e}", file=sys.stderr)
+    return manifest
+
+
+def build_manifest(data_root: str, workers: int = 8) -> Manifest:
+    """Rescan every directory and stat every video, reusing probes of unchanged files."""
+    return refresh_manifest(data_root, read_manifest(data_root), verify=True, workers=workers)
+
+
+_manifests = {}
+
+
+def ensure_manifest(data_root: str = 'data'):
+    """The manifest of ``data_root``, refreshed if stale; None when the root does not exist.
+
+    Cached per process, so repeated calls (one per Streamlit rerun) cost one
+    stat per directory.
+    """
+    if not os.path.isdir(data_root):
+        return None
+    key = os.path.normpath(data_root)
+    # An empty manifest has len() 0, so test for a cached one explicitly
+    manifest = _manifests.get(key)
+    if manifest is None:
+        manifest = read_manifest(data_root)
+    if manifest is None or manifest.is_stale():
+        manifest = refresh_manifest(data_root, manifest)
+    _manifests[key] = manifest
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or inspect the dataset manifest')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help='Scan a data root and write its manifest')
+    build_parser.add_argument('root', nargs='?', default='data', help='Data root with one directory per speaker')
+    build_parser.add_argument('--workers', type=int, default=8, help='Threads probing video headers')
+
+    show_parser = subparsers.add_parser('show', help='Summarize the manifest, or print one clip')
+    show_parser.add_argument('root', nargs='?', default='data', help='Data root')
+    show_parser.add_argument('clip', nargs='?', help='Clip id, e.g. bbaf2n')
+
+    args = parser.parse_args()
+    if not os.path.isdir(args.root):
+        print(f"Data root not found: {args.root}")
+        return 1
+
+    if args.command == 'build':
+        start = time.perf_counter()
+        manifest = build_manifest(args.root, args.workers)
+        print(f"Listed {len(manifest)} clips of {len(manifest.speakers)} speakers in "
+              f"{time.perf_counter() - start:.2f}s: {os.path.join(args.root, MANIFEST_NAME)}")
+        return 0
+
+    manifest = ensure_manifest(args.root)
+    if args.clip:
+        record = manifest.find(args.clip)
+        if record is None:
+            print(f"{args.clip} is not in the manifest")
+            return 1
+        print(json.dumps(record, indent=2))
+        return 0
+
+    print(f"{'speaker':<12}{'clips':>7}{'aligned':>9}{'hours':>8}{'MiB':>10}")
+    for speaker in sorted(set(record['speaker'] for record in manifest.clips)):
+        records = manifest.select(speaker)
+        print(f"{speaker or '(root)':<12}{len(records):>7}{sum(r['alignment'] is not None for r in records):>9}"
+              f"{sum(r['duration'] for r in records) / 3600:>8.2f}{sum(r['bytes'] for r in records) / 2 ** 20:>10.1f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
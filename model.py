@@ -23,16 +23,23 @@ class LipNet(Model):
         self.pool3 = MaxPool3D((1, 2, 2), strides=(1, 2, 2))
         
         # Bi-directional LSTM layers
-        self.reshape = Reshape((-1, 96 * 3 * 6))
+        # Conv/pool stack leaves 2x8x96 per frame; flatten per frame like the serving model
+        self.reshape = TimeDistributed(Flatten())
         self.dense1 = TimeDistributed(Dense(256))
         
         self.lstm1 = Bidirectional(LSTM(128, kernel_initializer='Orthogonal', return_sequences=True))
         self.lstm2 = Bidirectional(LSTM(128, kernel_initializer='Orthogonal', return_sequences=True))
         
         # Output layer
-        self.dense2 = Dense(vocab_size + 1, kernel_initializer='he_normal', activation='softmax')
+        # float32 output so the softmax and CTC loss stay full precision under a mixed policy
+        self.dense2 = Dense(vocab_size + 1, kernel_initializer='he_normal', activation='softmax', dtype='float32')
+
+    def call(self, x, training=False, input_length=None):
+        # input_length masks the padded frames of variable-length batches out of the LSTMs
+        mask = None
+        if input_length is not None:
+            mask = tf.sequence_mask(tf.reshape(input_length, [-1]), tf.shape(x)[1])
 
-    def call(self, x, training=False):
         # Conv3D layers
         x = self.conv1(x)
         x = self.bn1(x, training=training)
@@ -57,8 +64,8 @@ class LipNet(Model):
         x = self.dense1(x)
         
         # LSTM layers
-        x = self.lstm1(x)
-        x = self.lstm2(x)
+        x = self.lstm1(x, mask=mask)
+        x = self.lstm2(x, mask=mask)
         
         # Output
         x = self.dense2(x)
@@ -67,6 +74,7 @@ class LipNet(Model):
 
 def CTCLoss(y_true, y_pred):
     """Custom CTC loss function."""
+    y_pred = tf.cast(y_pred, tf.float32)
     batch_len = tf.cast(tf.shape(y_true)[0], dtype="int64")
     input_length = tf.cast(tf.shape(y_pred)[1], dtype="int64")
     label_length = tf.cast(tf.shape(y_true)[1], dtype="int64")
@@ -75,4 +83,67 @@ def CTCLoss(y_true, y_pred):
     label_length = label_length * tf.ones(shape=(batch_len, 1), dtype="int64")
 
     loss = tf.keras.backend.ctc_batch_cost(y_true, y_pred, input_length, label_length)
-    return loss 
\ No newline at end of file
+    return loss 
+
+def CTCLossWithLengths(y_true, y_pred, input_length, label_length):
+    """CTC loss over the true frame and label length of every clip in a padded batch."""
+    y_pred = tf.cast(y_pred, tf.float32)
+    input_length = tf.reshape(tf.cast(input_length, "int64"), [-1, 1])
+    label_length = tf.reshape(tf.cast(label_length, "int64"), [-1, 1])
+    return tf.keras.backend.ctc_batch_cost(y_true, y_pred, input_length, label_length)
+
+def ctc_neg_log_likelihood(labels, y_pred, label_length, input_length):
+    """CTC loss from plain TF ops, so it can be compiled with XLA.
+
+    Same definition as ``tf.keras.backend.ctc_batch_cost``: ``y_pred`` are
+    softmax outputs whose last class is the blank, ``labels`` are dense and
+    only the first ``label_length`` entries of each row count. Returns ``(B, 1)``.
+    """
+    y_pred = tf.cast(y_pred, tf.float32)
+    labels = tf.cast(labels, tf.int32)
+    label_length = tf.reshape(tf.cast(label_length, tf.int32), [-1])
+    input_length = tf.reshape(tf.cast(input_length, tf.int32), [-1])
+    batch_size, max_label = tf.shape(labels)[0], labels.shape[1]
+    blank = y_pred.shape[-1] - 1
+    states = 2 * max_label + 1
+    neg_inf = -1e30
+
+    # Label sequence with blanks around every label: b l1 b l2 ... b
+    extended = tf.reshape(tf.stack([tf.fill(tf.shape(labels), blank), labels], axis=2), [batch_size, -1])
+    extended = tf.concat([extended, tf.fill([batch_size, 1], blank)], axis=1)
+    # A label may skip the blank before it unless it repeats the label two states back
+    previous = tf.concat([tf.fill([batch_size, 2], blank), extended[:, :-2]], axis=1)
+    can_skip = tf.logical_and(tf.not_equal(extended, blank), tf.not_equal(extended, previous))
+
+    log_probs = tf.math.log(y_pred + tf.keras.backend.epsilon())
+    emissions = tf.gather(log_probs, extended, axis=2, batch_dims=1)  # (B, T, states)
+    emissions = tf.transpose(emissions, [1, 0, 2])
+
+    initial = tf.concat([emissions[0, :, :2], tf.fill([batch_size, states - 2], neg_inf)], axis=1)
+    padding = tf.fill([batch_size, 1], neg_inf)
+
+    def step(carry, inputs):
+        alpha, t = carry
+        emission = inputs
+        shift1 = tf.concat([padding, alpha[:, :-1]], axis=1)
+        shift2 = tf.where(can_skip, tf.concat([padding, padding, alpha[:, :-2]], axis=1), neg_inf)
+        new_alpha = tf.reduce_logsumexp(tf.stack([alpha, shift1, shift2]), axis=0) + emission
+        # Frames past a clip's input length leave its alphas unchanged
+        new_alpha = tf.where((t < input_length)[:, tf.newaxis], new_alpha, alpha)
+        return new_alpha, t + 1
+
+    alpha, _ = tf.scan(lambda carry, emission: step(carry, emission), emissions[1:],
+                       initializer=(initial, tf.ones([], tf.int32)))
+    final = tf.concat([initial[tf.newaxis], alpha], axis=0)[-1]
+
+    last = 2 * label_length
+    end = tf.stack([tf.gather(final, last, batch_dims=1), tf.gather(final, tf.maximum(last - 1, 0), batch_dims=1)], 1)
+    end = tf.where(tf.stack([tf.ones_like(last, tf.bool), last > 0], 1), end, neg_inf)
+    return -tf.reduce_logsumexp(end, axis=1, keepdims=True)
+
+def CTCLossXLA(y_true, y_pred):
+    """``CTCLoss`` built on ``ctc_neg_log_likelihood`` for ``jit_compile=True`` training steps."""
+    batch_len = tf.shape(y_true)[0]
+    label_length = tf.fill([batch_len], tf.shape(y_true)[1])
+    input_length = tf.fill([batch_len], tf.shape(y_pred)[1])
+    return ctc_neg_log_likelihood(y_true, y_pred, label_length, input_length)
@@ -0,0 +1,287 @@
+"""Mouth localization for clips that are not framed like GRID s1.
+
+The loaders crop the fixed window ``video.MOUTH_CROP``, which only fits the
+GRID s1 camera. ``MouthLocalizer`` finds the mouth instead:
+
+- every ``every`` frames a face detector (OpenCV's Haar cascade by default)
+  runs on a downscaled gray frame and the mouth box is placed from the face
+  geometry;
+- on the frames in between, the mouth is tracked by template matching in a
+  small window around its last position;
+- box centre and size are smoothed with an exponential moving average, so the
+  crop does not jitter from frame to frame.
+
+The crop is resized to the model's 46x140. Without a detector, for example
+when the installed OpenCV ships no cascades, the localizer starts from the
+GRID window and only tracks. Per-frame cost is recorded and reported against
+the frame budget at the clip's frame rate.
+
+Usage:
+    python mouth_roi.py data/s1/bbaf2n.mpg
+    python mouth_roi.py clip.mp4 --every 5 --preview crops.mp4
+    python mouth_roi.py clip.mp4 --cascade /path/to/haarcascade_frontalface_default.xml
+"""
+import os
+import time
+import argparse
+
+import cv2
+import numpy as np
+
+import video
+
+CROP_HEIGHT = 46
+CROP_WIDTH = 140
+FACE_CASCADE = 'haarcascade_frontalface_default.xml'
+
+# Mouth box relative to a frontal face box: centre height and width as fractions of the face
+MOUTH_CENTER_Y = 0.78
+MOUTH_WIDTH = 0.85
+# Tracking matches a taller patch than the crop: nose and chin move rigidly while the lips do not
+TRACK_CONTEXT = (1.2, 2.5)
+
+
+def grid_box():
+    """The fixed GRID s1 crop as a ``(cx, cy, w, h)`` box."""
+    top, bottom, left, right = video.MOUTH_CROP
+    return ((left + right) / 2, (top + bottom) / 2, float(right - left), float(bottom - top))
+
+
+def mouth_box_from_face(face) -> tuple:
+    """Place a ``CROP_WIDTH`` x ``CROP_HEIGHT`` shaped mouth box inside a face box ``(x, y, w, h)``."""
+    x, y, w, h = face
+    width = MOUTH_WIDTH * w
+    return (x + w / 2, y + MOUTH_CENTER_Y * h, width, width * CROP_HEIGHT / CROP_WIDTH)
+
+
+class CascadeFaceDetector:
+    """Largest frontal face from an OpenCV Haar cascade, detected at reduced resolution."""
+
+    def __init__(self, path: str = None, scale: float = 0.5, min_neighbors: int = 5) -> None:
+        if not hasattr(cv2, 'CascadeClassifier'):
+            raise ImportError("This OpenCV build has no CascadeClassifier (OpenCV 5 moved it to opencv-contrib)")
+        path = path or os.path.join(cv2.data.haarcascades, FACE_CASCADE)
+        self.cascade = cv2.CascadeClassifier(path)
+        if self.cascade.empty():
+            raise FileNotFoundError(f"Could not load face cascade: {path}")
+        self.scale = scale
+        self.min_neighbors = min_neighbors
+
+    def __call__(self, gray: np.ndarray):
+        small = cv2.resize(gray, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        faces = self.cascade.detectMultiScale(small, scaleFactor=1.1, minNeighbors=self.min_neighbors,
+                                              minSize=(24, 24))
+        if len(faces) == 0:
+            return None
+        x, y, w, h = max(faces, key=lambda face: face[2] * face[3])
+        return x / self.scale, y / self.scale, w / self.scale, h / self.scale
+
+
+def default_detector(path: str = None):
+    """The cascade detector, or None (tracking only) when OpenCV has no cascade to load."""
+    try:
+        return CascadeFaceDetector(path)
+    except (FileNotFoundError, ImportError):
+        if path:
+            raise
+        return None
+
+
+class MouthLocalizer:
+    """Detect-every-N-frames mouth localization with tracking and smoothing in between.
+
+    ``process`` takes BGR frames in order and returns ``(46, 140, 3)`` BGR
+    mouth crops. ``detector`` maps a gray frame to a face box ``(x, y, w, h)``
+    or None; ``initial_box`` is the ``(cx, cy, w, h)`` mouth box used until the
+    first detection.
+    """
+
+    def __init__(self, detector=None, every: int = 10, smoothing: float = 0.5, search_margin: int = 12,
+                 min_score: float = 0.4, initial_box=None) -> None:
+        if every < 1 or not 0 < smoothing <= 1:
+            raise ValueError("Need every >= 1 and 0 < smoothing <= 1")
+        self.detector = detector
+        self.every = every
+        self.smoothing = smoothing
+        self.search_margin = search_margin
+        self.min_score = min_score
+        self.initial_box = initial_box or grid_box()
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget the tracked mouth and the timings, e.g. between clips."""
+        self.box = None
+        self.template = None
+        self.since_detection = self.every
+        self.frame_seconds = []
+        self.detect_seconds = []
+        self.track_seconds = []
+        self.detections = 0
+        self.misses = 0
+
+    def _update(self, box) -> None:
+        if self.box is None:
+            self.box = tuple(float(v) for v in box)
+            return
+        a = self.smoothing
+        self.box = tuple((1 - a) * old + a * new for old, new in zip(self.box, box))
+
+    def _window(self, frame_shape, box):
+        """Integer ``(top, bottom, left, right)`` of ``box``, clamped to the frame."""
+        height, width = frame_shape[:2]
+        cx, cy, w, h = box
+        w, h = min(int(round(w)), width), min(int(round(h)), height)
+        left = min(max(int(round(cx - w / 2)), 0), width - w)
+        top = min(max(int(round(cy - h / 2)), 0), height - h)
+        return top, top + h, left, left + w
+
+    def _detect(self, gray) -> bool:
+        start = time.perf_counter()
+        face = self.detector(gray)
+        self.detect_seconds.append(time.perf_counter() - start)
+        if face is None:
+            self.misses += 1
+            return False
+        self.detections += 1
+        self._update(mouth_box_from_face(face))
+        return True
+
+    def _track_window(self, frame_shape):
+        cx, cy, w, h = self.box
+        return self._window(frame_shape, (cx, cy, w * TRACK_CONTEXT[0], h * TRACK_CONTEXT[1]))
+
+    def _track(self, gray) -> None:
+        start = time.perf_counter()
+        top, bottom, left, right = self._track_window(gray.shape)
+        margin = self.search_margin
+        s_top, s_left = max(top - margin, 0), max(left - margin, 0)
+        search = gray[s_top:min(bottom + margin, gray.shape[0]), s_left:min(right + margin, gray.shape[1])]
+        if search.shape[0] >= self.template.shape[0] and search.shape[1] >= self.template.shape[1]:
+            scores = cv2.matchTemplate(search, self.template, cv2.TM_CCOEFF_NORMED)
+            _, score, _, (dx, dy) = cv2.minMaxLoc(scores)
+            if score >= self.min_score:
+                # Move the box by the patch's displacement, keeping the box-to-patch offset
+                self._update((self.box[0] + s_left + dx - left, self.box[1] + s_top + dy - top,
+                              self.box[2], self.box[3]))
+            else:
+                # Lost the mouth: hold the box and detect again on the next frame
+                self.since_detection = self.every
+        self.track_seconds.append(time.perf_counter() - start)
+
+    def process(self, frame: np.ndarray) -> np.ndarray:
+        """Localize the mouth in one BGR frame and return its resized crop."""
+        start = time.perf_counter()
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        detected = False
+        if self.detector is not None and self.since_detection >= self.every:
+            self.since_detection = 0
+            detected = self._detect(gray)
+        if self.box is None:
+            self._update(self.initial_box)
+            detected = True
+        if not detected and self.template is not None:
+            self._track(gray)
+        self.since_detection += 1
+
+        if detected or self.template is None:
+            # Track against the appearance at the last detection so errors do not accumulate
+            top, bottom, left, right = self._track_window(frame.shape)
+            self.template = gray[top:bottom, left:right].copy()
+        top, bottom, left, right = self._window(frame.shape, self.box)
+        crop = frame[top:bottom, left:right]
+        if crop.shape[:2] != (CROP_HEIGHT, CROP_WIDTH):
+            crop = cv2.resize(crop, (CROP_WIDTH, CROP_HEIGHT), interpolation=cv2.INTER_AREA)
+        self.frame_seconds.append(time.perf_counter() - start)
+        return crop
+
+    def stats(self, fps: float = 25.0) -> dict:
+        """Per-frame cost in milliseconds against the ``1000 / fps`` budget."""
+        frame_ms = np.asarray(self.frame_seconds) * 1000
+        budget = 1000.0 / fps
+        p95 = float(np.percentile(frame_ms, 95)) if len(frame_ms) else 0.0
+        return {
+            'frames': len(frame_ms),
+            'detections': self.detections,
+            'missed_detections': self.misses,
+            'frame_ms_mean': float(frame_ms.mean()) if len(frame_ms) else 0.0,
+            'frame_ms_p95': p95,
+            'frame_ms_max': float(frame_ms.max()) if len(frame_ms) else 0.0,
+            'detect_ms_mean': float(np.mean(self.detect_seconds)) * 1000 if self.detect_seconds else 0.0,
+            'track_ms_mean': float(np.mean(self.track_seconds)) * 1000 if self.track_seconds else 0.0,
+            'budget_ms': budget,
+            'realtime': p95 <= budget,
+        }
+
+
+def localize_frames(frames: np.ndarray, localizer: MouthLocalizer = None,
+                    color_code: int = cv2.COLOR_RGB2GRAY) -> np.ndarray:
+    """Localized ``(T, 46, 140)`` uint8 gray mouth crops of full BGR frames ``(T, H, W, 3)``.
+
+    ``color_code`` has the same meaning as in ``video.read_mouth_crops``.
+    """
+    localizer = localizer or MouthLocalizer(default_detector())
+    localizer.reset()
+    crops = np.empty((len(frames), CROP_HEIGHT, CROP_WIDTH), dtype=np.uint8)
+    for index, frame in enumerate(frames):
+        cv2.cvtColor(localizer.process(frame), color_code, dst=crops[index])
+    return crops
+
+
+def read_localized_crops(path: str, localizer: MouthLocalizer = None, color_code: int = cv2.COLOR_RGB2GRAY,
+                         decoder: video.Decoder = None) -> np.ndarray:
+    """Decode a video and return its localized gray mouth crops, like ``video.read_mouth_crops``."""
+    decoder = decoder or video.get_decoder()
+    return localize_frames(decoder.read(path), localizer, color_code)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Localize and crop the mouth in a video')
+    parser.add_argument('video', help='Video file')
+    parser.add_argument('--every', type=int, default=10, help='Run the face detector every this many frames')
+    parser.add_argument('--smoothing', type=float, default=0.5, help='Weight of the newest box in the moving average')
+    parser.add_argument('--cascade', help=f'Face cascade file (default: OpenCV\'s {FACE_CASCADE})')
+    parser.add_argument('--preview', help='Write the 140x46 crops to this video file')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.video):
+        print(f"Video not found: {args.video}")
+        return 1
+    detector = default_detector(args.cascade)
+    if detector is None:
+        print("No face cascade available in this OpenCV build; tracking from the GRID window only")
+    localizer = MouthLocalizer(detector, every=args.every, smoothing=args.smoothing)
+
+    cap = cv2.VideoCapture(args.video)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+    writer = None
+    if args.preview:
+        writer = cv2.VideoWriter(args.preview, cv2.VideoWriter_fourcc(*'mp4v'), fps, (CROP_WIDTH, CROP_HEIGHT))
+    boxes = []
+    while True:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        crop = localizer.process(frame)
+        boxes.append(localizer.box)
+        if writer is not None:
+            writer.write(crop)
+    cap.release()
+    if writer is not None:
+        writer.release()
+
+    if not boxes:
+        print(f"No frames decoded from {args.video}")
+        return 1
+    stats = localizer.stats(fps)
+    centers = np.asarray(boxes)[:, :2]
+    print(f"{stats['frames']} frames, {stats['detections']} detections ({stats['missed_detections']} missed)")
+    print(f"Per frame: {stats['frame_ms_mean']:.2f} ms mean, {stats['frame_ms_p95']:.2f} ms p95, "
+          f"{stats['frame_ms_max']:.2f} ms max (budget {stats['budget_ms']:.1f} ms at {fps:.0f} fps: "
+          f"{'ok' if stats['realtime'] else 'over budget'})")
+    print(f"Detection {stats['detect_ms_mean']:.2f} ms, tracking {stats['track_ms_mean']:.2f} ms on average")
+    print(f"Mouth centre moved {np.ptp(centers[:, 0]):.1f} px horizontally, {np.ptp(centers[:, 1]):.1f} px vertically")
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,252 @@
+"""Parallel input pipeline for training.
+
+Video decoding runs on a pool of worker threads or processes fed from a file
+list that is shuffled before anything is decoded. The workers hand back the
+uint8 crops and the encoded label; normalization, padding and batching then
+happen in the tf.data graph, so no ``tf.py_function`` sits on the hot path.
+
+With ``bucket_sizes`` clips are grouped by frame count and padded only up to
+their bucket, and every batch carries the true frame and label lengths:
+``(frames, labels, input_length, label_length)``.
+"""
+import os
+import time
+import random
+import multiprocessing
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+import tensorflow as tf
+
+from label_index import alignment_label, ensure_label_index
+
+FRAME_HEIGHT = 46
+FRAME_WIDTH = 140
+MAX_FRAMES = 75
+MAX_LABEL_LENGTH = 40
+
+
+def alignment_path_for(video_path: str) -> str:
+    """Map ``<data>/<speaker>/<clip>.mpg`` to ``<data>/alignments/<speaker>/<clip>.align``."""
+    speaker_dir, file_name = os.path.split(video_path)
+    data_dir, speaker = os.path.split(speaker_dir)
+    clip_id = os.path.splitext(file_name)[0]
+    return os.path.join(data_dir, 'alignments', speaker, f'{clip_id}.align')
+
+
+def decode_clip(video_path: str, max_frames: int = MAX_FRAMES):
+    """Decode one clip into at most ``max_frames`` uint8 crops and its int64 label vector."""
+    from utils import read_mouth_crops, crop_cache, CROP_PARAMS
+
+    if crop_cache is not None:
+        crops = crop_cache.get_or_compute(video_path, CROP_PARAMS, read_mouth_crops)
+    else:
+        crops = read_mouth_crops(video_path)
+    label = alignment_label(alignment_path_for(video_path))
+    return np.ascontiguousarray(crops[:max_frames], dtype=np.uint8), label.astype(np.int64)
+
+
+def make_executor(backend: str = 'thread', workers: int = None):
+    """Create the decode pool; processes use spawn so TF state is never forked."""
+    workers = workers or os.cpu_count() or 1
+    if backend == 'thread':
+        return ThreadPoolExecutor(max_workers=workers)
+    if backend == 'process':
+        return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    raise ValueError(f"Unknown decode backend: {backend}")
+
+
+def parallel_map(executor, fn, items, window: int, deterministic: bool = True):
+    """Yield ``fn(item)`` for every item with at most ``window`` calls in flight.
+
+    With ``deterministic=False`` results are yielded as soon as they finish,
+    so one slow clip does not hold back the ones decoded after it.
+    """
+    items = iter(items)
+    pending = []
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= window:
+            break
+
+    while pending:
+        if deterministic:
+            done = pending.pop(0)
+        else:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            done = next(iter(finished))
+            pending.remove(done)
+        for item in items:
+            pending.append(executor.submit(fn, item))
+            break
+        yield done.result()
+
+
+def standardize(frames):
+    """Zero-mean, unit-variance float32 copy of a clip, the same as video.normalize_crops.
+
+    A constant (e.g. black) clip has no variance; like normalize_crops it
+    becomes all zeros instead of NaN.
+    """
+    frames = tf.cast(frames, tf.float32)
+    mean = tf.math.reduce_mean(frames)
+    std = tf.math.reduce_std(frames)
+    return (frames - mean) / tf.where(std > 0, std, tf.ones_like(std))
+
+
+def normalize_frames(crops, label):
+    """Per-clip mean/std normalization of ``(T, H, W)`` uint8 crops into ``(T, H, W, 1)`` frames."""
+    return standardize(tf.expand_dims(crops, axis=-1)), label
+
+
+def with_lengths(frames, label):
+    """Append the clip's frame count and label length to a ``(frames, label)`` element."""
+    return frames, label, tf.shape(frames, out_type=tf.int64)[0], tf.shape(label, out_type=tf.int64)[0]
+
+
+def bucket_batches(dataset: tf.data.Dataset, batch_size: int, bucket_sizes) -> tf.data.Dataset:
+    """Batch ``(frames, label)`` elements by frame count into variable-length batches.
+
+    A clip goes to the smallest bucket that holds it and is zero-padded to that
+    bucket's size; clips longer than the largest bucket are truncated to it.
+    Labels are padded only to the longest label in their batch.
+    """
+    bucket_sizes = sorted(set(int(size) for size in bucket_sizes))
+    sizes = tf.constant(bucket_sizes, dtype=tf.int64)
+    dataset = dataset.map(lambda frames, label: with_lengths(frames[:bucket_sizes[-1]], label),
+                          num_parallel_calls=tf.data.AUTOTUNE)
+
+    def bucket_of(frames, label, input_length, label_length):
+        return tf.searchsorted(sizes, tf.reshape(input_length, [1]), out_type=tf.int64)[0]
+
+    def batch_bucket(bucket, window):
+        padded_shapes = (tf.stack([sizes[bucket], FRAME_HEIGHT, FRAME_WIDTH, 1]), [None], [], [])
+        return window.padded_batch(batch_size, padded_shapes=padded_shapes)
+
+    return dataset.group_by_window(bucket_of, batch_bucket, window_size=batch_size)
+
+
+class FileOrder(tf.Module):
+    """The shuffled file order of every epoch and how far training has read into it.
+
+    Each epoch's order is derived from ``seed`` and the epoch number, so the
+    position is just three variables: seed, epoch and clips consumed. Track
+    it in a ``tf.train.Checkpoint`` next to the model and a restored dataset
+    resumes at the first clip the interrupted run had not trained on.
+    """
+
+    def __init__(self, files, shuffle: bool = True, seed: int = None) -> None:
+        super().__init__()
+        self.files = list(files)
+        self.shuffle = shuffle
+        self.seed = tf.Variable(random.randrange(2 ** 31) if seed is None else seed, dtype=tf.int64,
+                                trainable=False)
+        self.epoch = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self.consumed = tf.Variable(0, dtype=tf.int64, trainable=False)
+
+    def next_pass(self) -> list:
+        """The files still to be read, moving on to the next epoch once one is used up."""
+        if int(self.consumed) >= len(self.files):
+            self.epoch.assign_add(1)
+            self.consumed.assign(0)
+        order = list(self.files)
+        if self.shuffle:
+            random.Random(int(self.seed) + int(self.epoch)).shuffle(order)
+        return order[int(self.consumed):]
+
+    def advance(self, count):
+        return self.consumed.assign_add(tf.cast(count, tf.int64))
+
+
+def make_dataset(files, batch_size: int = 4, backend: str = 'thread', workers: int = None,
+                 executor=None, deterministic: bool = True, shuffle: bool = True,
+                 seed: int = None, bucket_sizes=None) -> tf.data.Dataset:
+    """Build a batched dataset that decodes ``files`` on a worker pool.
+
+    The file list is reshuffled at the start of every epoch, before decoding,
+    and each worker returns raw uint8 crops so the cross-process payload stays
+    small. Pass ``executor`` to share one pool between several datasets.
+    With ``bucket_sizes`` batches are bucketed by frame count (see
+    ``bucket_batches``) instead of padded to ``MAX_FRAMES``.
+
+    ``files`` may be a ``FileOrder``, whose position advances as batches are
+    taken from the dataset; checkpoint it to resume mid-epoch. The position
+    is exact for deterministic, unbucketed batches; otherwise it can be off by
+    the few clips still buffered in the pipeline.
+    """
+    order = files if isinstance(files, FileOrder) else FileOrder(files, shuffle, seed)
+    # Build or refresh the label index once here rather than in every worker
+    for alignment_root in {os.path.dirname(os.path.dirname(alignment_path_for(f))) for f in order.files}:
+        ensure_label_index(alignment_root)
+    workers = workers or os.cpu_count() or 1
+    executor = executor or make_executor(backend, workers)
+    window = 2 * workers
+
+    decode = partial(decode_clip, max_frames=max(bucket_sizes)) if bucket_sizes else decode_clip
+
+    def generator():
+        yield from parallel_map(executor, decode, order.next_pass(), window, deterministic)
+
+    dataset = tf.data.Dataset.from_generator(
+        generator,
+        output_signature=(
+            tf.TensorSpec(shape=(None, FRAME_HEIGHT, FRAME_WIDTH), dtype=tf.uint8),
+            tf.TensorSpec(shape=(None,), dtype=tf.int64),
+        ),
+    )
+    dataset = dataset.map(normalize_frames, num_parallel_calls=tf.data.AUTOTUNE, deterministic=deterministic)
+    if bucket_sizes:
+        dataset = bucket_batches(dataset, batch_size, bucket_sizes)
+    else:
+        dataset = dataset.padded_batch(
+            batch_size, padded_shapes=([MAX_FRAMES, FRAME_HEIGHT, FRAME_WIDTH, 1], [MAX_LABEL_LENGTH])
+        )
+    dataset = dataset.prefetch(tf.data.AUTOTUNE)
+
+    def count_batch(*batch):
+        # Runs as each batch is handed to the consumer, after the prefetch buffer
+        consumed = tf.py_function(order.advance, [tf.shape(batch[0])[0]], Tout=tf.int64)
+        with tf.control_dependencies([consumed]):
+            return tuple(tf.identity(tensor) for tensor in batch)
+
+    options = tf.data.Options()
+    options.experimental_optimization.inject_prefetch = False
+    return dataset.map(count_batch).with_options(options)
+
+
+def measure_throughput(dataset: tf.data.Dataset, max_batches: int = None) -> dict:
+    """Iterate ``dataset`` without training and report clips per second."""
+    clips = 0
+    batches = 0
+    start = time.perf_counter()
+    for batch in dataset:
+        clips += int(batch[0].shape[0])
+        batches += 1
+        if max_batches and batches >= max_batches:
+            break
+    elapsed = time.perf_counter() - start
+    return {'clips': clips, 'batches': batches, 'seconds': elapsed,
+            'clips_per_sec': clips / elapsed if elapsed else 0.0}
+
+
+class ThroughputCallback(tf.keras.callbacks.Callback):
+    """Print training clips/sec at the end of every epoch."""
+
+    def __init__(self, batch_size: int) -> None:
+        super().__init__()
+        self.batch_size = batch_size
+        self.start = None
+        self.batches = 0
+
+    def on_epoch_begin(self, epoch, logs=None) -> None:
+        self.start = time.perf_counter()
+        self.batches = 0
+
+    def on_train_batch_end(self, batch, logs=None) -> None:
+        self.batches += 1
+
+    def on_epoch_end(self, epoch, logs=None) -> None:
+        elapsed = time.perf_counter() - self.start
+        clips = self.batches * self.batch_size
+        print(f"\nEpoch {epoch + 1}: {clips} clips in {elapsed:.1f}s ({clips / elapsed:.1f} clips/sec)")
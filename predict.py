@@ -0,0 +1,223 @@
+"""Batch transcription of a directory, glob or manifest of clips.
+
+Clips are decoded and preprocessed on parallel workers while the main thread
+groups them into fixed-size batches for the ``app/modelutil.load_predictor``
+network (the distilled student with ``LIPNET_MODEL=student``), CTC-decodes
+each batch and streams one JSON line per clip. A summary with clips/sec and
+p50/p99 per-clip latency goes to stderr at the end.
+
+Usage:
+    python predict.py data/s1
+    python predict.py "data/s1/bb*.mpg" --batch-size 8 --output predictions.jsonl
+    python predict.py --manifest clips.txt --workers 8 --backend process
+    python predict.py data/s1 --beam-width 8 --grammar grid
+    python predict.py new_speaker/ --localize 10
+    LIPNET_MODEL=student python predict.py data/s1
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+import video
+import tracing
+from crop_cache import CropCache, cache_enabled, collect_videos
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Same preprocessing and cache key as app/utils.load_video, so cached crops are
+# shared with the app; built here rather than imported because app/utils loads
+# TensorFlow, which the process-pool workers never need
+CROP_PARAMS = None
+decoder = None
+crop_cache = None
+
+
+@tracing.traced()
+def prepare_clip(path: str, localize_every: int = 0):
+    """Decode and normalize one clip into the model's ``(75, 46, 140, 1)`` input.
+
+    Runs in the worker pool and returns ``(path, frames, error)``; failures are
+    reported rather than raised so one bad file does not end the run. With
+    ``localize_every`` the mouth is found by ``mouth_roi.MouthLocalizer``,
+    detecting every that many frames, instead of the fixed GRID crop.
+    """
+    global CROP_PARAMS, decoder, crop_cache
+    if decoder is None:
+        decoder = video.get_decoder()
+        CROP_PARAMS = video.crop_params(decoder, 'cv2.COLOR_BGR2GRAY')
+        crop_cache = CropCache() if cache_enabled() else None
+
+    params = CROP_PARAMS
+    if localize_every:
+        from mouth_roi import MouthLocalizer, default_detector, read_localized_crops
+        params = dict(CROP_PARAMS, crop='localized', every=localize_every)
+
+        def read(clip_path):
+            localizer = MouthLocalizer(default_detector(), every=localize_every)
+            return read_localized_crops(clip_path, localizer, cv2.COLOR_BGR2GRAY, decoder)
+    else:
+        def read(clip_path):
+            return video.read_mouth_crops(clip_path, color_code=cv2.COLOR_BGR2GRAY, decoder=decoder)
+
+    try:
+        crops = crop_cache.get_or_compute(path, params, read) if crop_cache is not None else read(path)
+    except (ValueError, OSError) as e:
+        return path, None, str(e)
+    return path, video.normalize_crops(video.fit_frames(crops, video.NUM_FRAMES), stretch=True), None
+
+
+def read_manifest(path: str) -> list:
+    """Clip paths from a text file (one per line) or JSON lines with a ``video`` key."""
+    paths = []
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('{'):
+                line = json.loads(line)['video']
+            paths.append(line if os.path.isabs(line) else os.path.join(base, line))
+    return paths
+
+
+def percentile(values, q: float) -> float:
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def run_predictions(paths, output, batch_size: int = 4, workers: int = 4, backend: str = 'thread',
+                    beam_width: int = 0, grammar: str = None, localize_every: int = 0) -> dict:
+    """Transcribe ``paths`` and write one JSON line per clip to ``output``.
+
+    ``beam_width=0`` decodes greedily; otherwise ``ctc_decoder.beam_search_batch``
+    runs, constrained by the ``lexicon`` or ``grid`` grammar if one is given.
+    A path listed more than once (say by a glob and the manifest) is
+    transcribed once, at its first position.
+    """
+    import tensorflow as tf
+    from ctc_decoder import greedy_decode_batch
+    from pipeline import parallel_map
+
+    sys.path.append(os.path.join(BASE_DIR, 'app'))
+    from modelutil import load_predictor
+
+    if beam_width:
+        from ctc_decoder import Grammar, beam_search_batch
+        constraint = Grammar.from_alignments(grammar) if grammar else None
+
+    # Latencies are keyed by path, so every path may be in flight only once
+    paths = list(dict.fromkeys(paths))
+    # Serves the checkpoint or, with LIPNET_MODEL=student, the distilled student;
+    # batches are always padded to batch_size, so the one traced graph is reused
+    _, infer = load_predictor()
+    input_shape = (batch_size, video.NUM_FRAMES, 46, 140, 1)
+
+    if backend == 'process':
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    else:
+        executor = ThreadPoolExecutor(max_workers=workers)
+
+    submitted = {}
+    latencies = []
+    failures = 0
+    batch = np.zeros(input_shape, dtype=np.float32)
+    batch_paths = []
+    start = time.perf_counter()
+
+    def timed_prepare(path):
+        submitted[path] = time.perf_counter()
+        return path
+
+    def flush():
+        with tracing.span('inference', clips=len(batch_paths)):
+            yhat = infer(tf.constant(batch)).numpy()[:len(batch_paths)]
+        if beam_width:
+            with tracing.span('beam_search', beam_width=beam_width):
+                texts = beam_search_batch(yhat, beam_width, constraint)
+        else:
+            with tracing.span('ctc_decode'):
+                texts = greedy_decode_batch(yhat)
+        done = time.perf_counter()
+        for path, text in zip(batch_paths, texts):
+            latency = done - submitted.pop(path)
+            latencies.append(latency)
+            clip_id = os.path.splitext(os.path.basename(path))[0]
+            output.write(json.dumps({'clip': clip_id, 'path': path, 'text': text,
+                                     'latency_ms': round(latency * 1000, 2)}) + '\n')
+        output.flush()
+        batch_paths.clear()
+
+    with executor:
+        window = 2 * workers + batch_size
+        prepare = partial(prepare_clip, localize_every=localize_every)
+        results = parallel_map(executor, prepare, map(timed_prepare, paths), window, deterministic=False)
+        for path, frames, error in results:
+            if error is not None:
+                failures += 1
+                submitted.pop(path, None)
+                print(f"Error preprocessing {path}: {error}", file=sys.stderr)
+                continue
+            batch[len(batch_paths)] = frames
+            batch_paths.append(path)
+            if len(batch_paths) == batch_size:
+                flush()
+        if batch_paths:
+            flush()
+
+    elapsed = time.perf_counter() - start
+    return {
+        'clips': len(latencies),
+        'failed': failures,
+        'seconds': elapsed,
+        'clips_per_sec': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Transcribe a batch of clips with the LipNet model')
+    parser.add_argument('inputs', nargs='*', help='Video files, directories or glob patterns')
+    parser.add_argument('--manifest', help='Text or JSON lines file listing the clips')
+    parser.add_argument('--output', '-o', help='JSON lines output file (default: stdout)')
+    parser.add_argument('--batch-size', type=int, default=4, help='Clips per model batch')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Parallel decode workers')
+    parser.add_argument('--backend', choices=['thread', 'process'], default='thread', help='Decode worker pool type')
+    parser.add_argument('--beam-width', type=int, default=0, help='CTC beam width (0 decodes greedily)')
+    parser.add_argument('--grammar', choices=['lexicon', 'grid'],
+                        help='Constrain the beam search to words from the alignment corpus')
+    parser.add_argument('--localize', type=int, default=0, metavar='EVERY',
+                        help='Find the mouth with a face detector every EVERY frames instead of the GRID crop')
+    args = parser.parse_args()
+
+    paths = collect_videos(args.inputs)
+    if args.manifest:
+        paths.extend(read_manifest(args.manifest))
+    if not paths:
+        print("No clips to transcribe", file=sys.stderr)
+        return 1
+
+    output = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        stats = run_predictions(paths, output, args.batch_size, args.workers, args.backend,
+                                args.beam_width, args.grammar, args.localize)
+    finally:
+        if args.output:
+            output.close()
+
+    print(f"\nTranscribed {stats['clips']} clips ({stats['failed']} failed) in {stats['seconds']:.1f}s: "
+          f"{stats['clips_per_sec']:.1f} clips/sec, p50 {stats['p50_ms']:.0f} ms, p99 {stats['p99_ms']:.0f} ms",
+          file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
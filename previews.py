@@ -0,0 +1,110 @@
+"""Cached video previews for the Streamlit apps.
+
+The H.264 mp4 shown to the user and the GIF of what the model sees are built
+once per source-file content hash and kept in a byte-budgeted on-disk cache,
+so reruns and concurrent sessions reuse them instead of transcoding again.
+ffmpeg writes to a pipe and the GIF is encoded in memory; the apps get bytes
+and nothing is written to the working directory.
+"""
+import io
+import os
+import hashlib
+import subprocess
+
+import numpy as np
+from PIL import Image
+
+from crop_cache import BASE_DIR, evict_lru
+from video import FFmpegDecoder
+
+DEFAULT_PREVIEW_DIR = os.environ.get('LIPNET_PREVIEW_DIR', os.path.join(BASE_DIR, '.cache', 'previews'))
+DEFAULT_MAX_BYTES = int(os.environ.get('LIPNET_PREVIEW_BYTES', 512 * 1024 ** 2))
+PREVIEW_SUFFIXES = ('.mp4', '.gif')
+
+# (path, size, mtime) -> sha1 of the file contents, so unchanged files are hashed once
+_digests = {}
+
+
+def file_digest(path: str) -> str:
+    """SHA-1 of the file contents, memoized on path, size and mtime."""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    digest = _digests.get(key)
+    if digest is None:
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha1.update(chunk)
+        digest = _digests[key] = sha1.hexdigest()
+    return digest
+
+
+def ffmpeg_available() -> bool:
+    return FFmpegDecoder.available()
+
+
+class PreviewCache:
+    """Byte-budgeted LRU store of preview files named by content hash."""
+
+    def __init__(self, root: str = DEFAULT_PREVIEW_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def get_or_create(self, name: str, build) -> bytes:
+        """Return the bytes stored under ``name``, calling ``build()`` on a miss."""
+        path = os.path.join(self.root, name)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except FileNotFoundError:
+            pass
+
+        data = build()
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        evict_lru(self.root, self.max_bytes, suffix=PREVIEW_SUFFIXES)
+        return data
+
+
+preview_cache = PreviewCache()
+
+
+def transcode_mp4(path: str) -> bytes:
+    """Transcode ``path`` to browser-playable H.264 mp4 bytes through a pipe."""
+    command = [FFmpegDecoder.executable(), '-v', 'error', '-nostdin', '-i', path,
+               '-vcodec', 'libx264', '-pix_fmt', 'yuv420p', '-preset', 'ultrafast',
+               # Fragmented mp4 can be written to a non-seekable pipe
+               '-movflags', 'frag_keyframe+empty_moov', '-f', 'mp4', 'pipe:1']
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise ValueError(f"ffmpeg failed on {path}: {result.stderr.decode(errors='replace').strip()[-500:]}")
+    return result.stdout
+
+
+def encode_gif(frames: np.ndarray, fps: int = 10) -> bytes:
+    """Encode uint8 ``(T, H, W)`` frames as an animated GIF in memory."""
+    images = [Image.fromarray(frame) for frame in frames]
+    buffer = io.BytesIO()
+    images[0].save(buffer, format='GIF', save_all=True, append_images=images[1:],
+                   duration=int(1000 / fps), loop=0)
+    return buffer.getvalue()
+
+
+def mp4_preview(path: str) -> bytes:
+    """Cached H.264 mp4 of the source video."""
+    return preview_cache.get_or_create(f'{file_digest(path)}.mp4', lambda: transcode_mp4(path))
+
+
+def gif_preview(path: str, frames: np.ndarray, tag: str, fps: int = 10) -> bytes:
+    """Cached GIF of the model-view ``frames`` computed from ``path``.
+
+    ``tag`` names the preprocessing that produced the frames, so apps that
+    preprocess differently do not share GIFs.
+    """
+    name = f'{file_digest(path)}-{tag}-{fps}.gif'
+    return preview_cache.get_or_create(name, lambda: encode_gif(frames, fps))
@@ -0,0 +1,428 @@
+"""Local HTTP inference server with dynamic batching.
+
+Requests are queued and a single batching task combines them into batches of
+up to ``--max-batch`` clips, waiting at most ``--max-wait-ms`` for a batch to
+fill, before running the ``app/modelutil.load_model`` network on a worker
+thread. When the queue, or the uploads waiting to be decoded, reach
+``--queue-size`` new requests get ``503`` immediately instead of piling up.
+
+Endpoints:
+    POST /predict    body is a video file (any type ffmpeg/OpenCV can read) or,
+                     with ``Content-Type: application/x-npy``, a preprocessed
+                     ``(75, 46, 140)`` or ``(75, 46, 140, 1)`` float32 .npy array
+    GET  /metrics    Prometheus text: queue depth, batch sizes, latencies, and
+                     per-stage span histograms when ``LIPNET_TRACE`` is set
+    GET  /healthz    ``ok`` once the model is loaded
+
+Usage:
+    python serve.py serve --port 8000 --max-batch 8 --max-wait-ms 10
+    python serve.py loadgen data/s1 --concurrency 16 --requests 200
+"""
+import io
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+import video
+import tracing
+from crop_cache import collect_videos
+from ctc_decoder import greedy_decode_batch
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FRAME_SHAPE = (video.NUM_FRAMES, 46, 140, 1)
+MAX_BODY_BYTES = 64 * 1024 ** 2
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+class Histogram:
+    """Cumulative Prometheus-style histogram."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.total += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def render(self, name: str, help_text: str) -> list:
+        lines = [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+        for bound, count in zip(self.buckets, self.counts):
+            lines.append(f'{name}_bucket{{le="{bound}"}} {count}')
+        lines.append(f'{name}_bucket{{le="+Inf"}} {self.total}')
+        lines.append(f'{name}_sum {self.sum}')
+        lines.append(f'{name}_count {self.total}')
+        return lines
+
+
+class Metrics:
+    def __init__(self, max_batch: int):
+        self.requests = 0
+        self.rejected = 0
+        self.errors = 0
+        self.batch_sizes = Histogram(range(1, max_batch + 1))
+        self.queue_wait = Histogram(LATENCY_BUCKETS)
+        self.inference = Histogram(LATENCY_BUCKETS)
+        self.request_latency = Histogram(LATENCY_BUCKETS)
+
+    def render(self, queue_depth: int, queue_capacity: int) -> str:
+        lines = [
+            '# HELP lipnet_queue_depth Requests waiting to be batched',
+            '# TYPE lipnet_queue_depth gauge',
+            f'lipnet_queue_depth {queue_depth}',
+            '# HELP lipnet_queue_capacity Queue size before requests are rejected',
+            '# TYPE lipnet_queue_capacity gauge',
+            f'lipnet_queue_capacity {queue_capacity}',
+            '# HELP lipnet_requests_total Prediction requests received',
+            '# TYPE lipnet_requests_total counter',
+            f'lipnet_requests_total {self.requests}',
+            '# HELP lipnet_rejected_total Requests rejected because the queue was full',
+            '# TYPE lipnet_rejected_total counter',
+            f'lipnet_rejected_total {self.rejected}',
+            '# HELP lipnet_errors_total Requests that failed',
+            '# TYPE lipnet_errors_total counter',
+            f'lipnet_errors_total {self.errors}',
+        ]
+        lines += self.batch_sizes.render('lipnet_batch_size', 'Clips per model batch')
+        lines += self.queue_wait.render('lipnet_queue_wait_seconds', 'Time from enqueue to batch start')
+        lines += self.inference.render('lipnet_inference_seconds', 'Model and CTC decoding time per batch')
+        lines += self.request_latency.render('lipnet_request_seconds', 'End-to-end prediction latency')
+        return '\n'.join(lines) + '\n'
+
+
+class Predictor:
+    """Runs batches through the model and decodes them to text."""
+
+    def __init__(self):
+        import tensorflow as tf
+
+        sys.path.append(os.path.join(BASE_DIR, 'app'))
+        from modelutil import load_predictor
+
+        self.tf = tf
+        self.model, self.predict = load_predictor()
+
+    def __call__(self, batch: np.ndarray) -> list:
+        tf = self.tf
+        with tracing.span('inference', clips=len(batch)):
+            yhat = self.predict(tf.constant(batch)).numpy()
+        with tracing.span('ctc_decode'):
+            return greedy_decode_batch(yhat)
+
+
+@tracing.traced()
+def preprocess_video(data: bytes) -> np.ndarray:
+    """Decode uploaded video bytes into the model's normalized input."""
+    with tempfile.NamedTemporaryFile(suffix='.video') as f:
+        f.write(data)
+        f.flush()
+        try:
+            crops = video.read_mouth_crops(f.name, color_code=cv2.COLOR_BGR2GRAY)
+        except ValueError:
+            raise ValueError("Could not decode the uploaded video")
+    return video.normalize_crops(video.fit_frames(crops, video.NUM_FRAMES), stretch=True)
+
+
+def preprocess_tensor(data: bytes) -> np.ndarray:
+    """Load an uploaded .npy array of already preprocessed frames."""
+    frames = np.load(io.BytesIO(data), allow_pickle=False).astype(np.float32, copy=False)
+    if frames.shape == FRAME_SHAPE[:-1]:
+        frames = frames[..., np.newaxis]
+    if frames.shape != FRAME_SHAPE:
+        raise ValueError(f"Expected an array of shape {FRAME_SHAPE}, got {frames.shape}")
+    return frames
+
+
+class BatchingServer:
+    def __init__(self, predictor, max_batch: int = 8, max_wait_ms: float = 10.0,
+                 queue_size: int = 64, preprocess_workers: int = 4):
+        self.predictor = predictor
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        # Uploads held in memory while waiting for or running preprocessing
+        self.preprocess_slots = asyncio.Semaphore(queue_size)
+        self.metrics = Metrics(max_batch)
+        # Decoding uploads and running the model both happen off the event loop
+        self.preprocess_pool = ThreadPoolExecutor(max_workers=preprocess_workers)
+        self.model_pool = ThreadPoolExecutor(max_workers=1)
+
+    async def batch_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(items) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            started = time.perf_counter()
+            for _, _, enqueued in items:
+                self.metrics.queue_wait.observe(started - enqueued)
+            self.metrics.batch_sizes.observe(len(items))
+
+            batch = np.stack([frames for frames, _, _ in items])
+            try:
+                texts = await loop.run_in_executor(self.model_pool, self.predictor, batch)
+            except Exception as e:
+                for _, future, _ in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.metrics.inference.observe(time.perf_counter() - started)
+            for (_, future, _), text in zip(items, texts):
+                if not future.done():
+                    future.set_result(text)
+
+    async def predict(self, content_type: str, body: bytes):
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        self.metrics.requests += 1
+
+        if self.queue.full() or self.preprocess_slots.locked():
+            self.metrics.rejected += 1
+            return 503, {'error': 'queue full, retry later'}
+
+        preprocess = preprocess_tensor if content_type == 'application/x-npy' else preprocess_video
+        async with self.preprocess_slots:
+            try:
+                frames = await loop.run_in_executor(self.preprocess_pool, preprocess, body)
+            except Exception as e:
+                # Malformed uploads raise anything from ValueError to EOFError or UnpicklingError
+                self.metrics.errors += 1
+                return 400, {'error': str(e) or type(e).__name__}
+
+        future = loop.create_future()
+        try:
+            self.queue.put_nowait((frames, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.metrics.rejected += 1
+            return 503, {'error': 'queue full, retry later'}
+
+        try:
+            text = await future
+        except Exception as e:
+            self.metrics.errors += 1
+            return 500, {'error': str(e)}
+
+        latency = time.perf_counter() - start
+        self.metrics.request_latency.observe(latency)
+        return 200, {'text': text, 'latency_ms': round(latency * 1000, 2)}
+
+    async def handle(self, reader, writer) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                parts = request_line.decode('latin-1').split(' ', 2)
+                if len(parts) != 3:
+                    raise ValueError('malformed request line')
+                method, target, _ = parts
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                try:
+                    length = int(headers.get('content-length', 0))
+                except ValueError:
+                    raise ValueError('invalid Content-Length')
+                if length < 0:
+                    raise ValueError('invalid Content-Length')
+                if length > MAX_BODY_BYTES:
+                    await self.respond(writer, 413, {'error': 'body too large'})
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                path = target.split('?', 1)[0]
+                if path == '/predict' and method == 'POST':
+                    content_type = headers.get('content-type', '').split(';')[0].strip()
+                    status, payload = await self.predict(content_type, body)
+                    await self.respond(writer, status, payload)
+                elif path == '/metrics' and method == 'GET':
+                    text = self.metrics.render(self.queue.qsize(), self.queue.maxsize)
+                    if tracing.enabled():
+                        text += tracing.prometheus_text()
+                    await self.respond(writer, 200, text, 'text/plain; version=0.0.4')
+                elif path == '/healthz' and method == 'GET':
+                    await self.respond(writer, 200, 'ok\n', 'text/plain')
+                elif path in ('/predict', '/metrics', '/healthz'):
+                    await self.respond(writer, 405, {'error': 'method not allowed'})
+                else:
+                    await self.respond(writer, 404, {'error': 'not found'})
+
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except ValueError as e:
+            # An unparseable request: answer it, then drop the connection since framing is lost
+            self.metrics.errors += 1
+            try:
+                await self.respond(writer, 400, {'error': str(e) or 'bad request'})
+            except ConnectionError:
+                pass
+        except Exception as e:
+            self.metrics.errors += 1
+            try:
+                await self.respond(writer, 500, {'error': str(e) or type(e).__name__})
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def respond(writer, status: int, payload, content_type: str = 'application/json') -> None:
+        body = payload if isinstance(payload, str) else json.dumps(payload)
+        body = body.encode('utf-8')
+        head = (f'HTTP/1.1 {status} {REASONS.get(status, "")}\r\n'
+                f'Content-Type: {content_type}\r\n'
+                f'Content-Length: {len(body)}\r\n\r\n')
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+
+async def run_server(args) -> None:
+    predictor = Predictor()
+    server = BatchingServer(predictor, args.max_batch, args.max_wait_ms, args.queue_size, args.workers)
+    batcher = asyncio.create_task(server.batch_loop())
+    http = await asyncio.start_server(server.handle, args.host, args.port)
+    print(f"Serving on http://{args.host}:{args.port} "
+          f"(max batch {args.max_batch}, max wait {args.max_wait_ms} ms, queue {args.queue_size})")
+    async with http:
+        await http.serve_forever()
+    batcher.cancel()
+
+
+async def post(host: str, port: int, body: bytes, content_type: str):
+    """Minimal HTTP/1.1 POST /predict used by the load generator."""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        head = (f'POST /predict HTTP/1.1\r\nHost: {host}\r\nContent-Type: {content_type}\r\n'
+                f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n')
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            if line.lower().startswith(b'content-length:'):
+                length = int(line.split(b':', 1)[1])
+        return status, json.loads(await reader.readexactly(length))
+    finally:
+        writer.close()
+
+
+async def run_loadgen(args) -> dict:
+    """Fire ``args.requests`` predictions with ``args.concurrency`` in flight."""
+    paths = collect_videos(args.inputs)
+    if not paths:
+        raise ValueError(f"No clips found in: {' '.join(args.inputs)}")
+
+    if args.tensors:
+        payloads = []
+        for path in paths:
+            crops = video.read_mouth_crops(path, color_code=cv2.COLOR_BGR2GRAY)
+            buffer = io.BytesIO()
+            np.save(buffer, video.normalize_crops(video.fit_frames(crops), stretch=True))
+            payloads.append((buffer.getvalue(), 'application/x-npy'))
+    else:
+        payloads = []
+        for path in paths:
+            with open(path, 'rb') as f:
+                payloads.append((f.read(), 'video/mpeg'))
+
+    latencies = []
+    statuses = {}
+    counter = iter(range(args.requests))
+
+    async def client():
+        for i in counter:
+            body, content_type = payloads[i % len(payloads)]
+            start = time.perf_counter()
+            try:
+                status, _ = await post(args.host, args.port, body, content_type)
+            except OSError:
+                status = 'connection error'
+            statuses[status] = statuses.get(status, 0) + 1
+            if status == 200:
+                latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        'requests': args.requests,
+        'statuses': statuses,
+        'seconds': elapsed,
+        'clips_per_sec': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': float(np.percentile(latencies, 50)) * 1000 if latencies else 0.0,
+        'p99_ms': float(np.percentile(latencies, 99)) * 1000 if latencies else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='LipNet inference server with dynamic batching')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = subparsers.add_parser('serve', help='Run the HTTP server')
+    serve_parser.add_argument('--host', default='127.0.0.1', help='Interface to bind')
+    serve_parser.add_argument('--port', type=int, default=8000, help='Port to listen on')
+    serve_parser.add_argument('--max-batch', type=int, default=8, help='Largest batch sent to the model')
+    serve_parser.add_argument('--max-wait-ms', type=float, default=10.0, help='Longest wait for a batch to fill')
+    serve_parser.add_argument('--queue-size', type=int, default=64, help='Queued requests before rejecting with 503')
+    serve_parser.add_argument('--workers', type=int, default=4, help='Threads decoding uploaded videos')
+
+    load_parser = subparsers.add_parser('loadgen', help='Send concurrent requests to a running server')
+    load_parser.add_argument('inputs', nargs='+', help='Video files, directories or glob patterns to upload')
+    load_parser.add_argument('--host', default='127.0.0.1', help='Server host')
+    load_parser.add_argument('--port', type=int, default=8000, help='Server port')
+    load_parser.add_argument('--concurrency', type=int, default=8, help='Requests in flight')
+    load_parser.add_argument('--requests', type=int, default=100, help='Total requests to send')
+    load_parser.add_argument('--tensors', action='store_true', help='Upload preprocessed .npy tensors instead of videos')
+
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        try:
+            asyncio.run(run_server(args))
+        except KeyboardInterrupt:
+            pass
+    elif args.command == 'loadgen':
+        stats = asyncio.run(run_loadgen(args))
+        print(f"{stats['requests']} requests in {stats['seconds']:.1f}s: {stats['clips_per_sec']:.1f} clips/sec, "
+              f"p50 {stats['p50_ms']:.0f} ms, p99 {stats['p99_ms']:.0f} ms")
+        print(f"Status codes: {stats['statuses']}")
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
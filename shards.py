@@ -0,0 +1,206 @@
+"""Sharded TFRecord dataset for the GRID corpus.
+
+The builder packs the uint8 mouth crops and the encoded alignment labels of
+every clip into fixed-size TFRecord shards, so training reads a handful of
+large sequential files instead of decoding MPEGs and parsing alignments per
+sample. The reader interleaves the shards with parallel reads through tf.data.
+
+Usage:
+    python shards.py build --data-dir data --out-dir shards
+    python shards.py build --data-dir data --speakers s1 s2 --shard-size 256
+    python shards.py inspect shards
+"""
+import os
+import glob
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import tensorflow as tf
+
+from utils import read_mouth_crops, crop_cache, CROP_PARAMS
+from label_index import alignment_label, ensure_label_index
+from manifest import ensure_manifest
+from pipeline import bucket_batches, standardize, FRAME_HEIGHT, FRAME_WIDTH, MAX_FRAMES, MAX_LABEL_LENGTH
+
+FEATURES = {
+    'clip_id': tf.io.FixedLenFeature([], tf.string),
+    'speaker': tf.io.FixedLenFeature([], tf.string),
+    'frames': tf.io.FixedLenFeature([], tf.string),
+    'num_frames': tf.io.FixedLenFeature([], tf.int64),
+    'label': tf.io.VarLenFeature(tf.int64),
+}
+
+
+def find_clips(data_dir: str, speakers=None):
+    """List ``(speaker, clip_id, video_path, alignment_path)`` for every clip.
+
+    Speakers are the ``s*`` folders of ``data_dir``, read from its manifest;
+    clips without an alignment file are skipped.
+    """
+    manifest = ensure_manifest(data_dir)
+    if manifest is None:
+        return []
+    if not speakers:
+        speakers = [speaker for speaker in manifest.speakers if speaker.startswith('s')]
+    clips = []
+    for speaker in speakers:
+        for record in manifest.select(speaker, extensions=('.mpg',)):
+            video_path = manifest.video_path(record)
+            if record['alignment'] is not None:
+                clips.append((speaker, record['id'], video_path, manifest.alignment_path(record)))
+            else:
+                print(f"Warning: No alignment for {video_path}, skipping")
+    return clips
+
+
+def encode_clip(speaker: str, clip_id: str, video_path: str, alignment_path: str) -> bytes:
+    """Serialize one clip's crops and label into a tf.train.Example."""
+    if crop_cache is not None:
+        crops = crop_cache.get_or_compute(video_path, CROP_PARAMS, read_mouth_crops)
+    else:
+        crops = read_mouth_crops(video_path)
+    crops = np.ascontiguousarray(crops[:MAX_FRAMES], dtype=np.uint8)
+    label = alignment_label(alignment_path)
+
+    feature = {
+        'clip_id': tf.train.Feature(bytes_list=tf.train.BytesList(value=[clip_id.encode('utf-8')])),
+        'speaker': tf.train.Feature(bytes_list=tf.train.BytesList(value=[speaker.encode('utf-8')])),
+        'frames': tf.train.Feature(bytes_list=tf.train.BytesList(value=[crops.tobytes()])),
+        'num_frames': tf.train.Feature(int64_list=tf.train.Int64List(value=[crops.shape[0]])),
+        'label': tf.train.Feature(int64_list=tf.train.Int64List(value=label.tolist())),
+    }
+    return tf.train.Example(features=tf.train.Features(feature=feature)).SerializeToString()
+
+
+def build_shards(data_dir: str, out_dir: str, speakers=None, shard_size: int = 128,
+                 workers: int = 4, seed: int = 0) -> list:
+    """Write every clip of ``data_dir`` into shards of ``shard_size`` examples.
+
+    Clips are shuffled once with ``seed`` before sharding so each shard mixes
+    speakers. Returns the list of shard paths.
+    """
+    clips = find_clips(data_dir, speakers)
+    if not clips:
+        raise ValueError(f"No clips with alignments found in: {data_dir}")
+    np.random.default_rng(seed).shuffle(clips)
+    ensure_label_index(os.path.join(data_dir, 'alignments'))
+
+    os.makedirs(out_dir, exist_ok=True)
+    num_shards = (len(clips) + shard_size - 1) // shard_size
+    shard_paths = []
+    start = time.time()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for shard_index in range(num_shards):
+            batch = clips[shard_index * shard_size:(shard_index + 1) * shard_size]
+            shard_path = os.path.join(out_dir, f'grid-{shard_index:05d}-of-{num_shards:05d}.tfrecord')
+            tmp_path = f'{shard_path}.tmp'
+            with tf.io.TFRecordWriter(tmp_path) as writer:
+                for record in executor.map(lambda clip: encode_clip(*clip), batch):
+                    writer.write(record)
+            os.replace(tmp_path, shard_path)
+            shard_paths.append(shard_path)
+            print(f"Wrote {shard_path} ({len(batch)} clips, {time.time() - start:.1f}s elapsed)")
+
+    return shard_paths
+
+
+def parse_example(record):
+    """Decode a serialized example into normalized frames and a label vector."""
+    example = tf.io.parse_single_example(record, FEATURES)
+    frames = tf.io.decode_raw(example['frames'], tf.uint8)
+    frames = tf.reshape(frames, [example['num_frames'], FRAME_HEIGHT, FRAME_WIDTH, 1])
+
+    # Same normalization as video.normalize_crops, zero-variance clips included
+    frames = standardize(frames)
+
+    label = tf.sparse.to_dense(example['label'])
+    return frames, label
+
+
+def load_shards(files, batch_size: int = 4, shuffle_buffer: int = 256, cycle_length: int = None,
+                deterministic: bool = False, bucket_sizes=None) -> tf.data.Dataset:
+    """Read shards through a parallel interleave into padded batches.
+
+    ``files`` is a list of shard paths or a glob pattern. With
+    ``deterministic=False`` tf.data may return elements out of order, which
+    keeps slow shards from stalling the pipeline. ``bucket_sizes`` batches by
+    frame count with true lengths, like ``pipeline.make_dataset``.
+    """
+    if isinstance(files, str):
+        files = sorted(glob.glob(files))
+    if not files:
+        raise ValueError("No shard files to read")
+
+    dataset = tf.data.Dataset.from_tensor_slices(files)
+    dataset = dataset.shuffle(len(files), reshuffle_each_iteration=True)
+    dataset = dataset.interleave(
+        tf.data.TFRecordDataset,
+        cycle_length=cycle_length or min(len(files), os.cpu_count() or 1),
+        num_parallel_calls=tf.data.AUTOTUNE,
+        deterministic=deterministic,
+    )
+    if shuffle_buffer:
+        dataset = dataset.shuffle(shuffle_buffer)
+    dataset = dataset.map(parse_example, num_parallel_calls=tf.data.AUTOTUNE, deterministic=deterministic)
+    if bucket_sizes:
+        dataset = bucket_batches(dataset, batch_size, bucket_sizes)
+    else:
+        dataset = dataset.padded_batch(
+            batch_size, padded_shapes=([MAX_FRAMES, FRAME_HEIGHT, FRAME_WIDTH, 1], [MAX_LABEL_LENGTH])
+        )
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+def split_shards(shard_dir: str, val_fraction: float = 0.2):
+    """Split the shards of ``shard_dir`` into train and validation file lists.
+
+    Whole shards go to validation, so at least two are needed; rebuild small
+    corpora with a lower ``--shard-size``.
+    """
+    files = sorted(glob.glob(os.path.join(shard_dir, '*.tfrecord')))
+    if not files:
+        raise ValueError(f"No shards found in: {shard_dir}")
+    if len(files) < 2:
+        raise ValueError(f"Only one shard in {shard_dir}; training needs at least 2 to hold out validation "
+                         f"shards. Rebuild with a smaller --shard-size, e.g. "
+                         f"python shards.py build --shard-size 16")
+    val_count = max(1, int(len(files) * val_fraction))
+    return files[val_count:], files[:val_count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or inspect GRID TFRecord shards')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help='Pack clips and labels into shards')
+    build_parser.add_argument('--data-dir', default='data', help='Directory with s*/ videos and alignments/s*/')
+    build_parser.add_argument('--out-dir', default='shards', help='Output directory for the shards')
+    build_parser.add_argument('--speakers', nargs='*', help='Speaker folders to include (default: all)')
+    build_parser.add_argument('--shard-size', type=int, default=128, help='Clips per shard')
+    build_parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Decoding threads')
+    build_parser.add_argument('--seed', type=int, default=0, help='Seed for the clip shuffle')
+
+    inspect_parser = subparsers.add_parser('inspect', help='Count clips in existing shards')
+    inspect_parser.add_argument('shard_dir', help='Directory with .tfrecord shards')
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        shards = build_shards(args.data_dir, args.out_dir, args.speakers, args.shard_size, args.workers, args.seed)
+        print(f"\nWrote {len(shards)} shards to {args.out_dir}")
+    elif args.command == 'inspect':
+        files = sorted(glob.glob(os.path.join(args.shard_dir, '*.tfrecord')))
+        total = 0
+        for path in files:
+            count = sum(1 for _ in tf.data.TFRecordDataset(path))
+            total += count
+            print(f"{os.path.basename(path)}: {count} clips")
+        print(f"\nTotal: {total} clips in {len(files)} shards")
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
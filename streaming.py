@@ -0,0 +1,362 @@
+"""Streaming transcription over a live or file-backed frame source.
+
+Frames are cropped, stretched and normalized one at a time as they arrive,
+with running statistics in place of the per-clip mean/std. The serving model
+is bidirectional and trained on 75-frame clips, so it runs as a chunked
+sliding window: every ``--hop`` new frames it sees the latest 75, and the
+frames at least ``--lookahead`` frames behind the newest one are committed
+through an incremental greedy CTC decoder. Frames still inside the lookahead
+give the tentative tail of the partial transcript.
+
+Latency is measured from the moment a frame became available (for a file
+replayed in real time, the moment it would have been captured) to the moment
+the character that starts on that frame is committed.
+
+Usage:
+    python streaming.py data/s1/bbaf2n.mpg
+    python streaming.py data/s1/bbaf2n.mpg --hop 10 --lookahead 15 --output events.jsonl
+    python streaming.py --camera 0 --localize 10
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from collections import deque
+
+import cv2
+import numpy as np
+
+import video
+from vocab import BLANK, CHARS
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class FrameSource:
+    """Iterates ``(available_at, frame)`` pairs of full-size BGR frames.
+
+    ``available_at`` is a ``time.perf_counter()`` timestamp of when the frame
+    was captured, so latencies measured against it include any backlog.
+    """
+    fps = 25.0
+
+    def __iter__(self):
+        raise NotImplementedError
+
+
+class VideoFileSource(FrameSource):
+    """Replays a video file at its own frame rate, as if it were a camera.
+
+    With ``realtime=False`` frames are returned as fast as they decode and
+    stamped when read, so latencies only cover processing.
+    """
+
+    def __init__(self, path: str, realtime: bool = True):
+        self.path = path
+        self.realtime = realtime
+        cap = cv2.VideoCapture(path)
+        if not cap.isOpened():
+            raise ValueError(f"Could not open video file: {path}")
+        self.fps = cap.get(cv2.CAP_PROP_FPS) or FrameSource.fps
+        cap.release()
+
+    def __iter__(self):
+        cap = cv2.VideoCapture(self.path)
+        start = time.perf_counter()
+        index = 0
+        try:
+            while True:
+                ok, frame = cap.read()
+                if not ok:
+                    break
+                if self.realtime:
+                    available_at = start + index / self.fps
+                    delay = available_at - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                else:
+                    available_at = time.perf_counter()
+                yield available_at, frame
+                index += 1
+        finally:
+            cap.release()
+
+
+class CameraSource(FrameSource):
+    """Frames from a live capture device."""
+
+    def __init__(self, index: int = 0):
+        self.index = index
+
+    def __iter__(self):
+        cap = cv2.VideoCapture(self.index)
+        if not cap.isOpened():
+            raise ValueError(f"Could not open camera: {self.index}")
+        self.fps = cap.get(cv2.CAP_PROP_FPS) or FrameSource.fps
+        try:
+            while True:
+                ok, frame = cap.read()
+                if not ok:
+                    break
+                yield time.perf_counter(), frame
+        finally:
+            cap.release()
+
+
+class RunningNormalizer:
+    """Causal stand-in for the per-clip mean/std of ``video.normalize_crops``.
+
+    Statistics cover every pixel seen so far (Welford's parallel update), or
+    with ``momentum`` an exponential average that follows lighting changes
+    on long feeds.
+    """
+
+    def __init__(self, momentum: float = None):
+        self.momentum = momentum
+        self.count = 0
+        self.mean = 0.0
+        self.var = 0.0
+
+    @property
+    def std(self) -> float:
+        return self.var ** 0.5
+
+    def update(self, frame: np.ndarray) -> None:
+        frame_mean, frame_std = cv2.meanStdDev(frame)
+        frame_mean, frame_var = float(frame_mean[0, 0]), float(frame_std[0, 0]) ** 2
+        n = frame.size
+        delta = frame_mean - self.mean
+        if self.momentum is not None and self.count:
+            self.mean += self.momentum * delta
+            self.var = (1 - self.momentum) * (self.var + self.momentum * delta ** 2) + self.momentum * frame_var
+        else:
+            total = self.count + n
+            self.mean += delta * n / total
+            self.var = (self.var * self.count + frame_var * n + delta ** 2 * self.count * n / total) / total
+        self.count += n
+
+    def __call__(self, frame: np.ndarray) -> np.ndarray:
+        """Update with the uint8 ``(H, W)`` frame and return it normalized as ``(H, W, 1)``."""
+        self.update(frame)
+        normalized = frame.astype(np.float32)[..., np.newaxis]
+        normalized -= self.mean
+        if self.std > 0:
+            normalized /= self.std
+        return normalized
+
+
+class IncrementalCTCDecoder:
+    """Greedy CTC over per-frame tokens that arrive in chunks.
+
+    The last token seen is kept between chunks, so a repeated character that
+    spans a chunk boundary still collapses to one.
+    """
+
+    def __init__(self, blank: int = BLANK):
+        self.blank = blank
+        self.chars = CHARS
+        self.previous = blank
+        self.text = []
+
+    def _collapse(self, tokens, previous):
+        for offset, token in enumerate(tokens):
+            if token != previous and token != self.blank and token < len(self.chars):
+                yield offset, self.chars[token]
+            previous = token
+
+    def push(self, tokens) -> list:
+        """Commit ``tokens``; returns ``(offset, char)`` for every new character."""
+        tokens = [int(t) for t in tokens]
+        emitted = list(self._collapse(tokens, self.previous))
+        if tokens:
+            self.previous = tokens[-1]
+        self.text.extend(char for _, char in emitted)
+        return emitted
+
+    def peek(self, tokens) -> str:
+        """Characters ``tokens`` would add, without committing them."""
+        return ''.join(char for _, char in self._collapse([int(t) for t in tokens], self.previous))
+
+    @property
+    def transcript(self) -> str:
+        return ''.join(self.text)
+
+
+class StreamingTranscriber:
+    """Sliding-window transcription of a frame stream with ``predict``.
+
+    ``predict`` maps a ``(1, window, 46, 140, 1)`` batch to per-frame class
+    probabilities, e.g. ``app/modelutil.make_predict_fn``.
+    """
+
+    def __init__(self, predict, window: int = video.NUM_FRAMES, hop: int = 15, lookahead: int = 10,
+                 normalizer: RunningNormalizer = None, localizer=None):
+        # A hop past window - lookahead would slide frames out before they were committed
+        if not 0 <= lookahead < window or not 1 <= hop <= window - lookahead:
+            raise ValueError("Need 0 <= lookahead < window and 1 <= hop <= window - lookahead")
+        self.predict = predict
+        self.window = window
+        self.hop = hop
+        self.lookahead = lookahead
+        self.normalizer = normalizer or RunningNormalizer()
+        self.decoder = IncrementalCTCDecoder()
+        self.frames = deque(maxlen=window)
+        self.times = deque(maxlen=window)
+        self.count = 0
+        self.committed = 0
+        self.last_run = 0
+        self.inference_seconds = []
+        self.char_latencies = []
+        self.partial_lags = []
+        # A mouth_roi.MouthLocalizer replaces the fixed GRID crop
+        self.localizer = localizer
+        top, bottom, left, right = video.MOUTH_CROP
+        self.crop = (slice(top, bottom), slice(left, right))
+
+    def preprocess(self, frame: np.ndarray) -> np.ndarray:
+        """Crop, convert and stretch one BGR frame the way ``app/utils.load_video`` does."""
+        mouth = self.localizer.process(frame) if self.localizer is not None else frame[self.crop]
+        gray = cv2.cvtColor(mouth, cv2.COLOR_BGR2GRAY)
+        gray = cv2.normalize(gray, None, 0, 255, cv2.NORM_MINMAX)
+        return self.normalizer(gray)
+
+    def push(self, available_at: float, frame: np.ndarray):
+        """Add one frame; returns an update dict whenever the model ran."""
+        self.frames.append(self.preprocess(frame))
+        self.times.append(available_at)
+        self.count += 1
+        if self.count - self.last_run >= self.hop:
+            return self.run()
+        return None
+
+    def flush(self):
+        """Commit every remaining frame at the end of the stream."""
+        if self.count > self.committed:
+            return self.run(final=True)
+        return None
+
+    def run(self, final: bool = False) -> dict:
+        frames = list(self.frames)
+        # Until a full window has arrived, repeat the first frame in front (like video.fit_frames at the tail)
+        padding = self.window - len(frames)
+        batch = np.stack([frames[0]] * padding + frames)[np.newaxis]
+
+        start = time.perf_counter()
+        probabilities = np.asarray(self.predict(batch))[0]
+        self.inference_seconds.append(time.perf_counter() - start)
+        tokens = probabilities.argmax(axis=-1)
+
+        window_start = self.count - self.window  # absolute index of tokens[0]
+        commit_from = max(self.committed, window_start, 0)
+        commit_until = self.count if final else max(self.count - self.lookahead, commit_from)
+        emitted = self.decoder.push(tokens[commit_from - window_start:commit_until - window_start])
+        tentative = self.decoder.peek(tokens[commit_until - window_start:])
+
+        now = time.perf_counter()
+        oldest = self.count - len(self.times)
+        new_chars = []
+        for offset, char in emitted:
+            latency = now - self.times[commit_from + offset - oldest]
+            self.char_latencies.append(latency)
+            new_chars.append({'char': char, 'frame': commit_from + offset, 'latency_ms': round(latency * 1000, 1)})
+        self.partial_lags.append(now - self.times[-1])
+
+        self.committed = commit_until
+        self.last_run = self.count
+        return {'frame': self.count, 'text': self.decoder.transcript, 'partial': self.decoder.transcript + tentative,
+                'new_chars': new_chars, 'final': final}
+
+    def stats(self) -> dict:
+        def ms(values, q):
+            return float(np.percentile(values, q)) * 1000 if values else 0.0
+        return {
+            'frames': self.count,
+            'inferences': len(self.inference_seconds),
+            'inference_mean_ms': float(np.mean(self.inference_seconds)) * 1000 if self.inference_seconds else 0.0,
+            'char_latency_p50_ms': ms(self.char_latencies, 50),
+            'char_latency_p95_ms': ms(self.char_latencies, 95),
+            'partial_lag_p50_ms': ms(self.partial_lags, 50),
+            'partial_lag_p95_ms': ms(self.partial_lags, 95),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Transcribe a live or replayed video stream')
+    parser.add_argument('video', nargs='?', help='Video file to replay as a live source')
+    parser.add_argument('--camera', type=int, help='Capture device index to read from instead of a file')
+    parser.add_argument('--no-realtime', action='store_true', help='Read the file as fast as possible')
+    parser.add_argument('--hop', type=int, default=15, help='New frames between model runs')
+    parser.add_argument('--lookahead', type=int, default=10,
+                        help='Frames of right context before a frame is committed')
+    parser.add_argument('--momentum', type=float,
+                        help='Exponential normalization statistics instead of cumulative ones')
+    parser.add_argument('--output', '-o', help='Write every update as a JSON line to this file')
+    parser.add_argument('--localize', type=int, default=0, metavar='EVERY',
+                        help='Find the mouth with a face detector every EVERY frames instead of the GRID crop')
+    args = parser.parse_args()
+
+    if args.camera is not None:
+        source = CameraSource(args.camera)
+    elif args.video:
+        source = VideoFileSource(args.video, realtime=not args.no_realtime)
+    else:
+        parser.error('Give a video file or --camera')
+
+    sys.path.append(os.path.join(BASE_DIR, 'app'))
+    from modelutil import load_predictor
+
+    _, predict = load_predictor()
+    localizer = None
+    if args.localize:
+        from mouth_roi import MouthLocalizer, default_detector
+        localizer = MouthLocalizer(default_detector(), every=args.localize)
+    transcriber = StreamingTranscriber(lambda batch: predict(batch).numpy(), hop=args.hop,
+                                       lookahead=args.lookahead, normalizer=RunningNormalizer(args.momentum),
+                                       localizer=localizer)
+    output = open(args.output, 'w') if args.output else None
+    start = time.perf_counter()
+
+    def report(update):
+        if update is None:
+            return
+        print(f"[{time.perf_counter() - start:6.2f}s frame {update['frame']:4d}] {update['partial']}")
+        if output:
+            output.write(json.dumps(update) + '\n')
+
+    try:
+        for available_at, frame in source:
+            report(transcriber.push(available_at, frame))
+        report(transcriber.flush())
+    except KeyboardInterrupt:
+        report(transcriber.flush())
+    finally:
+        if output:
+            output.close()
+
+    elapsed = time.perf_counter() - start
+    stats = transcriber.stats()
+    print(f"\nTranscript: {transcriber.decoder.transcript}")
+    print(f"{stats['frames']} frames in {elapsed:.1f}s, {stats['inferences']} model runs "
+          f"({stats['inference_mean_ms']:.0f} ms mean)")
+    print(f"Frame-to-character latency: p50 {stats['char_latency_p50_ms']:.0f} ms, "
+          f"p95 {stats['char_latency_p95_ms']:.0f} ms")
+    print(f"Partial transcript lag: p50 {stats['partial_lag_p50_ms']:.0f} ms, "
+          f"p95 {stats['partial_lag_p95_ms']:.0f} ms")
+    if localizer is not None:
+        roi = localizer.stats(source.fps)
+        print(f"Mouth localization: {roi['frame_ms_mean']:.2f} ms/frame mean, {roi['frame_ms_p95']:.2f} ms p95 "
+              f"of a {roi['budget_ms']:.0f} ms budget, {roi['detections']} detections")
+
+    if args.video:
+        from evaluation import error_rates, reference_text
+        from pipeline import alignment_path_for
+        alignment_path = alignment_path_for(args.video)
+        if os.path.exists(alignment_path):
+            rates = error_rates([(reference_text(alignment_path), transcriber.decoder.transcript)])
+            print(f"CER {rates['cer']:.3f}, WER {rates['wer']:.3f} against {alignment_path}")
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,283 @@
+"""GRID-shaped synthetic clips and alignments for benchmarks and load tests.
+
+A clip is 75 frames of 360x288 BGR at 25 fps, written as MPEG-1 like the
+corpus, showing a plain face whose mouth opens and closes inside the GRID
+mouth window (``video.MOUTH_CROP``) while a word is spoken. Its ``.align``
+file holds a random six-word GRID sentence with word timings in the corpus
+units (frame * 1000), framed by ``sil``. Everything is drawn from a seeded
+RNG, so the same seed always gives the same clip.
+
+Run as a script it writes a whole corpus of N speakers by M clips in the
+``data/`` layout (``s<k>/<id>.mpg`` and ``alignments/s<k>/<id>.align``) on
+a process pool. Clip ids follow the GRID naming (``bbaf2n`` is "bin blue at
+f two now") and are unique per speaker; each speaker keeps one face. Clips
+already on disk are skipped, so an interrupted run resumes.
+
+Usage:
+    python synthetic_grid.py --speakers 4 --clips 1000 --output synthetic
+    python synthetic_grid.py --speakers 34 --clips 1000 --output /scratch/grid --workers 32
+"""
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+import video
+
+FRAME_HEIGHT = 288
+FRAME_WIDTH = 360
+FPS = 25
+TIME_UNITS = 1000  # .align timings are frame indices times this
+NOISE_SEED = 1234
+NOISE_OFFSET = (6, 6, 6, 0)
+_NOISE_BANK = None
+
+# command color preposition letter digit adverb
+GRID_WORDS = (
+    ('bin', 'lay', 'place', 'set'),
+    ('blue', 'green', 'red', 'white'),
+    ('at', 'by', 'in', 'with'),
+    tuple('abcdefghijklmnopqrstuvxyz'),
+    ('zero', 'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine'),
+    ('again', 'now', 'please', 'soon'),
+)
+
+
+MAX_CLIPS_PER_SPEAKER = int(np.prod([len(slot) for slot in GRID_WORDS]))
+
+
+def random_sentence(rng: np.random.Generator) -> list:
+    return [slot[rng.integers(len(slot))] for slot in GRID_WORDS]
+
+
+def clip_id(words) -> str:
+    """GRID clip name: first letters of the words, the letter itself and the digit (``z`` for zero)."""
+    command, color, preposition, letter, digit, adverb = words
+    digit_char = 'z' if digit == 'zero' else str(GRID_WORDS[4].index(digit))
+    return f"{command[0]}{color[0]}{preposition[0]}{letter}{digit_char}{adverb[0]}"
+
+
+def speaker_appearance(rng: np.random.Generator) -> dict:
+    """Skin tone and mouth width, kept for every clip of a speaker."""
+    return {
+        'skin': tuple(int(c) for c in rng.integers((90, 120, 160), (130, 160, 210))),
+        'half_width': int(rng.integers(38, 50)),
+    }
+
+
+def word_timings(words, rng: np.random.Generator, num_frames: int = video.NUM_FRAMES) -> list:
+    """``(start_frame, end_frame, word)`` for ``words`` with leading and trailing silence.
+
+    Word durations grow with word length, plus jitter, and the speech fills
+    roughly the middle two thirds of the clip as in the corpus.
+    """
+    lead = int(rng.integers(8, 18))
+    tail = int(rng.integers(4, 10))
+    weights = np.array([len(word) + 2 for word in words], dtype=float) * rng.uniform(0.8, 1.2, len(words))
+    bounds = lead + np.round(np.cumsum(np.concatenate([[0.0], weights])) / weights.sum()
+                             * (num_frames - lead - tail)).astype(int)
+    timings = [(0, lead, 'sil')]
+    timings += [(int(start), int(end), word) for start, end, word in zip(bounds[:-1], bounds[1:], words)]
+    timings.append((int(bounds[-1]), num_frames, 'sil'))
+    return timings
+
+
+def mouth_openings(timings, num_frames: int = video.NUM_FRAMES) -> np.ndarray:
+    """Lip gap in pixels per frame: closed in silence, one open-close per syllable-ish chunk."""
+    opening = np.full(num_frames, 2.0)
+    for start, end, word in timings:
+        if word == 'sil' or end <= start:
+            continue
+        frames = np.arange(start, end)
+        cycles = max(1, len(word) // 3)
+        phase = (frames - start + 0.5) / (end - start)
+        opening[start:end] = 2.0 + 14.0 * np.abs(np.sin(np.pi * cycles * phase))
+    return opening
+
+
+def noise_bank() -> np.ndarray:
+    """Eight frames of sensor-like noise (0..12 around an offset of 6), made once per process."""
+    global _NOISE_BANK
+    if _NOISE_BANK is None:
+        rng = np.random.default_rng(NOISE_SEED)
+        _NOISE_BANK = rng.integers(0, 13, size=(8, FRAME_HEIGHT, FRAME_WIDTH, 3), dtype=np.uint8)
+    return _NOISE_BANK
+
+
+def render_frames(timings, rng: np.random.Generator, num_frames: int = video.NUM_FRAMES,
+                  appearance: dict = None) -> np.ndarray:
+    """``(T, 288, 360, 3)`` uint8 BGR frames of a face speaking ``timings``.
+
+    The face is drawn once and broadcast to every frame; only the mouth is
+    drawn per frame, and noise comes from a shared bank with saturating
+    OpenCV adds, which keeps rendering to a few milliseconds per clip.
+    """
+    top, bottom, left, right = video.MOUTH_CROP
+    mouth_x, mouth_y = (left + right) // 2, (top + bottom) // 2
+
+    background = np.empty((FRAME_HEIGHT, FRAME_WIDTH, 3), dtype=np.uint8)
+    background[:] = np.linspace(60, 120, FRAME_WIDTH, dtype=np.uint8)[np.newaxis, :, np.newaxis]
+    appearance = appearance or speaker_appearance(rng)
+    skin = appearance['skin']
+    cv2.ellipse(background, (mouth_x, mouth_y - 60), (115, 150), 0, 0, 360, skin, -1)
+    for eye_x in (mouth_x - 45, mouth_x + 45):
+        cv2.ellipse(background, (eye_x, mouth_y - 110), (18, 8), 0, 0, 360, (40, 40, 40), -1)
+
+    lips = tuple(max(0, c - 50) for c in skin)
+    half_width = appearance['half_width']
+    shifts = rng.integers(-2, 3, size=(num_frames, 2))
+    bank = noise_bank()
+    offset = int(rng.integers(len(bank)))
+    frames = np.empty((num_frames, FRAME_HEIGHT, FRAME_WIDTH, 3), dtype=np.uint8)
+    frames[:] = background
+    for index, gap in enumerate(mouth_openings(timings, num_frames)):
+        frame = frames[index]
+        # Small head motion, as in the corpus
+        x, y = mouth_x + int(shifts[index, 0]), mouth_y + int(shifts[index, 1])
+        cv2.ellipse(frame, (x, y), (half_width, int(gap) + 6), 0, 0, 360, lips, -1)
+        cv2.ellipse(frame, (x, y), (half_width - 8, max(1, int(gap))), 0, 0, 360, (20, 15, 25), -1)
+        cv2.add(frame, bank[(index + offset) % len(bank)], dst=frame)
+        cv2.subtract(frame, NOISE_OFFSET, dst=frame)
+    return frames
+
+
+def write_video(path: str, frames: np.ndarray, fps: int = FPS) -> None:
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    height, width = frames.shape[1:3]
+    fourcc = cv2.VideoWriter_fourcc(*('mpg1' if path.endswith('.mpg') else 'mp4v'))
+    writer = cv2.VideoWriter(path, fourcc, fps, (width, height))
+    if not writer.isOpened():
+        raise ValueError(f"Could not open video writer for: {path}")
+    for frame in frames:
+        writer.write(frame)
+    writer.release()
+
+
+def write_alignment(path: str, timings) -> None:
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        for start, end, word in timings:
+            f.write(f"{start * TIME_UNITS} {end * TIME_UNITS} {word}\n")
+
+
+def make_clip(video_path: str, alignment_path: str, seed, words=None, appearance: dict = None) -> list:
+    """Write one synthetic clip and its alignment; returns the sentence.
+
+    ``words`` defaults to a random sentence and ``appearance`` to a random
+    face, both drawn from ``seed``. The video is written under a temporary
+    name and renamed, so a clip on disk is always complete.
+    """
+    rng = np.random.default_rng(seed)
+    words = words or random_sentence(rng)
+    timings = word_timings(words, rng)
+    base, ext = os.path.splitext(video_path)
+    partial = f"{base}.partial{ext}"
+    write_video(partial, render_frames(timings, rng, appearance=appearance))
+    os.replace(partial, video_path)
+    write_alignment(alignment_path, timings)
+    return words
+
+
+def plan_corpus(output_root: str, speakers: int, clips: int, seed: int = 0) -> list:
+    """Every clip of the corpus as ``(video path, alignment path, seed, words, appearance)``.
+
+    Sentences are drawn per speaker until ``clips`` distinct ids exist, so
+    the plan, and with it every clip, only depends on ``seed``.
+    """
+    if clips > MAX_CLIPS_PER_SPEAKER:
+        raise ValueError(f"The GRID grammar has {MAX_CLIPS_PER_SPEAKER} distinct sentences per speaker, "
+                         f"{clips} requested")
+    jobs = []
+    for speaker in range(1, speakers + 1):
+        rng = np.random.default_rng([seed, speaker])
+        appearance = speaker_appearance(rng)
+        seen = set()
+        while len(seen) < clips:
+            words = random_sentence(rng)
+            name = clip_id(words)
+            if name in seen:
+                continue
+            seen.add(name)
+            jobs.append((os.path.join(output_root, f's{speaker}', f'{name}.mpg'),
+                         os.path.join(output_root, 'alignments', f's{speaker}', f'{name}.align'),
+                         [seed, speaker, len(seen)], words, appearance))
+    return jobs
+
+
+def is_written(job) -> bool:
+    video_path, alignment_path = job[:2]
+    return all(os.path.exists(path) and os.path.getsize(path) > 0 for path in (video_path, alignment_path))
+
+
+def make_clips(jobs, force: bool = False) -> tuple:
+    """Worker task: write a chunk of planned clips; returns ``(written, skipped)``."""
+    cv2.setNumThreads(1)
+    written = skipped = 0
+    for job in jobs:
+        if not force and is_written(job):
+            skipped += 1
+            continue
+        make_clip(*job)
+        written += 1
+    return written, skipped
+
+
+def generate_corpus(output_root: str, speakers: int, clips: int, workers: int = None, seed: int = 0,
+                    chunk_size: int = 32, force: bool = False) -> dict:
+    """Write ``speakers`` x ``clips`` synthetic clips under ``output_root`` on a process pool."""
+    workers = workers or os.cpu_count() or 1
+    jobs = plan_corpus(output_root, speakers, clips, seed)
+    chunks = [jobs[i:i + chunk_size] for i in range(0, len(jobs), chunk_size)]
+    print(f"Writing {len(jobs)} clips ({speakers} speakers x {clips}) to {output_root} on {workers} workers")
+
+    written = skipped = 0
+    start = time.perf_counter()
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    with executor:
+        for done, (chunk_written, chunk_skipped) in enumerate(
+                executor.map(make_clips, chunks, [force] * len(chunks)), 1):
+            written += chunk_written
+            skipped += chunk_skipped
+            if done % 20 == 0 or done == len(chunks):
+                elapsed = time.perf_counter() - start
+                print(f"{written + skipped}/{len(jobs)} clips, {written / elapsed:.1f} written/sec")
+
+    elapsed = time.perf_counter() - start
+    return {
+        'clips': len(jobs),
+        'written': written,
+        'skipped': skipped,
+        'seconds': elapsed,
+        'clips_per_sec': written / elapsed if elapsed else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic GRID-shaped corpus')
+    parser.add_argument('--speakers', type=int, default=1, help='Number of speakers (s1..sN)')
+    parser.add_argument('--clips', type=int, default=1000, help='Clips per speaker')
+    parser.add_argument('--output', '-o', default='synthetic', help='Corpus root, laid out like data/')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes')
+    parser.add_argument('--seed', type=int, default=0, help='Corpus seed; the same seed gives the same clips')
+    parser.add_argument('--chunk-size', type=int, default=32, help='Clips per worker task')
+    parser.add_argument('--force', action='store_true', help='Rewrite clips that already exist')
+    args = parser.parse_args()
+
+    try:
+        summary = generate_corpus(args.output, args.speakers, args.clips, args.workers, args.seed,
+                                  args.chunk_size, args.force)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    print(f"\nWrote {summary['written']} clips, skipped {summary['skipped']} existing, "
+          f"in {summary['seconds']:.1f}s ({summary['clips_per_sec']:.1f} clips/sec)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
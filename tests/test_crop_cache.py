@@ -0,0 +1,51 @@
+import os
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from crop_cache import CropCache, evict_lru  # noqa: E402
+
+
+def write_entry(root, name, size, mtime):
+    path = os.path.join(root, name)
+    with open(path, 'wb') as f:
+        f.write(b'\0' * size)
+    os.utime(path, ns=(mtime, mtime))
+    return path
+
+
+def test_evict_lru_removes_oldest_entries_first(tmp_path):
+    root = str(tmp_path)
+    oldest = write_entry(root, 'a.npy', 100, 1_000_000_000)
+    middle = write_entry(root, 'b.npy', 100, 2_000_000_000)
+    newest = write_entry(root, 'c.npy', 100, 3_000_000_000)
+
+    assert evict_lru(root, 200) == 200
+    assert not os.path.exists(oldest)
+    assert os.path.exists(middle) and os.path.exists(newest)
+
+
+def test_evict_lru_ignores_other_files_and_keeps_entries_within_budget(tmp_path):
+    root = str(tmp_path)
+    write_entry(root, 'a.npy', 100, 1_000_000_000)
+    other = write_entry(root, 'summary.json', 10_000, 1)
+
+    assert evict_lru(root, 100) == 100
+    assert os.path.exists(os.path.join(root, 'a.npy'))
+    assert os.path.exists(other)
+
+
+def test_cache_round_trip_and_eviction(tmp_path):
+    video_path = tmp_path / 'clip.mpg'
+    video_path.write_bytes(b'video')
+    crops = np.arange(2 * 3 * 4, dtype=np.uint8).reshape(2, 3, 4)
+    cache = CropCache(str(tmp_path / 'cache'), max_bytes=10 ** 6)
+
+    assert cache.get(str(video_path), {'crop': 1}) is None
+    computed = cache.get_or_compute(str(video_path), {'crop': 1}, lambda path: crops)
+    np.testing.assert_array_equal(computed, crops)
+    np.testing.assert_array_equal(cache.get(str(video_path), {'crop': 1}), crops)
+    # Different preprocessing parameters never share an entry
+    assert cache.get(str(video_path), {'crop': 2}) is None
+    assert (cache.hits, cache.misses) == (1, 3)
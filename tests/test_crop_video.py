@@ -0,0 +1,63 @@
+import json
+import os
+
+import pytest
+
+np = pytest.importorskip('numpy')
+cv2 = pytest.importorskip('cv2')
+
+from crop_video import crop_tree  # noqa: E402
+
+
+def write_video(path, frames=6):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*'mp4v'), 25, (360, 288))
+    if not writer.isOpened():
+        pytest.skip('OpenCV cannot write mp4v video here')
+    rng = np.random.default_rng(0)
+    for _ in range(frames):
+        writer.write(rng.integers(0, 255, (288, 360, 3), dtype=np.uint8))
+    writer.release()
+
+
+@pytest.fixture
+def tree(tmp_path):
+    write_video(tmp_path / 'in' / 's1' / 'a.mp4')
+    write_video(tmp_path / 'in' / 's2' / 'b.mp4')
+    return str(tmp_path / 'in'), str(tmp_path / 'out')
+
+
+def test_rerun_skips_up_to_date_outputs(tree):
+    input_root, output_root = tree
+    first = crop_tree(input_root, output_root, crop='center', workers=1)
+    assert first['run'] == {'cropped': 2, 'skipped': 0, 'failed': 0, 'frames': first['run']['frames']}
+    assert os.path.getsize(os.path.join(output_root, 's1', 'a.mp4')) > 0
+
+    second = crop_tree(input_root, output_root, crop='center', workers=1)
+    assert second['run']['cropped'] == 0 and second['run']['skipped'] == 2
+    # Cumulative totals still count the files cropped by the first run
+    assert second['totals']['cropped'] == 2
+
+
+def test_changed_crop_mode_recrops_everything(tree):
+    input_root, output_root = tree
+    crop_tree(input_root, output_root, crop='center', workers=1)
+
+    summary = crop_tree(input_root, output_root, crop='grid', workers=1)
+    assert summary['run']['cropped'] == 2 and summary['run']['skipped'] == 0
+    with open(os.path.join(output_root, 'summary.json')) as f:
+        assert {entry['crop'] for entry in json.load(f)['files'].values()} == {'grid'}
+
+
+def test_legacy_summary_entries_take_the_summary_mode(tree):
+    input_root, output_root = tree
+    crop_tree(input_root, output_root, crop='center', workers=1)
+    summary_path = os.path.join(output_root, 'summary.json')
+    with open(summary_path) as f:
+        summary = json.load(f)
+    for entry in summary['files'].values():
+        del entry['crop']
+    with open(summary_path, 'w') as f:
+        json.dump(summary, f)
+
+    assert crop_tree(input_root, output_root, crop='center', workers=1)['run']['skipped'] == 2
@@ -0,0 +1,63 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from ctc_decoder import Grammar, beam_search, beam_search_batch, greedy_decode_batch, greedy_tokens  # noqa: E402
+from vocab import BLANK, CHAR_TO_INDEX, NUM_CLASSES  # noqa: E402
+
+
+def frame_probs(frames, confidence=0.9):
+    """``(T, classes)`` outputs where each frame favours one character (``'_'`` is the blank)."""
+    probs = np.full((len(frames), NUM_CLASSES), (1 - confidence) / (NUM_CLASSES - 1))
+    for t, char in enumerate(frames):
+        probs[t, BLANK if char == '_' else CHAR_TO_INDEX[char]] = confidence
+    return probs
+
+
+def test_greedy_merges_repeats_before_removing_blanks():
+    probs = np.stack([frame_probs('hh_ee_ll_lo__'), frame_probs('__a_bb_c_____')])
+    assert greedy_decode_batch(probs) == ['hello', 'abc']
+    assert [tokens.tolist() for tokens in greedy_tokens(probs)][1] == [CHAR_TO_INDEX[c] for c in 'abc']
+
+
+def test_greedy_respects_lengths():
+    probs = np.stack([frame_probs('ab_cd'), frame_probs('ab_cd')])
+    assert greedy_decode_batch(probs, lengths=[5, 2]) == ['abcd', 'ab']
+
+
+def test_greedy_matches_tf_ctc_decode():
+    tf = pytest.importorskip('tensorflow')
+    from vocab import tokens_to_text
+
+    probs = np.random.default_rng(0).dirichlet(np.ones(NUM_CLASSES) * 0.3, size=(3, 20)).astype(np.float32)
+    decoded = tf.keras.backend.ctc_decode(probs, input_length=np.full(3, 20), greedy=True)[0][0].numpy()
+    assert greedy_decode_batch(probs) == [tokens_to_text(row) for row in decoded]
+
+
+def test_beam_search_without_grammar_finds_the_clear_transcript():
+    probs = frame_probs('bb_ii_nn__')
+    assert beam_search(probs, beam_width=4) == 'bin'
+
+
+def test_grid_grammar_corrects_a_non_word():
+    probs = frame_probs('b_o_n_ _r_e_d')
+    # The middle letter is ambiguous: greedy reads 'bon', which is not a corpus word
+    probs[2] = frame_probs('_')[0] * 0.2
+    probs[2, CHAR_TO_INDEX['o']] = 0.45
+    probs[2, CHAR_TO_INDEX['i']] = 0.35
+    grammar = Grammar([{'bin', 'lay'}, {'red', 'blue'}], end_slots={1})
+
+    assert greedy_decode_batch(probs[np.newaxis]) == ['bon red']
+    assert beam_search_batch(probs[np.newaxis], beam_width=8, grammar=grammar) == ['bin red']
+
+
+def test_grid_grammar_from_alignments(tmp_path):
+    speaker = tmp_path / 'alignments' / 's1'
+    speaker.mkdir(parents=True)
+    (speaker / 'a.align').write_text('0 10 sil\n10 20 bin\n20 30 red\n30 40 sil\n')
+    (speaker / 'b.align').write_text('0 10 lay\n10 20 blue\n')
+
+    grammar = Grammar.from_alignments('grid', str(tmp_path / 'alignments'))
+    assert grammar.slots == [['bin', 'lay'], ['blue', 'red']]
+    with pytest.raises(ValueError):
+        Grammar.from_alignments('unknown', str(tmp_path / 'alignments'))
@@ -0,0 +1,85 @@
+import os
+import time
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import label_index  # noqa: E402
+from label_index import (INDEX_NAME, alignment_label, alignment_text, build_label_index,  # noqa: E402
+                         ensure_label_index, load_label_index)
+from vocab import encode_text  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def fresh_caches():
+    """Every test starts as a new process would, with nothing loaded."""
+    label_index._indexes.clear()
+    label_index._checked_roots.clear()
+    yield
+    label_index._indexes.clear()
+    label_index._checked_roots.clear()
+
+
+def write_align(path, words):
+    rows = ['0 10 sil'] + [f'{10 * (i + 1)} {10 * (i + 2)} {word}' for i, word in enumerate(words)]
+    path.write_text('\n'.join(rows) + '\n')
+
+
+@pytest.fixture
+def alignments(tmp_path):
+    root = tmp_path / 'alignments'
+    (root / 's1').mkdir(parents=True)
+    (root / 's2').mkdir()
+    write_align(root / 's1' / 'bbaf2n.align', ['bin', 'blue', 'at', 'f', 'two', 'now'])
+    write_align(root / 's2' / 'lgaz8p.align', ['lay', 'green', 'sp', 'at', 'z', 'eight', 'please'])
+    return root
+
+
+def test_build_and_lookup(alignments):
+    build_label_index(str(alignments))
+    index = load_label_index(str(alignments))
+
+    assert len(index) == 2
+    assert 's1/bbaf2n' in index and 's1/missing' not in index
+    assert index.text('s2/lgaz8p') == 'lay green at z eight please'
+    np.testing.assert_array_equal(index.label('s1/bbaf2n'), encode_text('bin blue at f two now'))
+    assert index.label_length('s1/bbaf2n') == len('bin blue at f two now')
+    assert index.word_timings('s1/bbaf2n')[:2] == [(0, 10, 'sil'), (10, 20, 'bin')]
+
+
+def test_lookups_use_the_index_and_fall_back_to_parsing(alignments, tmp_path):
+    build_label_index(str(alignments))
+    assert alignment_text(str(alignments / 's1' / 'bbaf2n.align')) == 'bin blue at f two now'
+
+    # Outside any indexed tree the file is parsed
+    loose = tmp_path / 'loose' / 'x'
+    loose.mkdir(parents=True)
+    write_align(loose / 'clip.align', ['set', 'red'])
+    assert alignment_text(str(loose / 'clip.align')) == 'set red'
+    assert not os.path.exists(tmp_path / 'loose' / INDEX_NAME)
+
+
+def test_ensure_rebuilds_when_a_speaker_directory_changes(alignments):
+    index = ensure_label_index(str(alignments))
+    assert not index.is_stale(str(alignments))
+
+    time.sleep(0.01)
+    write_align(alignments / 's1' / 'new.align', ['set', 'red'])
+    assert index.is_stale(str(alignments))
+    assert 's1/new' in ensure_label_index(str(alignments))
+
+
+def test_first_lookup_rebuilds_a_stale_index(alignments):
+    align = alignments / 's1' / 'bbaf2n.align'
+    build_label_index(str(alignments))
+
+    # Replace the alignment (a new file, so the directory mtime changes) after the build
+    time.sleep(0.01)
+    replacement = alignments / 's1' / 'bbaf2n.tmp'
+    write_align(replacement, ['set', 'red'])
+    os.replace(replacement, align)
+
+    assert alignment_text(str(align)) == 'set red'
+    np.testing.assert_array_equal(alignment_label(str(align)), encode_text('set red'))
+    assert not load_label_index(str(alignments)).is_stale(str(alignments))
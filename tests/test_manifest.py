@@ -0,0 +1,84 @@
+import os
+import time
+
+import pytest
+
+pytest.importorskip('cv2')
+
+import manifest  # noqa: E402
+from manifest import MANIFEST_NAME, ensure_manifest, read_manifest, refresh_manifest  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache():
+    manifest._manifests.clear()
+    yield
+    manifest._manifests.clear()
+
+
+@pytest.fixture
+def probes(monkeypatch):
+    """Record probed videos instead of opening the (fake) files."""
+    probed = []
+
+    def probe(path):
+        probed.append(os.path.basename(path))
+        return {'frames': 75, 'width': 360, 'height': 288, 'fps': 25.0, 'duration': 3.0}
+
+    monkeypatch.setattr(manifest, 'probe_video', probe)
+    return probed
+
+
+def make_clip(root, speaker, clip_id, aligned=True):
+    (root / speaker).mkdir(exist_ok=True)
+    (root / speaker / f'{clip_id}.mpg').write_bytes(b'video ' + clip_id.encode())
+    if aligned:
+        (root / 'alignments' / speaker).mkdir(parents=True, exist_ok=True)
+        (root / 'alignments' / speaker / f'{clip_id}.align').write_text('0 10 sil\n')
+
+
+def test_refresh_lists_clips_and_rescans_only_changed_speakers(tmp_path, probes):
+    make_clip(tmp_path, 's1', 'bbaf2n')
+    make_clip(tmp_path, 's2', 'lgaz8p', aligned=False)
+    first = refresh_manifest(str(tmp_path))
+
+    assert sorted(probes) == ['bbaf2n.mpg', 'lgaz8p.mpg']
+    assert first.speakers == ['s1', 's2']
+    assert first.find('bbaf2n')['alignment'] == 'alignments/s1/bbaf2n.align'
+    assert first.video_paths('s1', aligned=True) == [os.path.join(str(tmp_path), 's1', 'bbaf2n.mpg')]
+    assert first.video_paths(aligned=True) == first.video_paths('s1')
+    assert read_manifest(str(tmp_path)).clips == first.clips
+
+    time.sleep(0.01)
+    make_clip(tmp_path, 's2', 'new1a')
+    assert first.is_stale()
+    probes.clear()
+    second = refresh_manifest(str(tmp_path), first)
+    assert probes == ['new1a.mpg']
+    assert [record['id'] for record in second.select('s2')] == ['lgaz8p', 'new1a']
+    assert not second.is_stale()
+
+
+def test_ensure_manifest_rescans_only_when_stale(tmp_path, probes, monkeypatch):
+    make_clip(tmp_path, 's1', 'bbaf2n')
+    first = ensure_manifest(str(tmp_path))
+    assert os.path.exists(tmp_path / MANIFEST_NAME)
+
+    refreshes = []
+    monkeypatch.setattr(manifest, 'refresh_manifest', lambda *args, **kwargs: refreshes.append(args))
+    assert ensure_manifest(str(tmp_path)) is first
+    assert refreshes == []
+
+
+def test_empty_manifest_is_cached(tmp_path, probes, monkeypatch):
+    empty = ensure_manifest(str(tmp_path))
+    assert len(empty) == 0
+
+    reads = []
+    monkeypatch.setattr(manifest, 'read_manifest', lambda root: reads.append(root))
+    assert ensure_manifest(str(tmp_path)) is empty
+    assert reads == []
+
+
+def test_ensure_manifest_of_missing_root(tmp_path):
+    assert ensure_manifest(str(tmp_path / 'missing')) is None
@@ -0,0 +1,37 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+tf = pytest.importorskip('tensorflow')
+
+from model import CTCLossWithLengths, CTCLossXLA, CTCLoss, ctc_neg_log_likelihood  # noqa: E402
+from vocab import NUM_CLASSES  # noqa: E402
+
+
+def batch(seed=0, frames=20):
+    rng = np.random.default_rng(seed)
+    y_pred = rng.dirichlet(np.ones(NUM_CLASSES), size=(3, frames)).astype(np.float32)
+    # The second label repeats a character, which needs a blank in between
+    labels = np.array([[5, 9, 2, 0, 0], [7, 7, 3, 1, 0], [4, 0, 0, 0, 0]], dtype=np.int64)
+    label_length = np.array([3, 4, 1])
+    input_length = np.array([frames, frames - 5, 8])
+    return labels, y_pred, label_length, input_length
+
+
+def test_matches_ctc_batch_cost_on_true_lengths():
+    labels, y_pred, label_length, input_length = batch()
+    expected = CTCLossWithLengths(labels, y_pred, input_length, label_length)
+    actual = ctc_neg_log_likelihood(labels, y_pred, label_length, input_length)
+    assert actual.shape == (3, 1)
+    np.testing.assert_allclose(actual.numpy(), expected.numpy(), rtol=1e-4)
+
+
+def test_xla_loss_matches_full_width_loss():
+    _, y_pred, _, _ = batch(seed=1)
+    # Full-width losses count every label column, so no padding here
+    labels = np.array([[5, 9, 2], [7, 7, 3], [4, 1, 4]], dtype=np.int64)
+
+    @tf.function(jit_compile=True)
+    def xla_loss(labels, y_pred):
+        return CTCLossXLA(labels, y_pred)
+
+    np.testing.assert_allclose(xla_loss(labels, y_pred).numpy(), CTCLoss(labels, y_pred).numpy(), rtol=1e-4)
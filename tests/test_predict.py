@@ -0,0 +1,43 @@
+import io
+import json
+import sys
+import types
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('tensorflow')
+pytest.importorskip('cv2')
+
+import predict  # noqa: E402
+from vocab import BLANK, CHAR_TO_INDEX, NUM_CLASSES  # noqa: E402
+
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    """A model that spells 'ok' for every clip, loaded the way predict.py loads the real one."""
+    def infer(batch):
+        probs = np.zeros((batch.shape[0], 75, NUM_CLASSES), dtype=np.float32)
+        probs[:, :, BLANK] = 1.0
+        probs[:, 0, :] = 0.0
+        probs[:, 0, CHAR_TO_INDEX['o']] = 1.0
+        probs[:, 2, :] = 0.0
+        probs[:, 2, CHAR_TO_INDEX['k']] = 1.0
+        return types.SimpleNamespace(numpy=lambda: probs)
+
+    modelutil = types.ModuleType('modelutil')
+    modelutil.load_predictor = lambda: (None, infer)
+    monkeypatch.setitem(sys.modules, 'modelutil', modelutil)
+    monkeypatch.setattr(predict, 'prepare_clip',
+                        lambda path, localize_every=0: (path, np.zeros((75, 46, 140, 1), np.float32), None))
+
+
+def test_duplicate_paths_are_transcribed_once(fake_model):
+    output = io.StringIO()
+    paths = ['data/s1/a.mpg', 'data/s1/b.mpg', 'data/s1/a.mpg', 'data/s1/c.mpg', 'data/s1/b.mpg']
+    stats = predict.run_predictions(paths, output, batch_size=2, workers=2)
+
+    lines = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert stats['clips'] == 3 and stats['failed'] == 0
+    assert sorted(line['path'] for line in lines) == ['data/s1/a.mpg', 'data/s1/b.mpg', 'data/s1/c.mpg']
+    assert {line['text'] for line in lines} == {'ok'}
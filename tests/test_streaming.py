@@ -0,0 +1,47 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('cv2')
+
+from ctc_decoder import greedy_decode_batch  # noqa: E402
+from streaming import StreamingTranscriber  # noqa: E402
+from vocab import BLANK, CHAR_TO_INDEX, NUM_CLASSES  # noqa: E402
+
+SCRIPT = 'bb_ii_nn__ __bb_ll_uu_ee_ __aa_tt__ __ff__ __tt_ww_oo__ __nn_oo_ww__'
+
+
+def one_hot(chars):
+    probs = np.full((len(chars), NUM_CLASSES), 0.01)
+    for t, char in enumerate(chars):
+        probs[t, BLANK if char == '_' else CHAR_TO_INDEX[char]] = 0.9
+    return probs
+
+
+def stream(window, hop, lookahead):
+    """Feed SCRIPT frame by frame; the fake model reads the script at the window's absolute frames."""
+    padded = '_' * window + SCRIPT
+    transcriber = None
+
+    def predict(batch):
+        assert batch.shape == (1, window, 46, 140, 1)
+        end = window + transcriber.count
+        return one_hot(padded[end - window:end])[np.newaxis]
+
+    transcriber = StreamingTranscriber(predict, window=window, hop=hop, lookahead=lookahead)
+    frame = np.zeros((288, 360, 3), dtype=np.uint8)
+    updates = [transcriber.push(t, frame) for t in range(len(SCRIPT))]
+    updates.append(transcriber.flush())
+    return transcriber, [update for update in updates if update]
+
+
+@pytest.mark.parametrize('hop', [1, 7, 15])
+def test_committed_text_matches_offline_greedy(hop):
+    transcriber, updates = stream(window=25, hop=hop, lookahead=10)
+    assert updates[-1]['final']
+    assert transcriber.decoder.transcript == greedy_decode_batch(one_hot(SCRIPT)[np.newaxis])[0]
+
+
+@pytest.mark.parametrize('window, hop, lookahead', [(25, 16, 10), (75, 66, 10), (25, 0, 10), (25, 5, 25)])
+def test_rejects_settings_that_would_skip_frames(window, hop, lookahead):
+    with pytest.raises(ValueError):
+        StreamingTranscriber(lambda batch: None, window=window, hop=hop, lookahead=lookahead)
@@ -0,0 +1,28 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from vocab import BLANK, CHAR_TO_INDEX, NUM_CLASSES, VOCAB, encode_text, tokens_to_text  # noqa: E402
+
+
+def test_token_numbering_matches_string_lookup():
+    # StringLookup(vocabulary=VOCAB, oov_token="") puts the OOV token at 0
+    assert CHAR_TO_INDEX['a'] == 1
+    assert CHAR_TO_INDEX[VOCAB[-1]] == len(VOCAB)
+    assert BLANK == NUM_CLASSES - 1 == len(VOCAB) + 1
+
+
+def test_encode_text_round_trips():
+    tokens = encode_text('bin blue at f two now')
+    assert tokens.dtype == np.uint8
+    assert tokens_to_text(tokens) == 'bin blue at f two now'
+
+
+def test_encode_text_maps_unknown_characters_to_zero():
+    assert encode_text('a#b').tolist() == [CHAR_TO_INDEX['a'], 0, CHAR_TO_INDEX['b']]
+
+
+def test_tokens_to_text_skips_empty_blank_and_padding():
+    tokens = [CHAR_TO_INDEX['h'], 0, CHAR_TO_INDEX['i'], BLANK, -1, -1]
+    assert tokens_to_text(tokens) == 'hi'
+    assert tokens_to_text(np.array([[CHAR_TO_INDEX['o']], [CHAR_TO_INDEX['k']]])) == 'ok'
@@ -0,0 +1,261 @@
+"""Nested timing spans for the loading and prediction path.
+
+Tracing is off unless ``LIPNET_TRACE`` is set to ``1``, ``true`` or ``yes``.
+While it is off ``span`` hands back one shared no-op context manager and
+``traced`` functions call straight through after a single flag check, so the
+instrumentation can stay in the hot path.
+
+While it is on, every ``span`` records its wall-clock start, duration, parent
+and attributes. Spans opened inside another span on the same thread nest
+under it; when the outermost span of a thread closes, it and all of its
+descendants are appended to ``LIPNET_TRACE_FILE`` (``logs/trace.jsonl`` by
+default) as one JSON object per line. Durations are also folded into a
+per-stage histogram that ``prometheus_text`` renders in the Prometheus text
+format, which ``serve.py`` adds to ``/metrics``.
+
+Usage:
+    LIPNET_TRACE=1 streamlit run app/streamlitapp.py
+    LIPNET_TRACE=1 python predict.py data/s1 --output predictions.jsonl
+    python tracing.py summary logs/trace.jsonl
+    python tracing.py prometheus logs/trace.jsonl > lipnet_trace.prom
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import functools
+import itertools
+import threading
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_TRACE_FILE = os.environ.get('LIPNET_TRACE_FILE', os.path.join(BASE_DIR, 'logs', 'trace.jsonl'))
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_enabled = os.environ.get('LIPNET_TRACE', '0').lower() in ('1', 'true', 'yes')
+_trace_file = DEFAULT_TRACE_FILE
+_local = threading.local()
+_lock = threading.Lock()
+_ids = itertools.count(1)
+
+
+class StageHistograms:
+    """Cumulative duration histograms keyed by span name."""
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.stages = {}
+
+    def observe(self, name: str, seconds: float) -> None:
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = {'counts': [0] * len(self.buckets), 'count': 0, 'sum': 0.0}
+        stage['count'] += 1
+        stage['sum'] += seconds
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                stage['counts'][i] += 1
+
+    def render(self, name: str = 'lipnet_span_seconds') -> str:
+        lines = [f'# HELP {name} Time spent in each traced stage',
+                 f'# TYPE {name} histogram']
+        for stage, values in sorted(self.stages.items()):
+            label = stage.replace('\\', '\\\\').replace('"', '\\"')
+            for bound, count in zip(self.buckets, values['counts']):
+                lines.append(f'{name}_bucket{{span="{label}",le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{span="{label}",le="+Inf"}} {values["count"]}')
+            lines.append(f'{name}_sum{{span="{label}"}} {values["sum"]}')
+            lines.append(f'{name}_count{{span="{label}"}} {values["count"]}')
+        return '\n'.join(lines) + '\n'
+
+
+histograms = StageHistograms()
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attrs) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def _stack() -> list:
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+class Span:
+    """One timed stage; use through ``span`` or ``traced``."""
+
+    __slots__ = ('name', 'attrs', 'span_id', 'parent', 'trace_id', 'path', 'records', 'wall_start', 'start')
+
+    def __init__(self, name: str, attrs: dict):
+        self.name = name
+        self.attrs = attrs
+
+    def set(self, **attrs) -> None:
+        """Attach attributes known only once the stage has run (sizes, cache hits)."""
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        stack = _stack()
+        parent = stack[-1] if stack else None
+        self.span_id = next(_ids)
+        self.parent = parent.span_id if parent else None
+        self.trace_id = parent.trace_id if parent else f'{os.getpid()}-{self.span_id}'
+        self.path = f'{parent.path}/{self.name}' if parent else self.name
+        self.records = parent.records if parent else []
+        stack.append(self)
+        self.wall_start = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        stack = _stack()
+        if stack and stack[-1] is self:
+            stack.pop()
+        elif self in stack:
+            stack.remove(self)
+
+        record = {'trace': self.trace_id, 'span': self.span_id, 'parent': self.parent, 'name': self.name,
+                  'path': self.path, 'start': round(self.wall_start, 6), 'ms': round(duration * 1000, 3),
+                  'thread': threading.current_thread().name}
+        if self.attrs:
+            record['attrs'] = self.attrs
+        if exc_type is not None:
+            record['error'] = exc_type.__name__
+        self.records.append(record)
+        with _lock:
+            histograms.observe(self.name, duration)
+        if self.parent is None:
+            _export(self.records)
+        return False
+
+
+def _export(records) -> None:
+    if not _trace_file:
+        return
+    lines = ''.join(json.dumps(record, default=str) + '\n' for record in records)
+    with _lock:
+        os.makedirs(os.path.dirname(_trace_file) or '.', exist_ok=True)
+        with open(_trace_file, 'a') as f:
+            f.write(lines)
+
+
+def span(name: str, **attrs):
+    """Context manager timing the enclosed block as stage ``name``."""
+    if not _enabled:
+        return NOOP_SPAN
+    return Span(name, attrs)
+
+
+def traced(name: str = None):
+    """Decorator timing every call of the function as a span (default: its name)."""
+    def decorate(func):
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with Span(label, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def enable(trace_file: str = None) -> None:
+    """Turn tracing on; ``trace_file`` overrides ``LIPNET_TRACE_FILE`` (empty string: memory only)."""
+    global _enabled, _trace_file
+    _enabled = True
+    if trace_file is not None:
+        _trace_file = trace_file
+
+
+def disable() -> None:
+    global _enabled
+    _enabled = False
+
+
+def prometheus_text() -> str:
+    """The in-process stage histograms in the Prometheus text exposition format."""
+    with _lock:
+        return histograms.render()
+
+
+def read_trace(path: str) -> list:
+    with open(path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summarize(records) -> list:
+    """Per span path: calls, mean/p50/p95 ms and share of the root spans' total time."""
+    by_path = {}
+    for record in records:
+        by_path.setdefault(record['path'], []).append(record['ms'])
+    root_total = sum(sum(values) for path, values in by_path.items() if '/' not in path) or 1.0
+
+    rows = []
+    for path, values in by_path.items():
+        values = sorted(values)
+        rows.append({
+            'path': path,
+            'calls': len(values),
+            'mean_ms': sum(values) / len(values),
+            'p50_ms': values[len(values) // 2],
+            'p95_ms': values[min(len(values) - 1, int(len(values) * 0.95))],
+            'share': sum(values) / root_total,
+        })
+    return sorted(rows, key=lambda row: row['path'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect LIPNET_TRACE span logs')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    summary_parser = subparsers.add_parser('summary', help='Latency per stage, nested by span path')
+    summary_parser.add_argument('trace', nargs='?', default=DEFAULT_TRACE_FILE, help='JSON lines trace file')
+
+    prometheus_parser = subparsers.add_parser('prometheus', help='Convert a trace to Prometheus text')
+    prometheus_parser.add_argument('trace', nargs='?', default=DEFAULT_TRACE_FILE, help='JSON lines trace file')
+
+    args = parser.parse_args()
+    if not os.path.exists(args.trace):
+        print(f"Trace file not found: {args.trace}")
+        return 1
+    records = read_trace(args.trace)
+
+    if args.command == 'prometheus':
+        stages = StageHistograms()
+        for record in records:
+            stages.observe(record['name'], record['ms'] / 1000)
+        sys.stdout.write(stages.render())
+        return 0
+
+    print(f"{'stage':<48}{'calls':>7}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'share':>8}")
+    for row in summarize(records):
+        depth = row['path'].count('/')
+        label = '  ' * depth + row['path'].rsplit('/', 1)[-1]
+        print(f"{label:<48}{row['calls']:>7}{row['mean_ms']:>10.2f}{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}"
+              f"{row['share']:>8.1%}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,10 +1,61 @@
 import os
+import random
+import argparse
+import contextlib
 import tensorflow as tf
-from utils import load_data, download_data, VOCAB, char_to_num
+from utils import download_data, char_to_num, crop_cache
 from model import LipNet, CTCLoss
-import glob
+from pipeline import (make_dataset, make_executor, measure_throughput, ThroughputCallback, FileOrder,
+                      MAX_FRAMES, FRAME_HEIGHT, FRAME_WIDTH)
+from train_loop import fit, set_precision, notebook_schedule, TrainingState
+from distributed import is_chief, task_index, make_distributed_dataset
+from manifest import ensure_manifest
 
 def main():
+    parser = argparse.ArgumentParser(description='Train LipNet')
+    parser.add_argument('--shards', help='Directory of TFRecord shards built with shards.py')
+    parser.add_argument('--batch-size', type=int, default=4, help='Clips per batch')
+    parser.add_argument('--epochs', type=int, default=100, help='Number of training epochs')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Parallel decode workers')
+    parser.add_argument('--decode-backend', choices=['thread', 'process'], default='thread',
+                        help='Decode clips on a thread pool or a process pool')
+    parser.add_argument('--nondeterministic', action='store_true',
+                        help='Let batches come out in completion order instead of file order')
+    parser.add_argument('--benchmark-input', type=int, metavar='BATCHES',
+                        help='Only time the input pipeline for this many batches and exit')
+    parser.add_argument('--custom-loop', action='store_true',
+                        help='Train with the compiled loop in train_loop.py instead of model.fit')
+    parser.add_argument('--jit-compile', action='store_true',
+                        help='XLA-compile the training step (implies --custom-loop)')
+    parser.add_argument('--precision', choices=['float32', 'mixed_bfloat16'], default='float32',
+                        help='Keras dtype policy for the model')
+    parser.add_argument('--bucket-sizes', type=int, nargs='+', metavar='FRAMES',
+                        help='Bucket clips by frame count, padding only to these sizes and training on the '
+                             'true input/label lengths (implies --custom-loop)')
+    parser.add_argument('--distributed', action='store_true',
+                        help='Data-parallel training across the workers in TF_CONFIG, with --batch-size clips '
+                             'per worker (start local workers with distributed.py launch)')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue from the latest full training-state checkpoint (implies --custom-loop)')
+    parser.add_argument('--state-dir', default=os.path.join('checkpoints', 'state'),
+                        help='Where the custom loop keeps its training-state checkpoints')
+    parser.add_argument('--keep-checkpoints', type=int, default=3, help='Training-state checkpoints to keep')
+    parser.add_argument('--save-every', type=int, metavar='STEPS',
+                        help='Also save the training state every this many steps, not only after each epoch')
+    parser.add_argument('--lr-schedule', action='store_true',
+                        help='Decay the learning rate by exp(-0.1) per epoch after epoch 30, as in the notebook')
+    args = parser.parse_args()
+    deterministic = not args.nondeterministic
+    if args.distributed and (args.shards or args.jit_compile or args.benchmark_input):
+        parser.error('--distributed shards the clip list and does not support --shards, --jit-compile '
+                     'or --benchmark-input')
+
+    # The collective ops must be set up before anything else touches the TF runtime
+    strategy = tf.distribute.MultiWorkerMirroredStrategy() if args.distributed else None
+    chief = strategy is None or is_chief(strategy)
+    steps_per_epoch = validation_steps = train_order = None
+    global_batch_size = args.batch_size * (strategy.num_replicas_in_sync if strategy else 1)
+
     # Set up GPU memory growth
     physical_devices = tf.config.list_physical_devices('GPU')
     try:
@@ -13,31 +64,66 @@ def main():
         print("No GPU available or error in GPU configuration")
         pass
 
-    # Download data if not present
-    download_data()
+    if args.shards:
+        # Pre-built TFRecord shards (see shards.py)
+        from shards import load_shards, split_shards
+        train_files, val_files = split_shards(args.shards)
+        train_dataset = load_shards(train_files, batch_size=args.batch_size, deterministic=deterministic,
+                                    bucket_sizes=args.bucket_sizes)
+        val_dataset = load_shards(val_files, batch_size=args.batch_size, shuffle_buffer=0,
+                                  deterministic=deterministic, bucket_sizes=args.bucket_sizes)
+    else:
+        # Download data if not present
+        download_data()
 
-    # Create data pipeline
-    data_path = os.path.join('data', 's1', '*.mpg')
-    data_files = glob.glob(data_path)
+        # Split the file list once, before any decoding, so validation
+        # clips never leak into training when the order is reshuffled
+        # The manifest lists the clips without globbing the speaker directory
+        data_files = ensure_manifest('data').video_paths('s1', extensions=('.mpg',))
+        random.Random(0).shuffle(data_files)
+        val_size = int(len(data_files) * 0.2)
+        train_files, val_files = data_files[val_size:], data_files[:val_size]
 
-    # Create dataset
-    dataset = tf.data.Dataset.from_tensor_slices(data_files)
-    dataset = dataset.map(lambda x: tf.py_function(load_data, [x], [tf.float32, tf.int64]))
-    dataset = dataset.shuffle(buffer_size=50)
-    dataset = dataset.batch(4)
-    dataset = dataset.prefetch(tf.data.AUTOTUNE)
+        # One decode pool shared by both datasets
+        executor = make_executor(args.decode_backend, args.workers)
+        if strategy:
+            # Each worker decodes only its own shard of both splits
+            dataset_kwargs = dict(workers=args.workers, executor=executor, deterministic=deterministic,
+                                  bucket_sizes=args.bucket_sizes)
+            train_dataset, steps_per_epoch, train_order = make_distributed_dataset(
+                strategy, train_files, global_batch_size, **dataset_kwargs)
+            val_dataset, validation_steps, _ = make_distributed_dataset(
+                strategy, val_files, global_batch_size, shuffle=False, **dataset_kwargs)
+        else:
+            # The file order is checkpointed with the training state, so --resume continues mid-epoch
+            train_order = FileOrder(train_files)
+            train_dataset = make_dataset(train_order, batch_size=args.batch_size, workers=args.workers,
+                                         executor=executor, deterministic=deterministic,
+                                         bucket_sizes=args.bucket_sizes)
+            val_dataset = make_dataset(val_files, batch_size=args.batch_size, workers=args.workers,
+                                       executor=executor, deterministic=deterministic, shuffle=False,
+                                       bucket_sizes=args.bucket_sizes)
 
-    # Split into train and validation
-    val_size = int(len(data_files) * 0.2)
-    train_dataset = dataset.skip(val_size)
-    val_dataset = dataset.take(val_size)
+    if args.benchmark_input:
+        stats = measure_throughput(train_dataset, args.benchmark_input)
+        print(f"Input pipeline: {stats['clips']} clips in {stats['seconds']:.1f}s "
+              f"({stats['clips_per_sec']:.1f} clips/sec)")
+        return
 
     # Initialize model
-    model = LipNet(vocab_size=len(VOCAB))
+    set_precision(args.precision)
+    with strategy.scope() if strategy else contextlib.nullcontext():
+        model = LipNet(vocab_size=char_to_num.vocabulary_size())
+
+        # Compile model
+        optimizer = tf.keras.optimizers.Adam(learning_rate=0.0001)
+        model.compile(optimizer=optimizer, loss=CTCLoss)
 
-    # Compile model
-    optimizer = tf.keras.optimizers.Adam(learning_rate=0.0001)
-    model.compile(optimizer=optimizer, loss=CTCLoss)
+        custom_loop = args.custom_loop or args.jit_compile or args.bucket_sizes or strategy or args.resume
+        if custom_loop:
+            # Build the variables now so the training state can track them
+            model(tf.zeros((1, MAX_FRAMES, FRAME_HEIGHT, FRAME_WIDTH, 1)))
+            optimizer.build(model.trainable_variables)
 
     # Create checkpoint callback
     checkpoint_path = "checkpoints/lipnet"
@@ -55,15 +141,37 @@ def main():
     )
 
     # Train model
-    history = model.fit(
-        train_dataset,
-        validation_data=val_dataset,
-        epochs=100,
-        callbacks=[cp_callback]
-    )
+    # model.fit would drop the length tensors of bucketed batches and cannot resume mid-epoch
+    schedule = notebook_schedule if args.lr_schedule else None
+    if custom_loop:
+        # Every worker saves its own state (its input position differs); worker 0 writes to --state-dir
+        state_dir = args.state_dir if chief else os.path.join(args.state_dir, f'worker-{task_index(strategy)}')
+        state = TrainingState(model, optimizer, state_dir, args.keep_checkpoints, train_order)
+        if args.resume and not state.restore():
+            print(f"No training state in {state_dir}; starting from scratch")
+        history = fit(model, optimizer, train_dataset, val_dataset, args.epochs, global_batch_size,
+                      jit_compile=args.jit_compile, checkpoint_path=checkpoint_path if chief else None,
+                      strategy=strategy, steps_per_epoch=steps_per_epoch, validation_steps=validation_steps,
+                      schedule=schedule, state=state, save_every=args.save_every)
+    else:
+        callbacks = [cp_callback, ThroughputCallback(args.batch_size)]
+        if schedule:
+            callbacks.append(tf.keras.callbacks.LearningRateScheduler(schedule))
+        history = model.fit(
+            train_dataset,
+            validation_data=val_dataset,
+            epochs=args.epochs,
+            callbacks=callbacks
+        )
 
     # Save final model
-    model.save_weights('models/lipnet_final')
+    if chief:
+        model.save_weights('models/lipnet_final')
+
+    if crop_cache is not None:
+        stats = crop_cache.stats()
+        print(f"Crop cache: {stats['hits']} hits, {stats['misses']} misses, "
+              f"{stats['entries']} entries ({stats['bytes'] / 1024 ** 2:.1f} MiB)")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,388 @@
+"""Compiled custom training loop for LipNet, with optional mixed bfloat16.
+
+``make_train_step`` wraps the forward pass, the CTC loss and the optimizer
+update in one ``tf.function``. With ``jit_compile=True`` XLA compiles all of
+it, using ``model.CTCLossXLA`` since the TF CTC kernel has no XLA lowering.
+Batches may also carry true lengths, ``(frames, labels, input_length,
+label_length)`` from a bucketed dataset; the loss and the validation decode
+then use them instead of the padded sizes. With a ``tf.distribute`` strategy
+(see ``distributed.py``) every step runs on all replicas and the gradients are
+all-reduced by the optimizer.
+``set_precision('mixed_bfloat16')`` computes in bfloat16 with float32 weights;
+it is fast on CPUs with AVX512-BF16 or AMX and slow elsewhere.
+
+``benchmark`` runs each mode in a fresh process on synthetic batches (or
+cached clips with ``--data``) and reports compile time, per-step time and
+peak memory.
+
+Usage:
+    python train.py --custom-loop --jit-compile --precision mixed_bfloat16
+    python train.py --bucket-sizes 60 75 90 120
+    python train_loop.py benchmark --steps 20 --batch-size 4
+    python train_loop.py benchmark --data data/s1 --modes float32 float32-xla
+"""
+import os
+import sys
+import json
+import math
+import time
+import resource
+import queue as queue_module
+import argparse
+import itertools
+import multiprocessing
+
+import numpy as np
+import tensorflow as tf
+
+from model import CTCLoss, CTCLossXLA, CTCLossWithLengths, ctc_neg_log_likelihood
+
+MODES = {
+    'float32': ('float32', False),
+    'float32-xla': ('float32', True),
+    'bfloat16': ('mixed_bfloat16', False),
+    'bfloat16-xla': ('mixed_bfloat16', True),
+}
+
+
+def cpu_supports_bf16() -> bool:
+    """Whether the CPU has native bfloat16 arithmetic (AVX512-BF16 or AMX)."""
+    try:
+        with open('/proc/cpuinfo', 'r') as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return 'avx512_bf16' in flags or 'amx_bf16' in flags
+
+
+def set_precision(policy: str = 'float32') -> None:
+    """Set the global Keras dtype policy; call before the model is built."""
+    if policy == 'mixed_bfloat16' and not cpu_supports_bf16() and not tf.config.list_physical_devices('GPU'):
+        print("Warning: this CPU has no native bfloat16 support; mixed_bfloat16 will be slower")
+    tf.keras.mixed_precision.set_global_policy(policy)
+
+
+def batch_loss(labels, y_pred, input_length=None, label_length=None, jit_compile: bool = False):
+    """Per-clip CTC loss, over the true lengths when they are given."""
+    if input_length is None:
+        return (CTCLossXLA if jit_compile else CTCLoss)(labels, y_pred)
+    if jit_compile:
+        return ctc_neg_log_likelihood(labels, y_pred, label_length, input_length)
+    return CTCLossWithLengths(labels, y_pred, input_length, label_length)
+
+
+def forward(model, frames, input_length=None, training=False):
+    if input_length is None:
+        return model(frames, training=training)
+    return model(frames, training=training, input_length=input_length)
+
+
+def mean_loss(per_clip, strategy=None):
+    # Under a strategy each replica divides by the global batch, so the summed gradients average
+    if strategy is None:
+        return tf.reduce_mean(per_clip)
+    return tf.nn.compute_average_loss(tf.reshape(per_clip, [-1]))
+
+
+def make_train_step(model, optimizer, jit_compile: bool = False, strategy=None):
+    """One optimizer step on a ``(frames, labels[, input_length, label_length])`` batch; returns the mean loss."""
+
+    # Traced once per batch shape; bucketing keeps that to a few frame counts
+    @tf.function(jit_compile=jit_compile)
+    def train_step(frames, labels, input_length=None, label_length=None):
+        with tf.GradientTape() as tape:
+            y_pred = forward(model, frames, input_length, training=True)
+            loss = mean_loss(batch_loss(labels, y_pred, input_length, label_length, jit_compile), strategy)
+        gradients = tape.gradient(loss, model.trainable_variables)
+        optimizer.apply_gradients(zip(gradients, model.trainable_variables))
+        return loss
+
+    if strategy is None:
+        return train_step
+
+    @tf.function
+    def distributed_train_step(*batch):
+        losses = strategy.run(train_step, args=batch)
+        return strategy.reduce(tf.distribute.ReduceOp.SUM, losses, axis=None)
+
+    return distributed_train_step
+
+
+def make_eval_step(model, jit_compile: bool = False, strategy=None):
+    """Mean loss and the softmax outputs of a batch, without updating the model."""
+
+    @tf.function(jit_compile=jit_compile)
+    def eval_step(frames, labels, input_length=None, label_length=None):
+        y_pred = forward(model, frames, input_length)
+        return mean_loss(batch_loss(labels, y_pred, input_length, label_length, jit_compile), strategy), y_pred
+
+    if strategy is None:
+        return eval_step
+
+    @tf.function
+    def distributed_eval_step(*batch):
+        loss, y_pred = strategy.run(eval_step, args=batch)
+        return strategy.reduce(tf.distribute.ReduceOp.SUM, loss, axis=None), y_pred
+
+    return distributed_eval_step
+
+
+def local_batches(strategy, *values) -> list:
+    """Split per-replica values into one tuple per replica on this worker."""
+    if strategy is None:
+        return [values]
+    return list(zip(*(strategy.experimental_local_results(value) for value in values)))
+
+
+def decode_batch(y_pred, labels, input_length=None, label_length=None) -> list:
+    """Greedy-decode a batch over each clip's frames; returns ``(reference, hypothesis)`` pairs."""
+    from ctc_decoder import greedy_decode_batch
+    from vocab import tokens_to_text
+
+    lengths = None if input_length is None else np.reshape(np.asarray(input_length), [-1])
+    hypotheses = greedy_decode_batch(np.asarray(y_pred), lengths)
+    labels = labels.numpy()
+    if label_length is None:
+        label_length = np.count_nonzero(labels, axis=1)
+    references = [tokens_to_text(label[:length]) for label, length in zip(labels, np.reshape(label_length, [-1]))]
+    return list(zip(references, hypotheses))
+
+
+def notebook_schedule(epoch: int, lr: float) -> float:
+    """The notebook's ``LearningRateScheduler``: constant for 30 epochs, then decays by exp(-0.1) per epoch."""
+    if epoch < 30:
+        return lr
+    return lr * math.exp(-0.1)
+
+
+class TrainingState:
+    """What a resumed run needs, kept by a ``tf.train.CheckpointManager``.
+
+    A checkpoint holds the model, the optimizer (its slots, iteration count
+    and current learning rate), the epoch, the batches done in that epoch, the
+    best validation loss and, when given, the ``pipeline.FileOrder`` of the
+    training input. Saves are asynchronous: variables are copied and written
+    in the background while training continues. Only the newest
+    ``max_to_keep`` checkpoints are kept. Without a ``directory`` nothing is
+    saved.
+
+    The model and optimizer must be built first: the checkpoint tracks their
+    underlying ``tf.Variable``s in creation order, since Keras variables do
+    not support asynchronous saving.
+    """
+
+    def __init__(self, model, optimizer, directory: str = None, max_to_keep: int = 3, file_order=None) -> None:
+        self.optimizer = optimizer
+        self.epoch = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self.step = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self.best_val_loss = tf.Variable(float('inf'), dtype=tf.float64, trainable=False)
+        self.manager = None
+        self.tracks_input = file_order is not None
+        if directory:
+            if not model.built or not optimizer.built:
+                raise ValueError("Build the model and optimizer before checkpointing the training state")
+            trackables = dict(model=[variable.value for variable in model.variables],
+                              optimizer=[variable.value for variable in optimizer.variables],
+                              epoch=self.epoch, step=self.step, best_val_loss=self.best_val_loss)
+            if file_order is not None:
+                trackables['input'] = file_order
+            self.checkpoint = tf.train.Checkpoint(**trackables)
+            self.manager = tf.train.CheckpointManager(self.checkpoint, directory, max_to_keep=max_to_keep)
+            self.options = tf.train.CheckpointOptions(experimental_enable_async_checkpoint=True)
+
+    def restore(self) -> bool:
+        """Load the latest checkpoint, if there is one."""
+        if self.manager is None or not self.manager.latest_checkpoint:
+            return False
+        self.checkpoint.restore(self.manager.latest_checkpoint)
+        print(f"Resuming from {self.manager.latest_checkpoint}: epoch {int(self.epoch) + 1}, "
+              f"{int(self.step)} batches into it")
+        return True
+
+    def save(self) -> None:
+        if self.manager is not None:
+            self.manager.save(checkpoint_number=int(self.optimizer.iterations.numpy()), options=self.options)
+
+    def sync(self) -> None:
+        """Wait for pending asynchronous saves to be written."""
+        if self.manager is not None:
+            self.checkpoint.sync()
+
+
+def fit(model, optimizer, train_dataset, val_dataset, epochs: int, batch_size: int,
+        jit_compile: bool = False, checkpoint_path: str = None, strategy=None,
+        steps_per_epoch: int = None, validation_steps: int = None, schedule=None,
+        state: TrainingState = None, save_every: int = None) -> list:
+    """Train like ``model.fit`` with a compiled step.
+
+    Saves weights to ``checkpoint_path`` whenever the validation loss improves
+    (the ``ModelCheckpoint`` settings ``train.py`` uses) and prints per-step
+    time, throughput and the greedy validation CER every epoch. Returns the
+    per-epoch losses and CER. ``schedule(epoch, lr)`` sets the learning rate at
+    the start of every epoch, like ``LearningRateScheduler``.
+
+    With a ``strategy`` the datasets are distributed, ``batch_size`` is the
+    global batch and the validation CER covers this worker's clips. Pass
+    ``steps_per_epoch`` and ``validation_steps`` to read epochs of that many
+    batches from repeating datasets, so every worker runs the same number of
+    collective steps.
+
+    ``state`` saves the full training state after every epoch and every
+    ``save_every`` steps; restore it before calling ``fit`` to continue where
+    it stopped. A training dataset without a checkpointed ``FileOrder`` is
+    resumed by skipping the batches the interrupted epoch had already done.
+    """
+    from evaluation import error_rates
+
+    state = state or TrainingState(model, optimizer)
+    train_step = make_train_step(model, optimizer, jit_compile, strategy)
+    eval_step = make_eval_step(model, jit_compile, strategy)
+    history = []
+    train_iterator = iter(train_dataset) if steps_per_epoch else None
+    val_iterator = iter(val_dataset) if validation_steps else None
+
+    for epoch in range(int(state.epoch), epochs):
+        done = int(state.step)
+        if schedule and done == 0:
+            optimizer.learning_rate.assign(schedule(epoch, float(optimizer.learning_rate.numpy())))
+        losses, step_times = [], []
+        start = time.perf_counter()
+        step_start = start
+        if steps_per_epoch:
+            train_batches = itertools.islice(train_iterator, steps_per_epoch - done)
+        elif done and not state.tracks_input:
+            train_batches = train_dataset.skip(done)
+        else:
+            train_batches = train_dataset
+        for batch in train_batches:
+            losses.append(float(train_step(*batch)))
+            state.step.assign_add(1)
+            if save_every and int(state.step) % save_every == 0:
+                state.save()
+            now = time.perf_counter()
+            step_times.append(now - step_start)
+            step_start = now
+        elapsed = time.perf_counter() - start
+        val_losses, pairs = [], []
+        val_batches = itertools.islice(val_iterator, validation_steps) if validation_steps else val_dataset
+        for batch in val_batches:
+            loss, y_pred = eval_step(*batch)
+            val_losses.append(float(loss))
+            for local in local_batches(strategy, y_pred, *batch[1:]):
+                pairs.extend(decode_batch(*local))
+
+        train_loss = float(np.mean(losses)) if losses else float('nan')
+        val_loss = float(np.mean(val_losses)) if val_losses else float('nan')
+        val_cer = error_rates(pairs)['cer'] if pairs else float('nan')
+        history.append({'loss': train_loss, 'val_loss': val_loss, 'val_cer': val_cer})
+        # The first step of a run includes tracing and compilation
+        steady = step_times[1:] or step_times or [0.0]
+        print(f"Epoch {epoch + 1}/{epochs}: loss {train_loss:.4f}, val_loss {val_loss:.4f}, val_cer {val_cer:.3f}, "
+              f"{np.median(steady) * 1000:.0f} ms/step, {len(losses) * batch_size / elapsed:.1f} clips/sec, "
+              f"peak RSS {peak_rss_mb():.0f} MiB")
+
+        best = float(state.best_val_loss)
+        if val_loss < best:
+            state.best_val_loss.assign(val_loss)
+            if checkpoint_path:
+                print(f"val_loss improved from {best:.4f} to {val_loss:.4f}, saving model to {checkpoint_path}")
+                model.save_weights(checkpoint_path)
+        state.epoch.assign(epoch + 1)
+        state.step.assign(0)
+        state.save()
+
+    state.sync()
+    return history
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def synthetic_batches(batch_size: int, seed: int = 0):
+    """An endless dataset of random normalized clips and full-length labels."""
+    rng = np.random.default_rng(seed)
+    frames = rng.standard_normal((batch_size, 75, 46, 140, 1)).astype(np.float32)
+    labels = rng.integers(1, 40, size=(batch_size, 40)).astype(np.int64)
+    return tf.data.Dataset.from_tensors((frames, labels)).repeat()
+
+
+def _benchmark_worker(mode: str, steps: int, batch_size: int, data: str, queue) -> None:
+    from utils import char_to_num
+    from model import LipNet
+
+    policy, jit_compile = MODES[mode]
+    baseline = peak_rss_mb()
+    set_precision(policy)
+    if data:
+        from crop_cache import collect_videos
+        from pipeline import make_dataset
+        dataset = make_dataset(collect_videos([data]), batch_size=batch_size).repeat()
+    else:
+        dataset = synthetic_batches(batch_size)
+
+    model = LipNet(vocab_size=char_to_num.vocabulary_size())
+    train_step = make_train_step(model, tf.keras.optimizers.Adam(learning_rate=0.0001), jit_compile)
+    step_times = []
+    for batch in dataset.take(steps + 1):
+        start = time.perf_counter()
+        float(train_step(*batch))
+        step_times.append(time.perf_counter() - start)
+
+    queue.put({
+        'mode': mode,
+        'first_step_s': step_times[0],
+        'step_ms_median': float(np.median(step_times[1:])) * 1000,
+        'step_ms_min': float(np.min(step_times[1:])) * 1000,
+        'clips_per_sec': batch_size / float(np.median(step_times[1:])),
+        'peak_rss_mb': peak_rss_mb(),
+        'rss_growth_mb': peak_rss_mb() - baseline,
+    })
+
+
+def benchmark(modes, steps: int = 20, batch_size: int = 4, data: str = None) -> list:
+    """Time ``steps`` training steps per mode, each in its own spawned process."""
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for mode in modes:
+        queue = context.Queue()
+        process = context.Process(target=_benchmark_worker, args=(mode, steps, batch_size, data, queue))
+        process.start()
+        process.join()
+        try:
+            results.append(queue.get(timeout=1))
+        except queue_module.Empty:
+            # XLA or bfloat16 kernels missing on this build, or out of memory
+            results.append({'mode': mode, 'error': f"exited with code {process.exitcode}"})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark compiled and mixed-precision LipNet training steps')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    bench_parser = subparsers.add_parser('benchmark', help='Per-step time and memory of every mode')
+    bench_parser.add_argument('--modes', nargs='+', choices=list(MODES), default=list(MODES), help='Modes to run')
+    bench_parser.add_argument('--steps', type=int, default=20, help='Timed steps per mode (after one warm-up)')
+    bench_parser.add_argument('--batch-size', type=int, default=4, help='Clips per step')
+    bench_parser.add_argument('--data', help='Directory of clips to train on (default: synthetic batches)')
+    bench_parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args()
+
+    print(f"Native bfloat16: {'yes' if cpu_supports_bf16() else 'no'}")
+    results = benchmark(args.modes, args.steps, args.batch_size, args.data)
+    print(f"\n{'mode':<14}{'first step s':>14}{'ms/step':>10}{'min ms':>10}{'clips/s':>10}{'peak MiB':>10}")
+    for row in results:
+        if 'error' in row:
+            print(f"{row['mode']:<14}  failed: {row['error']}")
+            continue
+        print(f"{row['mode']:<14}{row['first_step_s']:>14.1f}{row['step_ms_median']:>10.0f}{row['step_ms_min']:>10.0f}"
+              f"{row['clips_per_sec']:>10.2f}{row['peak_rss_mb']:>10.0f}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
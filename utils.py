@@ -1,10 +1,13 @@
 import os
 import cv2
+import numpy as np
 import tensorflow as tf
 from typing import List, Tuple
-
-# Define vocabulary
-VOCAB = [x for x in "abcdefghijklmnopqrstuvwxyz'?!123456789 "]
+from crop_cache import CropCache, cache_enabled
+import video
+import tracing
+from label_index import alignment_label
+from vocab import VOCAB
 
 # Create character to number and number to character layers
 char_to_num = tf.keras.layers.StringLookup(vocabulary=VOCAB, oov_token="")
@@ -12,32 +15,31 @@ num_to_char = tf.keras.layers.StringLookup(
     vocabulary=char_to_num.get_vocabulary(), oov_token="", invert=True
 )
 
+# Preprocessing that produced the cached crops; part of the cache key
+decoder = video.get_decoder()
+CROP_PARAMS = video.crop_params(decoder, 'cv2.COLOR_RGB2GRAY')
+
+crop_cache = CropCache() if cache_enabled() else None
+
+def read_mouth_crops(path: str) -> np.ndarray:
+    """Decode a video into its uint8 (T, 46, 140) mouth crops."""
+    return video.read_mouth_crops(path, color_code=cv2.COLOR_RGB2GRAY, decoder=decoder)
+
+@tracing.traced()
 def load_video(path: str) -> tf.Tensor:
     """Load and preprocess video frames."""
-    cap = cv2.VideoCapture(path)
-    frames = []
-    for _ in range(int(cap.get(cv2.CAP_PROP_FRAME_COUNT))):
-        ret, frame = cap.read()
-        frame = tf.image.rgb_to_grayscale(frame)
-        frames.append(frame[190:236, 80:220, :])
-    cap.release()
-    
-    frames = tf.convert_to_tensor(frames)
-    mean = tf.math.reduce_mean(frames)
-    std = tf.math.reduce_std(tf.cast(frames, tf.float32))
-    return tf.cast((frames - mean), tf.float32) / std
+    if crop_cache is not None:
+        crops = crop_cache.get_or_compute(path, CROP_PARAMS, read_mouth_crops)
+    else:
+        crops = read_mouth_crops(path)
+    return tf.convert_to_tensor(video.normalize_crops(crops))
 
+@tracing.traced()
 def load_alignments(path: str) -> tf.Tensor:
-    """Load and process alignment files."""
-    with open(path, 'r') as f:
-        lines = f.readlines()
-    tokens = []
-    for line in lines:
-        line = line.split()
-        if line[2] != 'sil':
-            tokens = [*tokens, ' ', line[2]]
-    return char_to_num(tf.reshape(tf.strings.unicode_split(tokens, input_encoding='UTF-8'), (-1)))[1:]
+    """Encoded label of an alignment file, looked up in the precompiled label index."""
+    return tf.convert_to_tensor(alignment_label(path), dtype=tf.int64)
 
+@tracing.traced()
 def load_data(path: str) -> Tuple[tf.Tensor, tf.Tensor]:
     """Load both video and alignment data."""
     if isinstance(path, bytes):
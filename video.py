@@ -0,0 +1,388 @@
+"""Shared video loading for training, the notebook and the Streamlit apps.
+
+Frames are cropped to the mouth window as they are decoded, written into a
+preallocated uint8 buffer and converted to grayscale in one vectorized pass
+over the whole clip. Normalization then happens in place on a single float32
+copy, so loading a clip costs a fixed number of allocations instead of
+several tensors per frame.
+
+Decoding goes through a pluggable backend:
+
+- ``opencv``: ``cv2.VideoCapture``, always available.
+- ``ffmpeg``: an ffmpeg subprocess that crops, and converts to gray when the
+  luminance is wanted, before anything crosses the pipe.
+- ``pyav``: PyAV with threaded decoding, reading the luma plane directly.
+
+The backend comes from the ``decoder`` argument, the ``LIPNET_DECODER``
+environment variable, or the choice saved by ``python video.py benchmark
+--save``, in that order, and falls back to OpenCV.
+
+Usage:
+    python video.py benchmark
+    python video.py benchmark data/s1/bbaf2n.mpg --repeats 20 --save
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import statistics
+
+import cv2
+import numpy as np
+
+import tracing
+
+# (top, bottom, left, right) of the GRID mouth region
+MOUTH_CROP = (190, 236, 80, 220)
+NUM_FRAMES = 75
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DECODER_CHOICE_PATH = os.path.join(BASE_DIR, '.cache', 'decoder.json')
+
+
+class Decoder:
+    """Decodes a video file into uint8 frames, optionally cropped at decode time."""
+
+    name = None
+    # True when the backend can hand back luminance without a BGR round trip
+    native_gray = False
+
+    @classmethod
+    def available(cls) -> bool:
+        return True
+
+    def read(self, path: str, crop=None, gray: bool = False) -> np.ndarray:
+        """Return ``(T, H, W, 3)`` BGR frames, or ``(T, H, W)`` luma with ``gray``.
+
+        ``crop`` is ``(top, bottom, left, right)``; None keeps the full frame.
+        """
+        raise NotImplementedError
+
+
+class OpenCVDecoder(Decoder):
+    name = 'opencv'
+
+    def read(self, path: str, crop=None, gray: bool = False) -> np.ndarray:
+        if gray:
+            raise ValueError("The OpenCV decoder only produces BGR frames")
+
+        cap = cv2.VideoCapture(path)
+        if not cap.isOpened():
+            raise ValueError(f"Could not open video file: {path}")
+
+        try:
+            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            if total_frames <= 0:
+                raise ValueError(f"Video file appears to be empty or corrupted: {path}")
+            top, bottom, left, right = crop or (0, int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                                                0, int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)))
+
+            frames = np.empty((total_frames, bottom - top, right - left, 3), dtype=np.uint8)
+            frame = None
+            count = 0
+            while count < total_frames:
+                # Reuse the decode buffer and keep only the crop window
+                ret, frame = cap.read(frame)
+                if not ret:
+                    break
+                if frame.shape[0] < bottom or frame.shape[1] < right:
+                    raise ValueError(f"Frame {count} too small ({frame.shape[0]}x{frame.shape[1]}) for crop {crop}: {path}")
+                frames[count] = frame[top:bottom, left:right]
+                count += 1
+        finally:
+            cap.release()
+
+        if count == 0:
+            raise ValueError(f"No valid frames were read from video: {path}")
+        return frames[:count]
+
+
+class FFmpegDecoder(Decoder):
+    """Streams raw frames out of an ffmpeg subprocess with the crop done inside ffmpeg.
+
+    ffmpeg takes its input file and filter graph on the command line and only
+    signals the end of a clip by closing the pipe, so one process decodes one
+    clip; a long-lived process would need a container per clip with no frame
+    boundary between clips. The pipe is read frame by frame straight into the
+    returned array, so the clip is never held twice in memory.
+    """
+
+    name = 'ffmpeg'
+    native_gray = True
+
+    @staticmethod
+    def executable():
+        return os.environ.get('LIPNET_FFMPEG') or shutil.which('ffmpeg')
+
+    @classmethod
+    def available(cls) -> bool:
+        return cls.executable() is not None
+
+    def read(self, path: str, crop=None, gray: bool = False) -> np.ndarray:
+        if not os.path.exists(path):
+            raise ValueError(f"Could not open video file: {path}")
+
+        filters = []
+        if crop:
+            top, bottom, left, right = crop
+            filters.append(f'crop={right - left}:{bottom - top}:{left}:{top}')
+            height, width = bottom - top, right - left
+        else:
+            height, width = self._frame_size(path)
+            if height <= 0 or width <= 0:
+                raise ValueError(f"Could not open video file: {path}")
+        pix_fmt = 'gray' if gray else 'bgr24'
+        filters.append(f'format={pix_fmt}')
+        frame_shape = (height, width) if gray else (height, width, 3)
+
+        command = [self.executable(), '-v', 'error', '-nostdin', '-threads', '1', '-i', path,
+                   '-vf', ','.join(filters), '-f', 'rawvideo', '-pix_fmt', pix_fmt, 'pipe:1']
+        # stderr goes to a file so a chatty ffmpeg cannot block on a full pipe while stdout is read
+        with tempfile.TemporaryFile() as stderr:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr)
+            try:
+                frames = self._read_frames(process.stdout, frame_shape)
+            finally:
+                process.stdout.close()
+                returncode = process.wait()
+            if returncode != 0:
+                stderr.seek(0)
+                message = stderr.read().decode(errors='replace').strip()[-500:]
+                raise ValueError(f"ffmpeg failed on {path}: {message}")
+
+        if len(frames) == 0:
+            raise ValueError(f"No valid frames were read from video: {path}")
+        return frames
+
+    @staticmethod
+    def _read_frames(stream, frame_shape) -> np.ndarray:
+        """Read whole frames from ``stream`` until EOF into a growing uint8 buffer."""
+        frames = np.empty((NUM_FRAMES,) + frame_shape, dtype=np.uint8)
+        count = 0
+        while True:
+            if count == len(frames):
+                frames = np.concatenate([frames, np.empty_like(frames)])
+            view = memoryview(frames[count]).cast('B')
+            filled = 0
+            while filled < len(view):
+                n = stream.readinto(view[filled:])
+                if not n:
+                    # EOF; a trailing partial frame is dropped
+                    return frames[:count]
+                filled += n
+            count += 1
+
+    @staticmethod
+    def _frame_size(path: str):
+        cap = cv2.VideoCapture(path)
+        try:
+            return int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        finally:
+            cap.release()
+
+
+class PyAVDecoder(Decoder):
+    """PyAV decoding on FFmpeg's frame/slice threads, cropping the luma plane in place."""
+
+    name = 'pyav'
+    native_gray = True
+
+    @classmethod
+    def available(cls) -> bool:
+        try:
+            import av  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def read(self, path: str, crop=None, gray: bool = False) -> np.ndarray:
+        import av
+
+        try:
+            container = av.open(path)
+        except (OSError, av.error.FFmpegError) as e:
+            raise ValueError(f"Could not open video file: {path} ({e})")
+
+        frames = []
+        limited_range = False
+        try:
+            stream = container.streams.video[0]
+            stream.thread_type = 'AUTO'
+            top, bottom, left, right = crop or (0, stream.codec_context.height, 0, stream.codec_context.width)
+            for frame in container.decode(stream):
+                if gray and frame.format.name in ('yuv420p', 'yuvj420p', 'yuv422p', 'yuv444p'):
+                    # The Y plane is the luminance; crop it without converting the frame
+                    plane = frame.planes[0]
+                    luma = np.frombuffer(plane, dtype=np.uint8).reshape(frame.height, plane.line_size)
+                    frames.append(luma[top:bottom, left:right].copy())
+                    limited_range = frame.format.name.startswith('yuv4') and frame.color_range != 2
+                elif gray:
+                    frames.append(frame.to_ndarray(format='gray')[top:bottom, left:right])
+                else:
+                    frames.append(frame.to_ndarray(format='bgr24')[top:bottom, left:right])
+        finally:
+            container.close()
+
+        if not frames:
+            raise ValueError(f"No valid frames were read from video: {path}")
+        frames = np.stack(frames)
+        if limited_range:
+            # Expand studio-swing luma (16..235) to full range in one LUT pass
+            cv2.LUT(frames, LIMITED_TO_FULL_RANGE, dst=frames)
+        return frames
+
+
+LIMITED_TO_FULL_RANGE = np.clip(np.rint((np.arange(256) - 16) * 255.0 / 219.0), 0, 255).astype(np.uint8)
+
+DECODERS = {decoder.name: decoder for decoder in (OpenCVDecoder, FFmpegDecoder, PyAVDecoder)}
+
+
+def saved_decoder_choice():
+    """Name of the backend saved by ``video.py benchmark --save``, if any."""
+    try:
+        with open(DECODER_CHOICE_PATH, 'r') as f:
+            return json.load(f).get('decoder')
+    except (OSError, ValueError):
+        return None
+
+
+def get_decoder(name: str = None) -> Decoder:
+    """Instantiate the requested, configured or fastest-known decoder backend."""
+    name = name or os.environ.get('LIPNET_DECODER') or saved_decoder_choice() or 'opencv'
+    if name not in DECODERS:
+        raise ValueError(f"Unknown decoder '{name}', choose from {sorted(DECODERS)}")
+    decoder = DECODERS[name]
+    if not decoder.available():
+        print(f"Warning: {name} decoder is not available, falling back to opencv")
+        decoder = OpenCVDecoder
+    return decoder()
+
+
+def crop_params(decoder: Decoder, gray: str = 'cv2.COLOR_BGR2GRAY') -> dict:
+    """Crop-cache key of ``read_mouth_crops`` with the GRID crop, ``decoder`` and the ``gray`` conversion.
+
+    Every loader that caches crops builds its key here, so the same
+    preprocessing always maps to the same cache entries.
+    """
+    return {'crop': list(MOUTH_CROP), 'gray': gray, 'decoder': decoder.name}
+
+
+def read_mouth_crops(path: str, crop=MOUTH_CROP, color_code: int = cv2.COLOR_RGB2GRAY,
+                     decoder: Decoder = None) -> np.ndarray:
+    """Decode a video into its uint8 ``(T, H, W)`` grayscale mouth crops.
+
+    ``color_code`` is applied to the BGR crops as they are. The default
+    ``COLOR_RGB2GRAY`` reproduces ``tf.image.rgb_to_grayscale`` on OpenCV's BGR
+    frames, which is what the notebook and ``train.py`` always did;
+    ``COLOR_BGR2GRAY`` gives the luminance the Streamlit apps use, which the
+    ffmpeg and PyAV backends produce without a BGR round trip.
+    """
+    decoder = decoder or get_decoder()
+    if color_code == cv2.COLOR_BGR2GRAY and decoder.native_gray:
+        with tracing.span('decode', decoder=decoder.name, gray=True):
+            return decoder.read(path, crop, gray=True)
+
+    with tracing.span('decode', decoder=decoder.name):
+        color = decoder.read(path, crop)
+    count, height, width = color.shape[:3]
+
+    # One color conversion for the whole clip, viewed as a single tall image
+    with tracing.span('grayscale'):
+        gray = np.empty((count, height, width), dtype=np.uint8)
+        cv2.cvtColor(np.ascontiguousarray(color).reshape(count * height, width, 3), color_code,
+                     dst=gray.reshape(count * height, width))
+    return gray
+
+
+def fit_frames(crops: np.ndarray, num_frames: int = NUM_FRAMES) -> np.ndarray:
+    """Sample evenly or repeat the last frame so ``crops`` has ``num_frames`` frames."""
+    if len(crops) == num_frames:
+        return crops
+    if len(crops) > num_frames:
+        indices = np.linspace(0, len(crops) - 1, num_frames, dtype=int)
+    else:
+        indices = np.minimum(np.arange(num_frames), len(crops) - 1)
+    return crops[indices]
+
+
+@tracing.traced('normalize')
+def normalize_crops(crops: np.ndarray, stretch: bool = False) -> np.ndarray:
+    """Return float32 ``(T, H, W, 1)`` frames with zero mean and unit variance.
+
+    With ``stretch=True`` every frame is first min-max stretched to 0..255 and
+    rounded, matching ``cv2.normalize(frame, None, 0, 255, cv2.NORM_MINMAX)``.
+    All arithmetic happens in place on the one float32 output buffer.
+    """
+    frames = np.empty(crops.shape + (1,), dtype=np.float32)
+    frames[..., 0] = crops
+
+    if stretch:
+        low = frames.min(axis=(1, 2, 3), keepdims=True)
+        high = frames.max(axis=(1, 2, 3), keepdims=True)
+        span = high - low
+        scale = np.divide(255.0, span, out=np.zeros_like(span), where=span > 0)
+        frames -= low
+        frames *= scale
+        np.rint(frames, out=frames)
+
+    # meanStdDev walks the buffer once without a float64 temporary
+    mean, std = cv2.meanStdDev(frames.reshape(-1, frames.shape[2]))
+    mean, std = float(mean[0, 0]), float(std[0, 0])
+    frames -= mean
+    if std > 0:
+        frames /= std
+    return frames
+
+
+def benchmark_decoders(path: str, repeats: int = 10) -> dict:
+    """Median seconds per mouth-crop decode of ``path`` for every available backend."""
+    results = {}
+    for name, decoder_class in DECODERS.items():
+        if not decoder_class.available():
+            print(f"{name:<8} not available")
+            continue
+        decoder = decoder_class()
+        read_mouth_crops(path, color_code=cv2.COLOR_BGR2GRAY, decoder=decoder)
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            read_mouth_crops(path, color_code=cv2.COLOR_BGR2GRAY, decoder=decoder)
+            timings.append(time.perf_counter() - start)
+        results[name] = statistics.median(timings)
+        print(f"{name:<8} {results[name] * 1000:8.1f} ms/clip")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Video decoder utilities')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    bench_parser = subparsers.add_parser('benchmark', help='Time every decoder backend and pick the fastest')
+    bench_parser.add_argument('video', nargs='?', default=os.path.join(BASE_DIR, 'data', 's1', 'bbaf2n.mpg'),
+                              help='Video to decode')
+    bench_parser.add_argument('--repeats', type=int, default=10, help='Timed decodes per backend')
+    bench_parser.add_argument('--save', action='store_true', help='Make the fastest backend the default')
+
+    args = parser.parse_args()
+
+    if args.command == 'benchmark':
+        if not os.path.exists(args.video):
+            print(f"Video not found: {args.video}")
+            return 1
+        results = benchmark_decoders(args.video, args.repeats)
+        fastest = min(results, key=results.get)
+        print(f"\nFastest decoder on this host: {fastest}")
+        if args.save:
+            os.makedirs(os.path.dirname(DECODER_CHOICE_PATH), exist_ok=True)
+            with open(DECODER_CHOICE_PATH, 'w') as f:
+                json.dump({'decoder': fastest, 'ms_per_clip': {k: v * 1000 for k, v in results.items()}}, f, indent=2)
+            print(f"Saved choice to {DECODER_CHOICE_PATH}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,35 @@
+"""The character vocabulary shared by training, decoding and the apps.
+
+Token 0 is the empty (out-of-vocabulary) string and ``VOCAB[i]`` is token
+``i + 1``: the numbering of ``tf.keras.layers.StringLookup(vocabulary=VOCAB,
+oov_token="")``, without needing TensorFlow to encode or decode text. The CTC
+blank is the class after the last token.
+
+Decoding goes through ``CHAR_CODES``, the ASCII code of every class (0 for
+the empty token and the blank), so a token array becomes text with one
+NumPy take and a bytes decode instead of a ``num_to_char`` lookup and a
+``tf.strings.reduce_join`` per sentence.
+"""
+import numpy as np
+
+VOCAB = [x for x in "abcdefghijklmnopqrstuvwxyz'?!123456789 "]
+CHARS = [''] + VOCAB
+CHAR_TO_INDEX = {char: index for index, char in enumerate(CHARS) if char}
+NUM_CLASSES = len(CHARS) + 1
+BLANK = NUM_CLASSES - 1
+SPACE = CHAR_TO_INDEX[' ']
+
+CHAR_CODES = np.zeros(NUM_CLASSES, dtype=np.uint8)
+CHAR_CODES[1:len(CHARS)] = [ord(char) for char in VOCAB]
+
+
+def encode_text(text: str) -> np.ndarray:
+    """uint8 tokens of ``text``; characters outside the vocabulary become 0."""
+    return np.fromiter((CHAR_TO_INDEX.get(char, 0) for char in text), dtype=np.uint8, count=len(text))
+
+
+def tokens_to_text(tokens) -> str:
+    """Text of a token array; the empty token, the blank and padding such as -1 are skipped."""
+    tokens = np.asarray(tokens).ravel()
+    tokens = tokens[(tokens > 0) & (tokens < len(CHARS))]
+    return CHAR_CODES[tokens].tobytes().decode('ascii')